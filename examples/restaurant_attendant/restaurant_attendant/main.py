@@ -3,16 +3,22 @@ from typing import List
 
 from whatsapp import Conversation, instruction
 from whatsapp._datastore import SQLiteDatastore
+from whatsapp.dataloader import DataLoader
 
 from restaurant_attendant.database import Products
 from restaurant_attendant.payments import Paystack
-from restaurant_attendant.tasks import job_thread, collection
+from restaurant_attendant.tasks import catalogue_sync, index
 
 
 WHATSAPP_TOKEN = os.environ.get("WHATSAPP_TOKEN", "")
 WHATSAPP_NUMBER = os.environ.get("WHATSAPP_NUMBER", "")
 PAYSTACK_SECRET_KEY = os.environ.get("PAYSTACK_SECRET_KEY", "")
 
+products = DataLoader(
+    lambda ids: {product.id: product for product in Products.from_ids(ids)},
+    scope="conversation",
+)
+
 
 class RestaurantAttendantConversation(Conversation):
     token = WHATSAPP_TOKEN
@@ -51,8 +57,7 @@ If there's any data that you need always ask the customer for it.
         """Create a payment link to pay for a list of products. Returns a link to the payment page."""
 
         price = float(0)
-        for product_id in product_ids:
-            product = Products.from_id(product_id)
+        for product in products.load_many(product_ids):
             price += float(product.price or 0.00)
         price_kobo = int(price * 100)
 
@@ -79,15 +84,11 @@ If there's any data that you need always ask the customer for it.
         """Executes a semantic search for products in the inventory that matches the query. Returns a list of products."""
 
         try:
-            results = collection.query(
-                n_results=5,
-                query_texts=[query],
-            )
-
-            products = []
-            for product_id in results["ids"][0]:
-                product = Products.from_id(product_id)
-                products.append({
+            ids = [product_id for product_id, _ in index.search(query, k=5)]
+
+            results = []
+            for product in products.load_many(ids):
+                results.append({
                     "id": product.id,
                     "name": product.name,
                     "price": product.price,
@@ -96,7 +97,7 @@ If there's any data that you need always ask the customer for it.
                     "description": product.description,
                 })
 
-            return products
+            return results
         except Exception as e:
             print(e)
             return str(e)
@@ -108,5 +109,5 @@ def main():
         gemini_model_name="models/gemini-1.5-pro",
         gemini_api_key=os.environ.get("GEMINI_API_KEY", ""),
     )
-    # job_thread.start()
+    catalogue_sync.schedule(chat_handler.scheduler, 40)
     chat_handler.start(5000)
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+genai = pytest.importorskip("google.generativeai")
+
+from whatsapp._types import AgentMessage
+from whatsapp.agent_interface import AgentInterface
+
+
+pytestmark = pytest.mark.benchmark
+
+ROUNDS = 200
+
+
+def _turn_parts():
+    call = genai.protos.Part(function_call=genai.protos.FunctionCall(
+        name="create_payment_link",
+        args={"email": "ada@example.com", "product_ids": ["12", "40", "41"]},
+    ))
+    responses = [
+        genai.protos.Part(function_response=genai.protos.FunctionResponse(
+            name="get_products",
+            response={"result": [
+                {"id": str(i), "name": f"Product {i}", "price": 2500 + i, "in_stock": True}
+                for i in range(20)
+            ]},
+        ))
+    ]
+    return call, responses
+
+
+@pytest.mark.parametrize("history_format", ["json", "protobuf"])
+def test_history_format_size_and_decode_time(history_format):
+    agent = AgentInterface("models/gemini-1.5-flash", "")
+    call, responses = _turn_parts()
+
+    messages = []
+    for type, parts in (("function_call", [call]), ("function_response", responses)):
+        data, payload = agent._encode_parts(type, parts, history_format)
+        messages.append(AgentMessage(
+            id="1", conversation_id=1, sender="model", type=type, data=data, payload=payload))
+    size = sum(len(m.data.encode()) + len(m.payload or b"") for m in messages)
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for message in messages:
+            agent._decode_parts(message)
+    per_turn = (time.perf_counter() - start) / ROUNDS
+
+    print(f"\n{history_format}: {size} bytes, {per_turn * 1e6:.0f}us to decode per turn")
+    decoded = [part for message in messages for part in agent._decode_parts(message)]
+    assert decoded[0].function_call.name == "create_payment_link"
+    assert decoded[1].function_response.response["result"][0]["name"] == "Product 0"
+    if history_format == "protobuf":
+        json_size = sum(len(agent._encode_parts(t, p, "json")[0].encode())
+                        for t, p in (("function_call", [call]), ("function_response", responses)))
+        assert size < json_size
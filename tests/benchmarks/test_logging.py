@@ -0,0 +1,126 @@
+import time
+import logging
+import logging.handlers
+from queue import Queue, SimpleQueue
+
+import pytest
+
+from whatsapp._logging import JsonFormatter, setup_logging
+from whatsapp.conversation_handler import ConversationHandler
+from whatsapp.events import Change, Message
+from whatsapp.reply_message import Message as ReplyMessage, Text
+
+
+pytestmark = pytest.mark.benchmark
+
+RECORDS = 20_000
+REQUESTS = 2_000
+CHANGE = {
+    "field": "messages",
+    "value": {
+        "metadata": {"phone_number_id": "111", "display_phone_number": "111"},
+        "contacts": [{"wa_id": "2348000000000", "profile": {"name": "Ada"}}],
+        "messages": [{"id": "wamid.1", "from": "2348000000000", "timestamp": "1700000000",
+                      "type": "text", "text": {"body": "Where is my order?"}}],
+    },
+}
+
+
+def _emit(logger):
+    start = time.perf_counter()
+    for i in range(RECORDS):
+        logger.info("Handled message %d for %s in %.2fs", i, "2348000000000", 0.25)
+    return (time.perf_counter() - start) / RECORDS
+
+
+def _logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def _json_file(path):
+    handler = logging.FileHandler(path)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def test_logging_cost_on_the_emitting_thread(tmp_path):
+    handler = _json_file(tmp_path / "inline.log")
+    inline = _emit(_logger("whatsapp.benchmark.inline", handler))
+    handler.close()
+
+    # The stdlib QueueHandler formats the record before enqueueing it
+    handler = _json_file(tmp_path / "stdlib.log")
+    queue: SimpleQueue = SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(queue)
+    queue_handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(queue, handler)
+    listener.start()
+    stdlib = _emit(_logger("whatsapp.benchmark.stdlib", queue_handler))
+    listener.stop()
+    handler.close()
+
+    handler = _json_file(tmp_path / "queued.log")
+    listener = setup_logging(handler=handler, logger_name="whatsapp.benchmark.queued")
+    queued = _emit(logging.getLogger("whatsapp.benchmark.queued"))
+    listener.stop()
+    handler.close()
+
+    print(f"\ninline JSON file:    {inline * 1e6:.1f}us per record"
+          f"\nstdlib QueueHandler: {stdlib * 1e6:.1f}us per record"
+          f"\nsetup_logging:       {queued * 1e6:.1f}us per record")
+    with open(tmp_path / "queued.log") as file:
+        assert sum(1 for _ in file) == RECORDS
+
+
+class Handler(ConversationHandler):
+    whatsapp_number = "111"
+    token = "token"
+
+    def on_message(self, message: Message):
+        self.dispatch(ReplyMessage(
+            to=message.to, type="text", text=Text(preview_url=False, body="hi")))
+
+
+def _requests_per_second(handler, change):
+    queue: Queue = Queue()
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        handler.handle_change(change, queue)
+        handler._handle_messages([queue.get()])
+    return REQUESTS / (time.perf_counter() - start)
+
+
+def test_request_throughput_with_logging_on_and_off(tmp_path):
+    change = Change(**CHANGE)
+    handler = Handler(start_proxy=False)
+    handler.dispatcher.submit = lambda message: None
+    logger = logging.getLogger("whatsapp")
+    level, propagate = logger.level, logger.propagate
+    results = {}
+    try:
+        logger.setLevel(logging.CRITICAL + 1)
+        results["off"] = _requests_per_second(handler, change)
+
+        for name in ("INFO", "DEBUG"):
+            file_handler = logging.FileHandler(tmp_path / f"{name}.log")
+            listener = setup_logging(level=getattr(logging, name), handler=file_handler)
+            results[name] = _requests_per_second(handler, change)
+            listener.stop()
+            file_handler.close()
+    finally:
+        for existing in list(logger.handlers):
+            if isinstance(existing, logging.handlers.QueueHandler):
+                logger.removeHandler(existing)
+        logger.setLevel(level)
+        logger.propagate = propagate
+        handler.dispatcher.shutdown()
+
+    print("".join(
+        f"\nlogging {name}: {rate:.0f} requests/s ({rate / results['off']:.0%} of off)"
+        for name, rate in results.items()))
+    with open(tmp_path / "DEBUG.log") as file:
+        assert sum(1 for _ in file) >= REQUESTS
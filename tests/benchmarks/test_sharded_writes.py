@@ -0,0 +1,47 @@
+import time
+import threading
+
+import pytest
+
+from whatsapp._datastore import ShardedSQLiteDatastore, SQLiteDatastore
+
+
+pytestmark = pytest.mark.benchmark
+
+THREADS = 8
+CUSTOMERS_PER_THREAD = 20
+MESSAGES_PER_CUSTOMER = 20
+
+
+def _write(datastore):
+    conversations = [
+        [datastore.create_conversation(f"{t}-{c}", 0) for c in range(CUSTOMERS_PER_THREAD)]
+        for t in range(THREADS)
+    ]
+
+    def worker(mine):
+        for i in range(MESSAGES_PER_CUSTOMER):
+            for conversation in mine:
+                datastore.add_chat_message(conversation.id, "customer", i, "Do you deliver to Lekki?")
+
+    threads = [threading.Thread(target=worker, args=(mine,)) for mine in conversations]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return THREADS * CUSTOMERS_PER_THREAD * MESSAGES_PER_CUSTOMER / (time.perf_counter() - start)
+
+
+@pytest.mark.parametrize("shards", [1, 4])
+def test_chat_message_write_throughput(tmp_path, shards):
+    if shards == 1:
+        datastore = SQLiteDatastore(str(tmp_path / "bot.db"))
+    else:
+        datastore = ShardedSQLiteDatastore(str(tmp_path / "bot.db"), shards=shards)
+
+    rate = _write(datastore)
+
+    print(f"\n{shards} shard(s), {THREADS} threads: {rate:.0f} messages/s")
+    total = sum(1 for _ in datastore.iter_chat_messages())
+    assert total == THREADS * CUSTOMERS_PER_THREAD * MESSAGES_PER_CUSTOMER
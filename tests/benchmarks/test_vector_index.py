@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from whatsapp.vector_index import VectorIndex
+
+
+pytestmark = pytest.mark.benchmark
+
+ITEMS = 2000
+DIMENSIONS = 768
+QUERIES = 200
+K = 5
+
+
+def _vectors(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((ITEMS, DIMENSIONS)).astype(np.float32)
+
+
+def _per_query(query):
+    queries = _vectors(seed=1)[:QUERIES]
+    start = time.perf_counter()
+    for vector in queries:
+        query(vector)
+    return (time.perf_counter() - start) / QUERIES
+
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_vector_index_query_latency(tmp_path, quantize):
+    vectors = _vectors()
+    ids = [str(i) for i in range(ITEMS)]
+    index = VectorIndex(str(tmp_path / "index"), quantize=quantize)
+    index.upsert(ids, vectors)
+
+    latency = _per_query(lambda vector: index.query(vector, K))
+
+    print(f"\nVectorIndex quantize={quantize}: {latency * 1e6:.0f}us per top-{K} query")
+    assert index.query(vectors[42], 1)[0][0] == "42"
+
+
+def test_chromadb_query_latency(tmp_path):
+    chromadb = pytest.importorskip("chromadb")
+
+    vectors = _vectors()
+    ids = [str(i) for i in range(ITEMS)]
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    collection = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+    for start in range(0, ITEMS, 500):
+        collection.add(ids=ids[start:start + 500], embeddings=vectors[start:start + 500].tolist())
+
+    latency = _per_query(
+        lambda vector: collection.query(query_embeddings=[vector.tolist()], n_results=K))
+
+    print(f"\nchromadb: {latency * 1e6:.0f}us per top-{K} query")
+    result = collection.query(query_embeddings=[vectors[42].tolist()], n_results=1)
+    assert result["ids"][0][0] == "42"
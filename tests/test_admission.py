@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+from whatsapp._admission import AdmissionController
+
+
+def _message(i):
+    return SimpleNamespace(to=str(i))
+
+
+def test_overload_limits():
+    admission = AdmissionController(max_queue_depth=10, max_queue_age=5, max_llm_in_flight=4)
+
+    assert not admission.is_overloaded(queue_depth=10, queue_age=5, llm_in_flight=3)
+    assert admission.is_overloaded(queue_depth=11, queue_age=0, llm_in_flight=0)
+    assert admission.is_overloaded(queue_depth=0, queue_age=6, llm_in_flight=0)
+    assert admission.is_overloaded(queue_depth=0, queue_age=0, llm_in_flight=4)
+
+
+def test_deferred_backlog_is_bounded_and_expires():
+    admission = AdmissionController(policy="defer", max_deferred=2, max_defer=0)
+
+    assert admission.defer(_message(0))
+    assert admission.defer(_message(1))
+    assert not admission.defer(_message(2))
+
+    assert [m.to for m in admission.take_expired()] == ["0", "1"]
+    assert admission.stats()["waiting"] == 0
+
+
+def test_readmission_is_limited_to_headroom():
+    admission = AdmissionController(max_queue_depth=10, max_llm_in_flight=4, policy="defer")
+    for i in range(20):
+        admission.defer(_message(i))
+
+    assert admission.headroom(queue_depth=12, llm_in_flight=0) == 0
+    assert admission.headroom(queue_depth=7, llm_in_flight=0) == 3
+    assert admission.headroom(queue_depth=0, llm_in_flight=2) == 2
+
+    ready = admission.take_ready(admission.headroom(queue_depth=7, llm_in_flight=0))
+    assert [m.to for m in ready] == ["0", "1", "2"]
+    assert admission.stats()["waiting"] == 17
+    assert admission.stats()["readmitted"] == 3
+
+
+def test_readmission_without_limits_is_capped_per_round():
+    admission = AdmissionController(max_queue_age=5, policy="defer", max_readmit=5)
+    for i in range(8):
+        admission.defer(_message(i))
+
+    assert len(admission.take_ready(admission.headroom(queue_depth=100, llm_in_flight=100))) == 5
+    assert len(admission.take_ready(admission.headroom(queue_depth=100, llm_in_flight=100))) == 3
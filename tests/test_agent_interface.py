@@ -0,0 +1,235 @@
+import threading
+
+import pytest
+
+genai = pytest.importorskip("google.generativeai")
+
+from whatsapp._datastore import SQLiteDatastore
+from whatsapp.agent_interface import AgentInterface
+
+
+class Agent(AgentInterface):
+    def __init__(self, datastore):
+        super().__init__("models/gemini-1.5-flash", "")
+        self.datastore = datastore
+
+
+def test_migrate_history_leaves_the_configured_format_alone(tmp_path):
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    conversation = agent.datastore.create_conversation("alice", 100)
+    part = genai.protos.Part(function_call=genai.protos.FunctionCall(
+        name="lookup", args={"order_id": "ORD-1"}))
+    data, payload = agent._encode_parts("function_call", [part])
+    agent.datastore.add_agent_message(conversation.id, "function_call", "model", data, payload)
+
+    encode = agent._encode_parts
+    formats = []
+
+    def spy(type, parts, history_format=None):
+        # What a turn running during the migration would write
+        formats.append(agent.history_format)
+        return encode(type, parts, history_format)
+
+    agent._encode_parts = spy
+    assert agent.migrate_history() == 1
+
+    assert formats == ["json"]
+    message, = agent.datastore.get_agent_messages(conversation.id)
+    assert message.payload is not None
+    assert agent._decode_parts(message)[0].function_call.args["order_id"] == "ORD-1"
+
+
+def test_turn_out_of_budget_falls_back(tmp_path):
+    from types import SimpleNamespace
+    from whatsapp._turn import TurnBudget
+
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    agent.turn_budget = TurnBudget(max_iterations=2)
+    conversation = agent.datastore.create_conversation("alice", 100)
+    calls = []
+
+    agent.model = lambda: SimpleNamespace(start_chat=lambda history: None)
+    agent._send_message = lambda session, content, force_text=False: calls.append(force_text)
+    # A model that asks for a tool on every iteration, even when told not to
+    agent._process_response = lambda id, res, allow_tools: (["lookup"], "", False, False)
+    agent._call_function = lambda fn: genai.protos.Part(
+        function_response=genai.protos.FunctionResponse(name="lookup", response={"ok": True}))
+
+    response, ended = agent.handler(conversation, "hi")
+
+    assert (response, ended) == (agent.budget_fallback_message, False)
+    assert calls == [False, False, True]
+    assert agent.turn_metrics.stats()["budget_hits"] == {"iterations": 1}
+    assert agent.turn_metrics.stats()["fallbacks"] == 1
+
+
+def _upload(monkeypatch, states):
+    from types import SimpleNamespace
+
+    files = iter(SimpleNamespace(name="files/1", state=SimpleNamespace(name=state),
+                                 mime_type="video/mp4", uri="uri") for state in states)
+    monkeypatch.setattr(genai, "upload_file", lambda path, mime_type: next(files))
+    monkeypatch.setattr(genai, "get_file", lambda name: next(files))
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+
+
+def test_failed_upload_raises(tmp_path, monkeypatch):
+    from whatsapp._multimodal import MediaPart, MediaUploadError
+
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    _upload(monkeypatch, ["PROCESSING", "FAILED"])
+
+    with pytest.raises(MediaUploadError):
+        agent._media_parts([MediaPart(mime_type="video/mp4", path=tmp_path / "a.mp4")])
+
+
+def test_upload_polling_stops_at_the_turn_deadline(tmp_path, monkeypatch):
+    from whatsapp._turn import TurnBudget, start_turn
+    from whatsapp._multimodal import MediaPart, MediaUploadError
+
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    agent.turn_budget = TurnBudget(deadline=10)
+    _upload(monkeypatch, ["PROCESSING"] * 1000)
+
+    with start_turn("1") as turn:
+        turn.started_at -= 10
+        with pytest.raises(MediaUploadError):
+            agent._media_parts([MediaPart(mime_type="video/mp4", path=tmp_path / "a.mp4")])
+
+
+class _HedgedModel:
+    """Chat model whose first request hangs until `release` is set."""
+
+    def __init__(self, fns=("lookup",)):
+        self.fns = list(fns)
+        self.sent = 0
+        self.release = threading.Event()
+
+    def start_chat(self, history=None):
+        from types import SimpleNamespace
+
+        model = self
+        chat = SimpleNamespace(model=model, history=list(history or []))
+
+        def send_message(content, **options):
+            model.sent += 1
+            attempt = model.sent
+            if attempt == 1:
+                model.release.wait(5)
+            chat.history = chat.history + [content, f"reply {attempt}"]
+            # Tools are asked for on the first iteration only
+            return SimpleNamespace(attempt=attempt, fns=model.fns if attempt <= 2 else [])
+
+        chat.send_message = send_message
+        return chat
+
+
+def _hedged_agent(tmp_path):
+    from whatsapp._hedging import HedgingPolicy
+
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    # Only the first request, which hangs, is slow enough to be hedged
+    agent.hedging = HedgingPolicy(min_delay=0.2, max_delay=0.2, budget=1.0)
+    return agent
+
+
+def test_hedged_send_keeps_only_the_winners_history(tmp_path):
+    agent = _hedged_agent(tmp_path)
+    model = _HedgedModel()
+    session = model.start_chat(history=["earlier"])
+
+    res = agent._send_message(session, "hi")
+    model.release.set()
+
+    assert res.attempt == 2
+    assert session.history == ["earlier", "hi", "reply 2"]
+    assert agent.hedging.stats()["hedge_wins"] == 1
+
+
+def test_hedged_turn_runs_each_tool_call_once(tmp_path):
+    agent = _hedged_agent(tmp_path)
+    model = _HedgedModel()
+    conversation = agent.datastore.create_conversation("alice", 100)
+    executed = []
+
+    agent.model = lambda: model
+    agent._process_response = lambda id, res, allow_tools: (res.fns, "done", not res.fns, False)
+    agent._call_function = lambda fn: executed.append(fn) or genai.protos.Part(
+        function_response=genai.protos.FunctionResponse(name=fn, response={"ok": True}))
+
+    response, ended = agent.handler(conversation, "where is my order?")
+    model.release.set()
+
+    # Both attempts of the first request asked for the tool, only the winner's ran
+    assert (response, ended) == ("done", False)
+    assert executed == ["lookup"]
+    assert model.sent == 3
+
+
+def test_hedged_send_raises_when_both_attempts_fail(tmp_path):
+    agent = _hedged_agent(tmp_path)
+    model = _HedgedModel()
+    session = model.start_chat()
+
+    def send_message(content, **options):
+        model.sent += 1
+        if model.sent == 1:
+            model.release.wait(5)
+            raise ValueError("bad request")
+        model.release.set()
+        raise ValueError("bad request")
+
+    model.start_chat = lambda history=None: type(session)(
+        model=model, history=list(history or []), send_message=send_message)
+
+    with pytest.raises(ValueError):
+        agent._send_message(session, "hi")
+    assert session.history == []
+
+
+def test_media_in_the_history_is_estimated_at_a_flat_rate(tmp_path):
+    from types import SimpleNamespace
+    from whatsapp._multimodal import MEDIA_TOKEN_ESTIMATE
+
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    image = genai.protos.Part(inline_data=genai.protos.Blob(
+        mime_type="image/jpeg", data=b"\xff" * 1024 * 1024))
+    history = [genai.protos.Content(role="user", parts=[image, genai.protos.Part(text="x" * 40)])]
+
+    tokens = agent._estimate_tokens(SimpleNamespace(history=history), "y" * 40)
+    assert MEDIA_TOKEN_ESTIMATE < tokens < MEDIA_TOKEN_ESTIMATE + 100
+
+
+def test_turn_goes_on_without_media_that_failed_to_upload(tmp_path):
+    from types import SimpleNamespace
+    from whatsapp._multimodal import MediaPart, MediaUploadError
+
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    conversation = agent.datastore.create_conversation("alice", 100)
+    sent = []
+
+    def media_parts(media):
+        raise MediaUploadError("files/1 failed processing")
+
+    agent._media_parts = media_parts
+    agent.model = lambda: SimpleNamespace(start_chat=lambda history: None)
+    agent._send_message = lambda session, content, force_text=False: sent.append(content)
+    agent._process_response = lambda id, res, allow_tools: ([], "Sorry, I can't open it", True, False)
+
+    media = [MediaPart(mime_type="video/mp4", path=tmp_path / "a.mp4")]
+    assert agent.handler(conversation, "what is this?", media) == ("Sorry, I can't open it", False)
+
+    assert sent == ["[attachment: video/mp4, could not be opened]\nwhat is this?"]
+    customer, = agent.datastore.get_agent_messages(conversation.id)
+    assert customer.data == sent[0]
+
+
+def test_model_warm_up_opens_the_generate_content_client(tmp_path):
+    from types import SimpleNamespace
+
+    agent = Agent(SQLiteDatastore(str(tmp_path / "bot.db")))
+    counted = []
+    agent._model = SimpleNamespace(count_tokens=counted.append)
+
+    agent._warm_up_model()
+    assert counted == ["warm-up"]
@@ -0,0 +1,119 @@
+import pytest
+
+from whatsapp._datastore import ShardedSQLiteDatastore, SQLiteDatastore
+
+DAY = 86400
+# 2024-01-01 and 2024-01-02, UTC
+FIRST, SECOND = 1704067200, 1704067200 + DAY
+
+
+@pytest.fixture(params=[False, True], ids=["same-file", "archive-file"])
+def datastore(request, tmp_path):
+    archive_path = str(tmp_path / "archive.db") if request.param else None
+    return SQLiteDatastore(str(tmp_path / "bot.db"), archive_path)
+
+
+def _conversation(datastore, customer_id, start, turns, tool_calls=0, duration=None):
+    conversation = datastore.create_conversation(customer_id, start)
+    for i in range(turns):
+        datastore.add_chat_message(conversation.id, "customer", start + i, "hi")
+        datastore.add_chat_message(conversation.id, "bot", start + i, "hello")
+    for _ in range(tool_calls):
+        datastore.add_agent_message(conversation.id, "function_call", "model", "{}")
+        datastore.add_agent_message(conversation.id, "function_response", "customer", "{}")
+    if duration is not None:
+        datastore.end_conversation(customer_id, start + duration)
+    return conversation
+
+
+def _fill(datastore):
+    return [
+        _conversation(datastore, "alice", FIRST + 10, turns=2, tool_calls=1, duration=300),
+        _conversation(datastore, "bob", FIRST + 20, turns=1, duration=100),
+        _conversation(datastore, "carol", SECOND + 10, turns=3, tool_calls=2),
+    ]
+
+
+def _daily(datastore):
+    return [vars(stats) for stats in datastore.get_daily_stats()]
+
+
+def test_summaries_follow_writes(datastore):
+    alice, _, carol = _fill(datastore)
+
+    stats = datastore.get_conversation_stats(alice.id)
+    assert (stats.day, stats.end_time) == ("2024-01-01", FIRST + 310)
+    assert (stats.customer_messages, stats.bot_messages, stats.tool_calls) == (2, 2, 1)
+    assert datastore.get_conversation_stats(carol.id).end_time is None
+
+    first, second = datastore.get_daily_stats()
+    assert vars(first) == {
+        "day": "2024-01-01",
+        "conversations": 2,
+        "ended_conversations": 2,
+        "customer_messages": 3,
+        "bot_messages": 3,
+        "tool_calls": 1,
+        "total_duration": 400,
+    }
+    assert first.average_turns == 1.5
+    assert first.average_duration == 200
+    assert (second.conversations, second.ended_conversations, second.tool_calls) == (1, 0, 2)
+
+    assert [s.day for s in datastore.get_daily_stats(since="2024-01-02")] == ["2024-01-02"]
+    assert [s.day for s in datastore.get_daily_stats(until="2024-01-02")] == ["2024-01-01"]
+
+
+def test_summaries_survive_archival_and_match_a_rebuild(datastore):
+    _fill(datastore)
+    before = _daily(datastore)
+
+    assert datastore.archive_conversations(ended_before=SECOND) == 2
+    assert _daily(datastore) == before
+
+    datastore.rebuild_analytics()
+    assert _daily(datastore) == before
+
+
+def test_existing_history_is_summarized_on_first_open(tmp_path):
+    path = str(tmp_path / "bot.db")
+    datastore = SQLiteDatastore(path)
+    _fill(datastore)
+    before = _daily(datastore)
+    datastore.conn.execute("DROP TABLE daily_stats")
+    datastore.conn.execute("DROP TABLE conversation_stats")
+    datastore.conn.commit()
+    datastore.conn.close()
+
+    assert _daily(SQLiteDatastore(path)) == before
+
+
+def test_sharded_daily_stats_add_up_across_shards(tmp_path):
+    datastore = ShardedSQLiteDatastore(str(tmp_path / "bot.db"), shards=4)
+    conversations = _fill(datastore)
+    customers = {c.customer_id for c in conversations}
+    assert len({datastore._customer_shard(c)[0] for c in customers}) > 1
+
+    single = SQLiteDatastore(str(tmp_path / "single.db"))
+    _fill(single)
+    assert _daily(datastore) == _daily(single)
+
+    stats = datastore.get_conversation_stats(conversations[0].id)
+    assert stats.conversation_id == conversations[0].id
+    assert stats.tool_calls == 1
+
+    datastore.rebuild_analytics()
+    assert _daily(datastore) == _daily(single)
+
+
+def test_archive_file_keeps_a_rollback_journal(tmp_path):
+    path = str(tmp_path / "bot.db")
+    datastore = SQLiteDatastore(path)
+    assert datastore.conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    datastore.conn.close()
+
+    # A database that ran in WAL mode is switched back
+    datastore = SQLiteDatastore(path, str(tmp_path / "archive.db"))
+    for schema in ("main", "archive"):
+        mode, = datastore.conn.execute(f"PRAGMA {schema}.journal_mode").fetchone()
+        assert mode == "delete"
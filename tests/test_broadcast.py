@@ -0,0 +1,67 @@
+import json
+from types import SimpleNamespace
+
+from whatsapp.events import Status
+from whatsapp.broadcast import Broadcast
+from whatsapp.message import Language, Template
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class Handler:
+    url = "https://graph.example"
+    whatsapp_number = "123"
+    token = "token"
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+        self.http = SimpleNamespace(post=self.post)
+
+    def post(self, url, headers, json):
+        self.calls.append(json["to"])
+        return self.responses[json["to"]].pop(0)
+
+
+def _broadcast(responses, **options):
+    handler = Handler(responses)
+    template = Template(name="promo", language=Language(code="en"))
+    return Broadcast(handler, template, messages_per_second=1000, max_workers=1, **options), handler
+
+
+def _accepted(id):
+    return Response(200, json.dumps({"messages": [{"id": id}]}))
+
+
+def test_unreadable_responses_count_as_failed():
+    broadcast, handler = _broadcast({
+        "1": [_accepted("wamid.1")],
+        "2": [Response(200, "<html>")],
+        "3": [Response(400, "<html>")],
+        "4": [Response(400, json.dumps({"error": {"code": 131026}}))],
+    })
+    result = broadcast.run(["1", "2", "3", "4"])
+
+    assert (result.sent, result.failed) == (1, 3)
+    assert result.errors == {"invalid_response": 1, "400": 1, "131026": 1}
+    # An accepted send is never sent twice
+    assert handler.calls.count("2") == 1
+
+
+def test_statuses_are_counted_until_the_window_closes():
+    broadcast, _ = _broadcast({"1": [_accepted("wamid.1")]}, status_window=0)
+    status = Status(id="wamid.1", status="delivered", timestamp="0", recipient_id="1")
+
+    assert not broadcast.is_expired()
+    broadcast.run(["1"])
+    assert broadcast.record_status(status)
+    assert broadcast.result.statuses == {"delivered": 1}
+    assert broadcast.is_expired()
@@ -0,0 +1,58 @@
+import threading
+from types import SimpleNamespace
+
+from whatsapp._coalescer import MessageCoalescer
+
+
+def _coalescer(window_ms=50, max_messages=10):
+    batches = []
+    done = threading.Event()
+
+    def handle(batch):
+        batches.append([message.id for message in batch])
+        done.set()
+
+    def submit(func):
+        threading.Thread(target=func).start()
+
+    return MessageCoalescer(handle, submit, window_ms, max_messages), batches, done
+
+
+def _message(id, to="123"):
+    return SimpleNamespace(id=id, to=to)
+
+
+def test_messages_within_the_window_are_flushed_together():
+    coalescer, batches, done = _coalescer()
+    for i in range(3):
+        coalescer.add(_message(i))
+
+    assert done.wait(1)
+    assert batches == [[0, 1, 2]]
+    assert coalescer.stats() == {"received": 3, "batches": 1, "coalesced": 2}
+
+
+def test_full_batch_is_flushed_without_waiting():
+    coalescer, batches, done = _coalescer(window_ms=10_000, max_messages=2)
+    coalescer.add(_message(0))
+    coalescer.add(_message(1))
+
+    assert done.wait(1)
+    assert batches == [[0, 1]]
+
+
+def test_superseded_timer_does_not_flush():
+    coalescer, batches, done = _coalescer(window_ms=10_000)
+    coalescer.add(_message(0))
+    stale = coalescer._customers["123"].generation
+    coalescer.add(_message(1))
+    current = coalescer._customers["123"].generation
+    coalescer._customers["123"].timer.cancel()
+
+    # A timer that fired while add() was cancelling it
+    coalescer._on_window_closed("123", stale)
+    assert not done.wait(0.1)
+
+    coalescer._on_window_closed("123", current)
+    assert done.wait(1)
+    assert batches == [[0, 1]]
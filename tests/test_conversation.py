@@ -0,0 +1,125 @@
+from whatsapp import Conversation, intent
+from whatsapp._datastore import SQLiteDatastore
+from whatsapp._turn import current_turn
+
+
+def _bot(tmp_path, **kwargs):
+    class Bot(Conversation):
+        whatsapp_number = "111"
+        token = "token"
+        datastore = SQLiteDatastore(str(tmp_path / "bot.db"))
+
+    return Bot(start_proxy=False, media_root=str(tmp_path / "media"), **kwargs)
+
+
+def test_archival_runs_a_bounded_number_of_batches(tmp_path):
+    bot = _bot(tmp_path, archive_after=0, archive_batches_per_run=3)
+    batches = []
+    # A backlog that never runs out
+    bot.datastore.archive_conversations = lambda ended_before: batches.append(ended_before) or 500
+
+    bot._archive_conversations()
+    assert len(batches) == 3
+
+
+def test_archival_stops_when_the_backlog_is_done(tmp_path):
+    bot = _bot(tmp_path, archive_after=0)
+    for customer in ("alice", "bob"):
+        bot.datastore.create_conversation(customer, 100, "111")
+        bot.datastore.end_conversation(customer, 200, "111")
+
+    bot._archive_conversations()
+    assert bot.datastore.archive_conversations(ended_before=10 ** 10) == 0
+
+
+class Shop(Conversation):
+    whatsapp_number = "111"
+    token = "token"
+
+    @intent(keywords=["hours"])
+    def hours(self, text: str) -> str:
+        return "9 to 5"
+
+
+def _shop(tmp_path, tools=()):
+    Shop.datastore = SQLiteDatastore(str(tmp_path / "shop.db"))
+    shop = Shop(start_proxy=False, media_root=str(tmp_path / "media"), response_cache_ttl=60)
+    shop.turns = []
+
+    def handler(conversation, text, media=()):
+        # Stands in for the model, runs a tool when the text names one
+        turn = current_turn()
+        turn.iterations += 1
+        turn.tool_calls += sum(tool in text for tool in tools)
+        shop.turns.append(text)
+        return f"reply {len(shop.turns)}", False
+
+    shop.handler = handler
+    return shop
+
+
+def _first_turn(shop, customer, text):
+    conversation = shop.datastore.create_conversation(customer, 100, "111")
+    return shop._respond(conversation, text, is_new_conversation=True)
+
+
+def test_intents_answer_before_the_cache_and_the_model(tmp_path):
+    shop = _shop(tmp_path)
+    shop.response_cache.put("What are your hours?", "cached", False)
+
+    assert _first_turn(shop, "alice", "What are your hours?") == ("9 to 5", False)
+    assert shop.turns == []
+    conversation = shop.datastore.get_current_conversation("alice", "111")
+    assert [m.data for m in shop.datastore.get_agent_messages(conversation.id)] == [
+        "What are your hours?", "9 to 5"]
+
+
+def test_first_turn_replies_are_cached(tmp_path):
+    shop = _shop(tmp_path)
+
+    assert _first_turn(shop, "alice", "Do you deliver?") == ("reply 1", False)
+    assert _first_turn(shop, "bob", "do you deliver") == ("reply 1", False)
+    assert shop.turns == ["Do you deliver?"]
+
+    # Later turns depend on the history and always go to the model
+    conversation = shop.datastore.get_current_conversation("bob", "111")
+    assert shop._respond(conversation, "do you deliver", is_new_conversation=False) == (
+        "reply 2", False)
+
+
+def test_replies_that_ran_tools_are_not_cached(tmp_path):
+    shop = _shop(tmp_path, tools=["order"])
+
+    _first_turn(shop, "alice", "Where is my order?")
+    _first_turn(shop, "bob", "Where is my order?")
+    assert len(shop.turns) == 2
+
+
+def test_routing_stats(tmp_path):
+    shop = _shop(tmp_path)
+    _first_turn(shop, "alice", "hours?")
+    _first_turn(shop, "bob", "Do you deliver?")
+    _first_turn(shop, "carol", "Do you deliver?")
+    _first_turn(shop, "dave", "Do you deliver?")
+
+    assert shop.routing_stats() == {
+        "intent_hits": 1,
+        "cache_hits": 2,
+        "llm_turns": 1,
+        "llm_calls_saved": 3,
+        "hit_rate": 0.75,
+    }
+
+
+def test_start_warms_up_before_restoring_sends_and_scheduling(tmp_path):
+    bot = _bot(tmp_path)
+    calls = []
+    bot.warm_up = lambda: calls.append("warm_up")
+    bot.dispatcher.restore = lambda: calls.append("restore")
+    bot.scheduler.start = lambda: calls.append("scheduler")
+    bot._handle_new_message = lambda: calls.append("inbox")
+    bot.create_server = lambda queue, host, port: calls.append("server")
+
+    bot.start()
+    assert calls[:3] == ["warm_up", "restore", "scheduler"]
+    assert sorted(calls[3:]) == ["inbox", "server"]
@@ -0,0 +1,42 @@
+from queue import Queue
+
+from whatsapp.events import Change
+from whatsapp.conversation_handler import ConversationHandler
+
+
+class Handler(ConversationHandler):
+    whatsapp_number = "111"
+    token = "token"
+
+    def on_message(self, message):
+        pass
+
+
+def _change(*messages):
+    return Change(**{
+        "field": "messages",
+        "value": {
+            "metadata": {"phone_number_id": "111", "display_phone_number": "111"},
+            "contacts": [{"wa_id": "alice", "profile": {"name": "Alice"}}],
+            "messages": list(messages),
+        },
+    })
+
+
+def test_media_messages_are_queued_once_after_download(tmp_path):
+    handler = Handler(start_proxy=False, media_root=str(tmp_path))
+    downloaded = tmp_path / "photo.jpg"
+    handler._download_media = lambda media_id, mime_type, sha256=None: downloaded
+    change = _change(
+        {"id": "1", "from": "alice", "timestamp": "1", "type": "text", "text": {"body": "hi"}},
+        {"id": "2", "from": "alice", "timestamp": "2", "type": "image",
+         "image": {"id": "m1", "sha256": "0", "mime_type": "image/jpeg", "caption": "this one"}},
+    )
+
+    queue = Queue()
+    handler.handle_change(change, queue)
+
+    queued = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert [message.type for message in queued] == ["text", "image"]
+    assert queued[1].message.file == downloaded
+    handler.dispatcher.shutdown()
@@ -0,0 +1,87 @@
+from whatsapp._turn import start_turn
+from whatsapp.dataloader import DataLoader
+
+
+def _loader(**kwargs):
+    batches = []
+
+    def fetch(keys):
+        batches.append(keys)
+        return {key: key.upper() for key in keys if key != "missing"}
+
+    return DataLoader(fetch, **kwargs), batches
+
+
+def test_keys_are_fetched_in_batches_and_returned_in_order():
+    loader, batches = _loader(max_batch_size=2)
+
+    with start_turn("1"):
+        assert loader.load_many(["c", "a", "missing", "b"]) == ["C", "A", None, "B"]
+
+    assert batches == [["c", "a"], ["missing", "b"]]
+    assert loader.stats() == {"batches": 2, "hits": 0, "misses": 4}
+
+
+def test_records_are_cached_for_the_turn():
+    loader, batches = _loader()
+
+    with start_turn("1"):
+        loader.load_many(["a", "b"])
+        assert loader.load("a") == "A"
+        assert loader.load_many(["b", "c"]) == ["B", "C"]
+    with start_turn("1"):
+        loader.load("a")
+
+    assert batches == [["a", "b"], ["c"], ["a"]]
+    assert loader.stats() == {"batches": 3, "hits": 2, "misses": 4}
+
+
+def test_conversation_scope_keeps_records_across_turns():
+    loader, batches = _loader(scope="conversation")
+
+    with start_turn("1"):
+        loader.load("a")
+    with start_turn("1"):
+        loader.load("a")
+    with start_turn("2"):
+        loader.load("a")
+
+    assert batches == [["a"], ["a"]]
+
+
+def test_duplicate_keys_are_fetched_and_counted_once():
+    loader, batches = _loader()
+
+    with start_turn("1"):
+        assert loader.load_many(["a", "a", "b", "a"]) == ["A", "A", "B", "A"]
+        assert loader.load_many(["a", "a"]) == ["A", "A"]
+
+    assert batches == [["a", "b"]]
+    assert loader.stats() == {"batches": 1, "hits": 1, "misses": 2}
+
+
+def test_nothing_is_cached_outside_a_turn():
+    loader, batches = _loader()
+
+    loader.load("a")
+    loader.load("a")
+    assert batches == [["a"], ["a"]]
+
+
+def test_primed_records_are_not_fetched():
+    loader, batches = _loader()
+
+    with start_turn("1"):
+        loader.prime("a", "primed")
+        assert loader.load("a") == "primed"
+    assert batches == []
+
+
+def test_oldest_scopes_are_dropped():
+    loader, batches = _loader(scope="conversation", max_scopes=2)
+
+    for conversation_id in ("1", "2", "3", "1"):
+        with start_turn(conversation_id):
+            loader.load("a")
+
+    assert len(batches) == 4
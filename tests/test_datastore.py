@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from whatsapp._datastore import SQLiteDatastore
+
+
+@pytest.fixture(params=[False, True], ids=["same-file", "archive-file"])
+def datastore(request, tmp_path):
+    archive_path = str(tmp_path / "archive.db") if request.param else None
+    return SQLiteDatastore(str(tmp_path / "bot.db"), archive_path)
+
+
+def _conversation(datastore, customer_id, start, messages):
+    conversation = datastore.create_conversation(customer_id, start)
+    for i, text in enumerate(messages):
+        datastore.add_chat_message(conversation.id, "customer", start + i, text)
+        datastore.add_agent_message(conversation.id, "text", "customer", text)
+    return conversation
+
+
+def test_iterators_page_over_hot_and_archived_messages(datastore):
+    _conversation(datastore, "alice", 100, ["a1", "a2", "a3"])
+    _conversation(datastore, "bob", 101, ["b1", "b2"])
+    datastore.end_conversation("alice", 200)
+    assert datastore.archive_conversations(ended_before=300) == 1
+
+    messages = [m.message for m in datastore.iter_chat_messages(batch_size=2)]
+    assert messages == ["a1", "a2", "b1", "a3", "b2"]
+
+    hot = [m.message for m in datastore.iter_chat_messages(batch_size=2, include_archived=False)]
+    assert hot == ["b1", "b2"]
+
+    alice = [m.message for m in datastore.iter_chat_messages(customer_id="alice", since=101)]
+    assert alice == ["a2", "a3"]
+
+    agent = [m.data for m in datastore.iter_agent_messages(batch_size=2)]
+    assert agent == ["a1", "a2", "a3", "b1", "b2"]
+
+
+def test_exports_include_archived_messages(datastore, tmp_path):
+    _conversation(datastore, "alice", 100, ["a1", "a2"])
+    datastore.end_conversation("alice", 200)
+    datastore.archive_conversations(ended_before=300)
+    _conversation(datastore, "alice", 400, ["a3"])
+
+    path = tmp_path / "chat.jsonl"
+    assert datastore.export_chat_messages(str(path), batch_size=1) == 3
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [row["message"] for row in rows] == ["a1", "a2", "a3"]
+
+    path = tmp_path / "agent.jsonl"
+    assert datastore.export_agent_messages(str(path), include_archived=False) == 1
+
+
+def test_archived_conversation_keeps_its_history(datastore):
+    conversation = _conversation(datastore, "alice", 100, ["a1", "a2"])
+    datastore.end_conversation("alice", 200)
+    datastore.archive_conversations(ended_before=300)
+
+    assert [m.message for m in datastore.get_chat_messages(conversation.id)] == ["a1", "a2"]
+    assert [m.data for m in datastore.get_agent_messages(conversation.id)] == ["a1", "a2"]
+
+
+def test_warm_up_does_not_take_the_write_lock(datastore):
+    import threading
+
+    _conversation(datastore, "alice", 100, ["a1"])
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with datastore.lock:
+            locked.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait(5)
+    try:
+        done = threading.Thread(target=datastore.warm_up)
+        done.start()
+        done.join(5)
+        assert not done.is_alive()
+    finally:
+        release.set()
+        holder.join()
+
+    SQLiteDatastore(":memory:").warm_up()
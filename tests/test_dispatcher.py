@@ -0,0 +1,57 @@
+import time
+
+from whatsapp._datastore import SQLiteDatastore
+from whatsapp._dispatcher import SendDispatcher
+from whatsapp.reply_message import Message, Text
+
+
+def _message(to: str, body: str) -> Message:
+    return Message(to=to, type="text", text=Text(preview_url=False, body=body))
+
+
+def test_restore_delivers_pending_sends_in_order(tmp_path):
+    datastore = SQLiteDatastore(str(tmp_path / "bot.db"))
+    for body in ("first", "second"):
+        datastore.add_pending_send("123", _message("123", body).model_dump_json(), 0)
+
+    delivered = []
+    dispatcher = SendDispatcher(
+        lambda message: delivered.append(message.text.body) or True, datastore)
+    dispatcher.restore()
+    dispatcher.shutdown()
+
+    assert delivered == ["first", "second"]
+    assert datastore.get_pending_sends() == []
+    assert dispatcher.stats()["sent"] == 2
+
+
+def test_exhausted_sends_are_kept_and_can_be_resent(tmp_path):
+    datastore = SQLiteDatastore(str(tmp_path / "bot.db"))
+    accept = False
+
+    def send(message):
+        if not accept:
+            raise ConnectionError("Graph API unreachable")
+        return True
+
+    dispatcher = SendDispatcher(send, datastore, max_retries=1, backoff=0)
+    dispatcher.submit(_message("123", "hello"))
+    while dispatcher.stats()["pending"]:
+        time.sleep(0.01)
+
+    failed = datastore.get_failed_sends()
+    assert [send.error for send in failed] == ["Graph API unreachable"]
+    assert datastore.get_pending_sends() == []
+
+    # Failed sends are not picked up again on restart
+    restarted = SendDispatcher(send, datastore)
+    restarted.restore()
+    assert restarted.stats()["pending"] == 0
+
+    accept = True
+    assert dispatcher.resend_failed() == 1
+    dispatcher.shutdown()
+
+    assert datastore.get_failed_sends() == []
+    assert datastore.get_pending_sends() == []
+    assert dispatcher.stats()["sent"] == 1
@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+
+from whatsapp._hedging import HedgingPolicy
+
+
+def _policy(**kwargs):
+    # Hedges after 10ms until enough latencies have been seen
+    return HedgingPolicy(**{"min_delay": 0.01, "max_delay": 0.01, "budget": 1.0, **kwargs})
+
+
+def _slow(result, release, error=None):
+    def call():
+        release.wait(5)
+        if error:
+            raise error
+        return result
+    return call
+
+
+def _fast(result, error=None, calls=None):
+    def call():
+        if calls is not None:
+            calls.append(result)
+        if error:
+            raise error
+        return result
+    return call
+
+
+def test_fast_requests_are_not_hedged():
+    policy = _policy(min_delay=5, max_delay=5)
+    hedges = []
+
+    assert policy.run(_fast("primary"), _fast("hedge", calls=hedges)) == "primary"
+    assert hedges == []
+    assert policy.stats() == {"requests": 1, "hedges": 0, "hedge_wins": 0, "hedge_rate": 0.0}
+
+
+def test_slow_request_is_hedged_and_the_first_result_wins():
+    policy = _policy()
+    release = threading.Event()
+
+    assert policy.run(_slow("primary", release), _fast("hedge")) == "hedge"
+    release.set()
+    assert policy.stats()["hedges"] == 1
+    assert policy.stats()["hedge_wins"] == 1
+
+
+def test_primary_can_still_win_after_the_hedge_fired():
+    policy = _policy()
+    release = threading.Event()
+    hedge_release = threading.Event()
+
+    def primary():
+        release.wait(5)
+        return "primary"
+
+    def hedge():
+        # Lets the primary finish first
+        release.set()
+        hedge_release.wait(5)
+        return "hedge"
+
+    assert policy.run(primary, hedge) == "primary"
+    hedge_release.set()
+    assert policy.stats()["hedges"] == 1
+    assert policy.stats()["hedge_wins"] == 0
+
+
+def test_hedges_stay_within_the_budget():
+    policy = _policy(budget=0.5)
+    hedges = []
+
+    def primary():
+        # Slower than the hedge delay, but always answers
+        threading.Event().wait(0.03)
+        return "primary"
+
+    for _ in range(4):
+        policy.run(primary, _fast("hedge", calls=hedges))
+
+    assert len(hedges) == 2
+    assert policy.stats()["hedge_rate"] == 0.5
+
+
+def test_no_budget_waits_for_the_primary():
+    policy = _policy(budget=0)
+    hedges = []
+
+    def primary():
+        threading.Event().wait(0.03)
+        return "primary"
+
+    assert policy.run(primary, _fast("hedge", calls=hedges)) == "primary"
+    assert hedges == []
+
+
+def test_a_failed_attempt_loses_to_one_that_succeeds():
+    policy = _policy()
+    release = threading.Event()
+
+    def primary():
+        release.wait(5)
+        raise ConnectionError("reset")
+
+    def hedge():
+        release.set()
+        return "hedge"
+
+    assert policy.run(primary, hedge) == "hedge"
+
+
+def test_error_is_raised_when_both_attempts_fail():
+    policy = _policy()
+    release = threading.Event()
+
+    def hedge():
+        release.set()
+        raise ValueError("hedge failed")
+
+    with pytest.raises((ConnectionError, ValueError)):
+        policy.run(_slow(None, release, ConnectionError("reset")), hedge)
+
+
+def test_fast_failure_is_raised_without_hedging():
+    policy = _policy(min_delay=5, max_delay=5)
+    hedges = []
+
+    with pytest.raises(ConnectionError):
+        policy.run(_fast(None, ConnectionError("reset")), _fast("hedge", calls=hedges))
+    assert hedges == []
+
+
+def test_delay_follows_observed_latencies():
+    policy = HedgingPolicy(percentile=50, min_delay=0.1, max_delay=5, min_samples=3)
+    assert policy.delay() == 5
+
+    policy._latencies.extend([1.0, 2.0, 3.0])
+    assert policy.delay() == 2.0
+    policy._latencies.extend([0.01] * 10)
+    assert policy.delay() == 0.1
@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+from whatsapp._limiter import CircuitBreaker, CircuitOpenError, GeminiLimiter
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+def _fail(error):
+    def call():
+        raise error
+    return call
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one trial call is let through
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0)
+    breaker.state = "open"
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_limiter_rejects_while_open():
+    limiter = GeminiLimiter(max_retries=0, failure_threshold=1, reset_timeout=60)
+
+    with pytest.raises(ServiceUnavailable):
+        limiter.call(_fail(ServiceUnavailable()))
+    with pytest.raises(CircuitOpenError):
+        limiter.call(lambda: "ok")
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_non_retryable_trial_failure_reopens_the_breaker():
+    limiter = GeminiLimiter(max_retries=0, failure_threshold=1, reset_timeout=0)
+    with pytest.raises(ServiceUnavailable):
+        limiter.call(_fail(ServiceUnavailable()))
+
+    with pytest.raises(ValueError):
+        limiter.call(_fail(ValueError("bad request")))
+    assert limiter.breaker.state == "open"
+
+    assert limiter.call(lambda: "ok") == "ok"
+    assert limiter.breaker.state == "closed"
+
+
+def test_non_retryable_errors_do_not_open_a_closed_breaker():
+    limiter = GeminiLimiter(max_retries=0, failure_threshold=1)
+
+    with pytest.raises(ValueError):
+        limiter.call(_fail(ValueError("bad request")))
+    assert limiter.breaker.state == "closed"
+
+
+def test_retryable_errors_are_retried():
+    limiter = GeminiLimiter(max_retries=2, backoff=0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ServiceUnavailable()
+        return "ok"
+
+    assert limiter.call(flaky) == "ok"
+    assert limiter.stats()["retries"] == 2
+
+
+def test_calls_started_while_closed_do_not_decide_the_trial():
+    limiter = GeminiLimiter(max_retries=0, failure_threshold=1, reset_timeout=0)
+    admitted = limiter.breaker.allow()
+    assert admitted == "closed"
+
+    # Meanwhile another call opens the breaker and a trial starts
+    limiter.breaker.record_failure()
+    assert limiter.breaker.allow() == "half_open"
+
+    # The call started while closed fails, then another one succeeds
+    limiter.breaker.record_failure(trial=False)
+    assert limiter.breaker.state == "half_open"
+    limiter.breaker.record_success(trial=False)
+    assert limiter.breaker.state == "half_open"
+
+    limiter.breaker.record_success()
+    assert limiter.breaker.state == "closed"
+
+
+def test_non_retryable_failure_during_a_trial_leaves_it_running():
+    limiter = GeminiLimiter(max_retries=0, failure_threshold=1, reset_timeout=0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_failure():
+        started.set()
+        release.wait(5)
+        raise ValueError("bad request")
+
+    errors = []
+
+    def run():
+        try:
+            limiter.call(slow_failure)
+        except ValueError as e:
+            errors.append(e)
+
+    # Starts while the breaker is closed
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait(5)
+
+    with pytest.raises(ServiceUnavailable):
+        limiter.call(_fail(ServiceUnavailable()))
+    assert limiter.breaker.allow() == "half_open"
+
+    release.set()
+    thread.join(5)
+    assert errors and limiter.breaker.state == "half_open"
@@ -0,0 +1,35 @@
+import io
+import json
+import logging
+
+from whatsapp._logging import setup_logging
+from whatsapp._turn import start_turn
+
+
+def _log(logger_name, emit):
+    stream = io.StringIO()
+    listener = setup_logging(
+        level=logging.DEBUG, handler=logging.StreamHandler(stream), logger_name=logger_name)
+    emit(logging.getLogger(logger_name))
+    listener.stop()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_formatted_on_the_listener_as_json():
+    def emit(logger):
+        items = ["a"]
+        with start_turn("42"):
+            logger.info("Items: %s", items)
+        # Changes after the call don't leak into the record
+        items.append("b")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Failed")
+
+    first, second = _log("whatsapp.test_logging", emit)
+
+    assert first["message"] == "Items: ['a']"
+    assert first["conversation_id"] == "42"
+    assert second["message"] == "Failed"
+    assert "ValueError: boom" in second["exception"]
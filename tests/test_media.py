@@ -0,0 +1,97 @@
+import hashlib
+
+from whatsapp._media import MediaStore, UploadCache, digest_key, is_media_error
+
+
+def test_store_only_manages_its_own_files(tmp_path):
+    (tmp_path / "notes.txt").write_bytes(b"x" * 100)
+    (tmp_path / "uploads").mkdir()
+    content = b"y" * 100
+    sha256 = hashlib.sha256(content).hexdigest()
+    (tmp_path / f"{sha256}.jpg").write_bytes(content)
+
+    store = MediaStore(str(tmp_path), max_bytes=150)
+    store.put(hashlib.sha256(b"new").hexdigest(), ".jpg", b"n" * 100)
+
+    assert (tmp_path / "notes.txt").exists()
+    assert not (tmp_path / f"{sha256}.jpg").exists()
+    assert store.stats()["files"] == 1
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=250)
+    keys = [hashlib.sha256(bytes([i])).hexdigest() for i in range(3)]
+    for key in keys:
+        store.put(key, ".bin", b"z" * 100)
+
+    assert store.get(keys[0]) is None
+    assert store.get(keys[2]) == tmp_path / f"{digest_key(keys[2])}.bin"
+    assert store.stats()["evictions"] == 1
+
+
+def test_pinned_files_are_not_evicted(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=150)
+    keys = [hashlib.sha256(bytes([i])).hexdigest() for i in range(3)]
+    first = store.put(keys[0], ".bin", b"z" * 100)
+
+    with store.pinned(first) as available:
+        assert available
+        store.put(keys[1], ".bin", b"z" * 100)
+        store.put(keys[2], ".bin", b"z" * 100)
+        assert first.exists()
+
+    # Over budget once released, so the pinned file goes first
+    assert not first.exists()
+    with store.pinned(first) as available:
+        assert not available
+
+
+def test_upload_cache_is_bounded(tmp_path):
+    cache = UploadCache(max_entries=2)
+    for i in range(3):
+        cache.put("123", f"digest{i}", "image/jpeg", f"media{i}")
+        file = tmp_path / f"{i}.jpg"
+        file.write_bytes(bytes([i]))
+        cache.file_digest(str(file))
+
+    assert cache.get("123", "digest0", "image/jpeg") is None
+    assert cache.get("123", "digest2", "image/jpeg") == "media2"
+    assert len(cache._entries) == 2
+    assert len(cache._digests) == 2
+
+
+def test_expired_upload_is_dropped():
+    cache = UploadCache(ttl=-1)
+    cache.put("123", "digest", "image/jpeg", "media")
+
+    assert cache.get("123", "digest", "image/jpeg") is None
+    assert not cache._entries
+
+
+def test_only_media_errors_invalidate():
+    assert is_media_error({"code": 131053, "message": "Media upload error"})
+    assert is_media_error({"code": 100, "message": "Invalid media id"})
+    assert not is_media_error({"code": 131047, "message": "Re-engagement message"})
+    assert not is_media_error({"code": 100, "message": "Invalid parameter: to"})
+    assert not is_media_error({})
+
+
+class _NoPool:
+    def submit(self, *args):
+        raise AssertionError("only images and audio go to the process pool")
+
+
+def test_other_media_is_read_without_the_process_pool(tmp_path, monkeypatch):
+    from whatsapp import _multimodal
+    from whatsapp._multimodal import MediaPreprocessor
+
+    path = tmp_path / "menu.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    preprocessor = MediaPreprocessor(executor=_NoPool())
+
+    part = preprocessor.prepare(path, "application/pdf")
+    assert (part.mime_type, part.data) == ("application/pdf", b"%PDF-1.4")
+
+    # Too large to inline, left for the File API
+    monkeypatch.setattr(_multimodal, "MAX_INLINE_BYTES", 4)
+    assert preprocessor.prepare(path, "application/pdf").data is None
@@ -0,0 +1,80 @@
+import copy
+import json
+from queue import Queue
+
+from whatsapp.events import Change, Message
+from whatsapp.conversation_handler import ConversationHandler, SAMPLE_EVENT
+from whatsapp.reply_message import Message as ReplyMessage, Text
+from whatsapp.replay import DRY_RUN, REPLAY_HEADER, Replayer, WebhookRecorder, read_log, retime
+
+
+def _body():
+    event = copy.deepcopy(SAMPLE_EVENT)
+    value = event["entry"][0]["changes"][0]["value"]
+    value["messages"] = value["messages"][:1]
+    return event
+
+
+class Handler(ConversationHandler):
+    whatsapp_number = "111"
+    token = "token"
+
+    def on_message(self, message: Message):
+        self.dispatch(ReplyMessage(
+            to=message.to, type="text", text=Text(preview_url=False, body="hi")))
+
+
+def test_retime_moves_messages_and_statuses_to_replay_time():
+    body = json.loads(retime(json.dumps(_body()), 1700000000))
+    value = body["entry"][0]["changes"][0]["value"]
+
+    assert value["messages"][0]["timestamp"] == "1700000000"
+    assert value["statuses"][0]["timestamp"] == "1700000000"
+
+
+def test_recorder_continues_offsets_when_appending(tmp_path):
+    path = str(tmp_path / "hooks.log.gz")
+    recorder = WebhookRecorder(path)
+    recorder._started -= 5
+    recorder.record(b"{}")
+    recorder.close()
+
+    recorder = WebhookRecorder(path)
+    recorder.record(b"{}")
+    recorder.close()
+
+    first, second = [offset for offset, _ in read_log(path)]
+    assert second >= first >= 5
+
+
+def test_replayer_is_dry_run_by_default(monkeypatch):
+    sent = []
+
+    class Session:
+        def post(self, url, data, headers):
+            sent.append(headers)
+            return type("Response", (), {"ok": True})()
+
+    monkeypatch.setattr("whatsapp.replay.get_session", Session)
+    Replayer("http://localhost", None)._post(json.dumps(_body()))
+    Replayer("http://localhost", None, send_replies=True)._post(json.dumps(_body()))
+
+    assert sent[0][REPLAY_HEADER] == DRY_RUN
+    assert REPLAY_HEADER not in sent[1]
+
+
+def test_replies_to_replayed_messages_are_not_sent():
+    handler = Handler(start_proxy=False)
+    submitted = []
+    handler.dispatcher.submit = submitted.append
+    change = Change(**_body()["entry"][0]["changes"][0])
+
+    queue = Queue()
+    handler.handle_change(change, queue, replayed=True)
+    handler.handle_change(change, queue)
+    handler._handle_messages([queue.get()])
+    assert submitted == []
+
+    handler._handle_messages([queue.get()])
+    assert len(submitted) == 1
+    handler.dispatcher.shutdown()
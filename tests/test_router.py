@@ -0,0 +1,58 @@
+from whatsapp import Conversation
+from whatsapp.router import Router
+from whatsapp._datastore import SQLiteDatastore
+from whatsapp._dispatcher import SendDispatcher
+from whatsapp.reply_message import Message, Text
+
+
+def _tenant(number, media_root):
+    class Tenant(Conversation):
+        whatsapp_number = number
+        token = "token"
+
+    return Tenant(start_proxy=False, media_root=media_root)
+
+
+def test_tenants_sharing_a_datastore_keep_conversations_apart(tmp_path):
+    datastore = SQLiteDatastore(str(tmp_path / "bots.db"))
+
+    first = datastore.create_conversation("alice", 100, "111")
+    assert datastore.get_current_conversation("alice", "222") is None
+
+    second = datastore.create_conversation("alice", 101, "222")
+    datastore.end_conversation("alice", 200, "111")
+
+    assert datastore.get_current_conversation("alice", "111") is None
+    assert str(datastore.get_current_conversation("alice", "222").id) == second.id
+    assert first.id != second.id
+
+
+def test_dispatchers_restore_only_their_own_sends(tmp_path):
+    datastore = SQLiteDatastore(str(tmp_path / "bots.db"))
+    message = Message(to="alice", type="text", text=Text(preview_url=False, body="hi"))
+    datastore.add_pending_send("alice", message.model_dump_json(), 0, "111")
+    datastore.add_pending_send("alice", message.model_dump_json(), 0, "222")
+
+    sent = []
+    dispatcher = SendDispatcher(
+        lambda m: sent.append(m) or True, datastore, phone_number_id="111")
+    dispatcher.restore()
+    dispatcher.shutdown()
+
+    assert len(sent) == 1
+    assert len(datastore.get_pending_sends("222")) == 1
+
+
+def test_router_shares_datastore_and_media_store(tmp_path):
+    datastore = SQLiteDatastore(str(tmp_path / "bots.db"))
+    router = Router(datastore=datastore)
+    media_root = str(tmp_path / "media")
+
+    first = router.add(_tenant("111", media_root))
+    second = router.add(_tenant("222", media_root))
+    third = router.add(_tenant("333", str(tmp_path / "other")))
+
+    assert first.datastore is second.datastore is datastore
+    assert first.media_store is second.media_store
+    assert third.media_store is not first.media_store
+    assert first.dispatcher.phone_number_id == "111"
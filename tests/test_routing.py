@@ -0,0 +1,88 @@
+from whatsapp._routing import IntentMatcher, ResponseCache, get_all_intents, intent, normalize
+
+
+class Shop:
+    calls = 0
+
+    @intent(keywords=["opening hours", "open"])
+    def hours(self, text: str) -> str:
+        return "9 to 5"
+
+    @intent(name="order_status", pattern=r"\bORD-\d+\b")
+    def order(self, text: str) -> str:
+        return "On its way"
+
+    def not_an_intent(self, text: str) -> str:
+        return ""
+
+    @property
+    def expensive(self):
+        Shop.calls += 1
+        return None
+
+
+def test_keywords_match_whole_words_and_phrases():
+    matcher = IntentMatcher(name="hours", keywords=["opening hours", "open"])
+
+    assert matcher.matches("What are your Opening Hours?")
+    assert matcher.matches("are you open today")
+    assert not matcher.matches("can you reopen my ticket")
+    assert not matcher.matches("")
+
+
+def test_pattern_matches_case_insensitively():
+    shop = Shop()
+    (hours, _), (order, _) = sorted(get_all_intents(shop), key=lambda i: i[0].name)
+
+    assert order.name == "order_status"
+    assert order.matches("where is ord-42?")
+    assert not order.matches("where is my order")
+
+
+def test_get_all_intents_skips_properties_and_plain_methods():
+    shop = Shop()
+    intents = dict((matcher.name, func) for matcher, func in get_all_intents(shop))
+
+    assert sorted(intents) == ["hours", "order_status"]
+    assert intents["hours"]("open?") == "9 to 5"
+    assert Shop.calls == 0
+
+
+def test_normalize():
+    assert normalize("  Hello,   WORLD!! ") == "hello world"
+
+
+def test_cache_hits_ignore_case_and_punctuation():
+    cache = ResponseCache(ttl=60)
+    cache.put("Do you deliver?", "Yes", False)
+
+    assert cache.get("do you deliver") == ("Yes", False)
+    assert cache.get("do you ship") is None
+
+
+def test_cache_entries_expire():
+    cache = ResponseCache(ttl=60)
+    cache.put("hi", "Hello", False)
+    stored_at, response, end_chat = cache._entries["hi"]
+    cache._entries["hi"] = (stored_at - 61, response, end_chat)
+
+    assert cache.get("hi") is None
+    assert "hi" not in cache._entries
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(ttl=60, max_size=2)
+    cache.put("a", "1", False)
+    cache.put("b", "2", False)
+    cache.get("a")
+    cache.put("c", "3", False)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == ("1", False)
+    assert cache.get("c") == ("3", False)
+
+
+def test_blank_text_is_not_cached():
+    cache = ResponseCache(ttl=60)
+    cache.put("?!", "Sorry?", False)
+    assert cache._entries == {}
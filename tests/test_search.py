@@ -0,0 +1,60 @@
+import pytest
+
+from whatsapp._datastore import ShardedSQLiteDatastore, SQLiteDatastore
+
+
+@pytest.fixture(params=["single", "archive_file"])
+def datastore(tmp_path, request):
+    archive_path = str(tmp_path / "archive.db") if request.param == "archive_file" else None
+    datastore = SQLiteDatastore(str(tmp_path / "bot.db"), archive_path)
+    if not datastore.search_enabled:
+        pytest.skip("SQLite was built without FTS5")
+    return datastore
+
+
+def _chat(datastore, customer, *messages):
+    conversation = datastore.create_conversation(customer, 0)
+    for i, message in enumerate(messages):
+        datastore.add_chat_message(conversation.id, "customer", i, message)
+    return conversation
+
+
+def test_search_matches_every_word(datastore):
+    _chat(datastore, "alice", "Where is order ORD-123?", "Thanks!")
+    _chat(datastore, "bob", "Is ORD-124 on its way?")
+
+    hit, = datastore.search_messages("ORD-123 order")
+    assert hit.customer_id == "alice"
+    assert hit.snippet == "Where is [order] [ORD-123]?"
+    assert [h.customer_id for h in datastore.search_messages("order", customer_id="bob")] == []
+
+
+def test_blank_query_matches_nothing(datastore):
+    _chat(datastore, "alice", "hello")
+    assert datastore.search_messages("") == []
+    assert datastore.search_messages("   ", raw=True) == []
+
+
+def test_archived_messages_stay_searchable(datastore):
+    _chat(datastore, "alice", "Refund for the jollof rice")
+    _chat(datastore, "bob", "Refund for the plantain")
+    datastore.end_conversation("alice", 10)
+    assert datastore.archive_conversations(ended_before=20) == 1
+
+    hits = datastore.search_messages("refund")
+    assert sorted(h.customer_id for h in hits) == ["alice", "bob"]
+    hit, = datastore.search_messages("jollof")
+    assert hit.message.message == "Refund for the jollof rice"
+
+
+def test_sharded_search_merges_shards(tmp_path):
+    datastore = ShardedSQLiteDatastore(str(tmp_path / "bot.db"), shards=4)
+    if not datastore.shards[0].search_enabled:
+        pytest.skip("SQLite was built without FTS5")
+    for customer in ("alice", "bob", "erin"):
+        _chat(datastore, customer, f"Delivery for {customer}")
+
+    hits = datastore.search_messages("delivery", limit=2)
+    assert len(hits) == 2
+    assert all(":" in hit.message.id for hit in hits)
+    assert datastore.search_messages(" ") == []
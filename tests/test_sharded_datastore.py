@@ -0,0 +1,65 @@
+import zlib
+
+import pytest
+
+from whatsapp._datastore import ShardedSQLiteDatastore
+
+
+@pytest.fixture
+def datastore(tmp_path):
+    return ShardedSQLiteDatastore(str(tmp_path / "bot.db"), shards=4)
+
+
+def test_customers_are_routed_by_crc32(tmp_path, datastore):
+    for customer in ("alice", "bob", "carol", "dave"):
+        conversation = datastore.create_conversation(customer, 100)
+        shard = zlib.crc32(customer.encode()) % 4
+        assert conversation.id.startswith(f"{shard}:")
+        assert datastore.shards[shard].get_current_conversation(customer) is not None
+        assert datastore.get_current_conversation(customer).id == conversation.id
+
+    assert {p.name for p in tmp_path.iterdir() if p.suffix == ".db"} == {
+        f"bot.{i}.db" for i in range(4)}
+
+
+def test_sharded_ids_route_writes(datastore):
+    conversation = datastore.create_conversation("alice", 100)
+    datastore.add_chat_message(conversation.id, "customer", 101, "hi")
+    datastore.add_agent_message(conversation.id, "text", "customer", "hi")
+
+    message, = datastore.get_chat_messages(conversation.id)
+    assert message.conversation_id == conversation.id
+    assert message.id.split(":")[0] == conversation.id.split(":")[0]
+
+    agent_message, = datastore.get_agent_messages(conversation.id)
+    datastore.update_agent_message(agent_message.id, "hello", None)
+    assert datastore.get_agent_messages(conversation.id)[0].data == "hello"
+
+    with pytest.raises(ValueError):
+        datastore.add_chat_message("12", "customer", 101, "hi")
+
+
+def test_messages_are_merged_across_shards_in_time_order(datastore):
+    timestamp = 0
+    for customer in ("alice", "bob", "carol", "dave", "erin"):
+        conversation = datastore.create_conversation(customer, 0)
+        for _ in range(3):
+            timestamp += 1
+            datastore.add_chat_message(conversation.id, "customer", timestamp, customer)
+
+    timestamps = [m.timestamp for m in datastore.iter_chat_messages(batch_size=2)]
+    assert timestamps == list(range(1, 16))
+    assert len(list(datastore.iter_conversations())) == 5
+
+
+def test_pending_sends_across_shards(datastore):
+    ids = [datastore.add_pending_send(customer, "{}", created_at)
+           for created_at, customer in enumerate(("alice", "bob", "carol", "dave"))]
+
+    assert [send.id for send in datastore.get_pending_sends()] == ids
+
+    datastore.mark_pending_send_failed(ids[1], 10, "131026")
+    datastore.remove_pending_send(ids[0])
+    assert [send.id for send in datastore.get_pending_sends()] == ids[2:]
+    failed, = datastore.get_failed_sends()
+    assert (failed.id, failed.error) == (ids[1], "131026")
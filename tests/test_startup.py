@@ -0,0 +1,79 @@
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("google.generativeai", "google.protobuf", "requests", "werkzeug", "pyngrok")
+# Generous enough for a cold CI runner, importing Gemini alone takes longer
+IMPORT_BUDGET = 1.5
+STARTUP_BUDGET = 2.5
+
+
+def _run(code: str, tmp_path=None) -> dict:
+    """Runs `code` in a fresh interpreter and returns the JSON it prints."""
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=tmp_path or ROOT,
+        env={"PYTHONPATH": str(ROOT), "PATH": ""},
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ["whatsapp", "whatsapp.events", "whatsapp.reply_message"])
+def test_import_is_lazy_and_within_budget(module):
+    result = _run(f"""
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(sys.modules)}}))
+""")
+
+    print(f"\nimport {module}: {result['elapsed'] * 1e3:.0f}ms")
+    assert not set(HEAVY_MODULES) & set(result["modules"])
+    assert result["elapsed"] < IMPORT_BUDGET
+
+
+def test_constructing_conversation_is_lazy_and_within_budget(tmp_path):
+    result = _run(f"""
+import sys, json, time
+start = time.perf_counter()
+from whatsapp import Conversation, instruction, intent
+from whatsapp._datastore import SQLiteDatastore
+
+class Bot(Conversation):
+    whatsapp_number = "123"
+    token = "token"
+    datastore = SQLiteDatastore(":memory:")
+
+    @instruction
+    def lookup(self, order_id: str) -> str:
+        "Looks up an order."
+        return order_id
+
+    @intent(keywords=["hours"])
+    def hours(self, text: str) -> str:
+        return "9 to 5"
+
+bot = Bot(start_proxy=False, media_root={str(tmp_path / "media")!r})
+elapsed = time.perf_counter() - start
+instructions = [func.__name__ for func in bot.get_all_instructions()]
+print(json.dumps({{
+    "instructions": instructions,
+    "elapsed": elapsed,
+    "modules": sorted(sys.modules),
+    "intents": [matcher.name for matcher, _ in bot.intents],
+}}))
+""", tmp_path)
+
+    assert not set(HEAVY_MODULES) & set(result["modules"])
+    assert result["intents"] == ["hours"]
+    assert result["instructions"] == ["lookup"]
+    assert result["elapsed"] < STARTUP_BUDGET
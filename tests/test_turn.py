@@ -0,0 +1,42 @@
+from whatsapp._turn import Turn, TurnBudget, TurnMetrics, current_turn, start_turn
+
+
+def test_budget_reports_the_first_limit_reached():
+    budget = TurnBudget(max_iterations=3, deadline=60, max_tokens=100)
+    turn = Turn(conversation_id="1")
+
+    assert budget.exceeded(turn) is None
+    turn.tokens = 100
+    assert budget.exceeded(turn) == "tokens"
+    turn.started_at -= 60
+    assert budget.exceeded(turn) == "deadline"
+    turn.iterations = 3
+    assert budget.exceeded(turn) == "iterations"
+
+
+def test_disabled_limits_are_never_reached():
+    turn = Turn(conversation_id="1", iterations=1000, tokens=10 ** 9)
+    turn.started_at -= 10 ** 6
+    assert TurnBudget(max_iterations=None, deadline=None).exceeded(turn) is None
+
+
+def test_nested_turns_join_the_open_one():
+    with start_turn("1") as outer:
+        with start_turn("2") as inner:
+            assert inner is outer
+        assert current_turn() is outer
+    assert current_turn() is None
+
+
+def test_metrics():
+    metrics = TurnMetrics()
+    metrics.record(Turn(conversation_id="1", iterations=1), None, fallback=False)
+    metrics.record(Turn(conversation_id="2", iterations=3), "iterations", fallback=True)
+
+    assert metrics.stats() == {
+        "turns": 2,
+        "avg_iterations": 2.0,
+        "iterations": {1: 1, 3: 1},
+        "budget_hits": {"iterations": 1},
+        "fallbacks": 1,
+    }
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from whatsapp.vector_index import CatalogueSync, VectorIndex
+
+
+def _embed(texts, task_type=None):
+    return [[float(len(text)), 1.0, float(i)] for i, text in enumerate(texts)]
+
+
+def test_held_back_rows_are_written_on_flush(tmp_path):
+    index = VectorIndex(str(tmp_path / "index"))
+    index.upsert(["a", "b"], [[1, 0], [0, 1]], flush=False)
+
+    assert "a" in index and len(index) == 2
+    assert index.query([1, 0]) == []
+
+    index.delete(["b"])
+    index.flush()
+    assert VectorIndex(str(tmp_path / "index")).ids() == ["a"]
+    assert index.query([1, 0], k=1)[0][0] == "a"
+
+
+def test_sync_writes_the_index_once(tmp_path):
+    index = VectorIndex(str(tmp_path / "index"), embed=_embed)
+    saves = []
+    save = index._save
+    index._save = lambda *args: saves.append(1) or save(*args)
+
+    records = [str(i) for i in range(10)]
+    sync = CatalogueSync(index, lambda: records, key=lambda r: r, text=lambda r: r * 3, batch_size=3)
+    result = sync.run()
+
+    assert result.added == 10
+    assert len(saves) == 1
+    assert sorted(VectorIndex(str(tmp_path / "index")).ids()) == sorted(records)
+    assert sync.run().unchanged == 10
+
+
+def test_trigger_skips_while_a_run_is_going(tmp_path):
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        return ["a"]
+
+    sync = CatalogueSync(
+        VectorIndex(str(tmp_path / "index"), embed=_embed), load, key=lambda r: r, text=lambda r: r)
+    running = sync.trigger()
+    assert running is not None
+    assert sync.trigger() is None
+
+    release.set()
+    assert running.result(5).added == 1
+    assert sync.trigger().result(5).unchanged == 1
@@ -1,7 +1,9 @@
 from whatsapp.conversation import Conversation
 from whatsapp.agent_interface import instruction
+from whatsapp._routing import intent
 
 __all__ = [
+    "intent",
     "instruction",
     "Conversation"
 ]
@@ -0,0 +1,118 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Deque, List, Literal, Optional, Tuple
+
+from whatsapp.events import Message
+
+
+logger = logging.getLogger(__name__)
+
+OverloadPolicy = Literal["reply", "defer"]
+
+
+class AdmissionController:
+    """Decides whether new work is accepted while the pipeline is saturated.
+
+    The pipeline counts as overloaded when any configured limit is exceeded:
+    messages waiting or being handled, the age of the message being
+    admitted, or Gemini calls in flight. Messages for ongoing conversations
+    are always accepted. Messages that would start a new conversation are
+    either answered with `busy_message` ("reply") or held back and re-admitted
+    once the load drops ("defer"). Deferred messages older than `max_defer`
+    seconds, or beyond `max_deferred`, are answered with `busy_message`.
+    Each re-admission round takes no more than the headroom left under the
+    queue depth and in-flight limits, and at most `max_readmit` messages.
+    """
+
+    def __init__(
+            self,
+            max_queue_depth: Optional[int] = None,
+            max_queue_age: Optional[float] = None,
+            max_llm_in_flight: Optional[int] = None,
+            policy: OverloadPolicy = "reply",
+            busy_message: str = "We're receiving a lot of messages right now, please try again in a few minutes.",
+            max_deferred: int = 1000,
+            max_defer: float = 300.0,
+            max_readmit: int = 50,
+    ):
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_age = max_queue_age
+        self.max_llm_in_flight = max_llm_in_flight
+        self.policy = policy
+        self.busy_message = busy_message
+        self.max_deferred = max_deferred
+        self.max_defer = max_defer
+        self.max_readmit = max_readmit
+
+        self._lock = threading.Lock()
+        self._deferred: Deque[Tuple[float, Message]] = deque()
+
+        self.accepted = 0
+        self.shed = 0
+        self.deferred = 0
+        self.readmitted = 0
+
+    def is_overloaded(self, queue_depth: int, queue_age: float, llm_in_flight: int) -> bool:
+        if self.max_queue_depth is not None and queue_depth > self.max_queue_depth:
+            return True
+        if self.max_queue_age is not None and queue_age > self.max_queue_age:
+            return True
+        if self.max_llm_in_flight is not None and llm_in_flight >= self.max_llm_in_flight:
+            return True
+        return False
+
+    def headroom(self, queue_depth: int, llm_in_flight: int) -> int:
+        """Returns how many deferred messages can be re-admitted right now."""
+        room = self.max_readmit
+        if self.max_queue_depth is not None:
+            room = min(room, self.max_queue_depth - queue_depth)
+        if self.max_llm_in_flight is not None:
+            room = min(room, self.max_llm_in_flight - llm_in_flight)
+        return max(room, 0)
+
+    def record_accepted(self):
+        with self._lock:
+            self.accepted += 1
+
+    def record_shed(self):
+        with self._lock:
+            self.shed += 1
+
+    def defer(self, message: Message) -> bool:
+        """Holds a message back for later, returns False when the backlog is full."""
+        with self._lock:
+            if len(self._deferred) >= self.max_deferred:
+                return False
+            self._deferred.append((time.monotonic(), message))
+            self.deferred += 1
+            return True
+
+    def take_expired(self) -> List[Message]:
+        """Removes and returns deferred messages that waited longer than `max_defer`."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._deferred and now - self._deferred[0][0] > self.max_defer:
+                expired.append(self._deferred.popleft()[1])
+        return expired
+
+    def take_ready(self, limit: int) -> List[Message]:
+        """Removes and returns up to `limit` of the oldest deferred messages."""
+        with self._lock:
+            ready = []
+            while self._deferred and len(ready) < limit:
+                ready.append(self._deferred.popleft()[1])
+            self.readmitted += len(ready)
+        return ready
+
+    def stats(self):
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "shed": self.shed,
+                "deferred": self.deferred,
+                "readmitted": self.readmitted,
+                "waiting": len(self._deferred),
+            }
@@ -0,0 +1,124 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from whatsapp.events import Message
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CustomerState:
+    pending: List[Message] = field(default_factory=list)
+    timer: Optional[threading.Timer] = None
+    running: bool = False
+    # Bumped whenever a window is opened or flushed, a timer that fired while
+    # it was being cancelled sees a newer generation and does nothing
+    generation: int = 0
+
+
+class MessageCoalescer:
+    """Groups rapid-fire messages from one customer into a single batch.
+
+    A batch is flushed once no new message has arrived for `window_ms`, or as
+    soon as it holds `max_messages`. Batches for the same customer are handled
+    one at a time, so replies keep the order the messages were sent in;
+    messages arriving while a batch is in flight go into the next one.
+    A `window_ms` of 0 disables merging and hands messages over one by one.
+    """
+
+    def __init__(
+            self,
+            handle: Callable[[List[Message]], None],
+            submit: Callable[[Callable[[], None]], Any],
+            window_ms: int = 0,
+            max_messages: int = 10,
+    ):
+        self._handle = handle
+        self._submit = submit
+        self.window_ms = window_ms
+        self.max_messages = max(1, max_messages)
+
+        self._lock = threading.Lock()
+        self._customers: Dict[str, _CustomerState] = {}
+
+        self.received = 0
+        self.batches = 0
+        self.in_flight = 0
+
+    def add(self, message: Message):
+        key = message.to
+        with self._lock:
+            self.received += 1
+            state = self._customers.setdefault(key, _CustomerState())
+            state.pending.append(message)
+
+            if state.running:
+                return
+
+            if self.window_ms <= 0 or len(state.pending) >= self.max_messages:
+                self._flush(key, state)
+                return
+
+            # Every new message restarts the window
+            if state.timer is not None:
+                state.timer.cancel()
+            state.generation += 1
+            state.timer = threading.Timer(
+                self.window_ms / 1000, self._on_window_closed, (key, state.generation))
+            state.timer.daemon = True
+            state.timer.start()
+
+    def _on_window_closed(self, key: str, generation: int):
+        with self._lock:
+            state = self._customers.get(key)
+            if state is None or state.generation != generation:
+                return
+            state.timer = None
+            if not state.running and state.pending:
+                self._flush(key, state)
+
+    def _flush(self, key: str, state: _CustomerState):
+        # Must be called with the lock held
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        state.generation += 1
+
+        size = self.max_messages if self.window_ms > 0 else 1
+        batch, state.pending = state.pending[:size], state.pending[size:]
+        state.running = True
+        self.batches += 1
+        self.in_flight += len(batch)
+        self._submit(lambda: self._run(key, batch))
+
+    def _run(self, key: str, batch: List[Message]):
+        try:
+            self._handle(batch)
+        except Exception as e:
+            logger.error("Error handling messages from %s: %s", key, e)
+        finally:
+            with self._lock:
+                self.in_flight -= len(batch)
+                state = self._customers[key]
+                state.running = False
+                if state.pending:
+                    self._flush(key, state)
+                elif state.timer is None:
+                    del self._customers[key]
+
+    def backlog(self) -> int:
+        """Returns the number of messages waiting for or being handled."""
+        with self._lock:
+            pending = sum(len(state.pending) for state in self._customers.values())
+            return pending + self.in_flight
+
+    def stats(self):
+        with self._lock:
+            return {
+                "received": self.received,
+                "batches": self.batches,
+                "coalesced": self.received - self.batches,
+            }
@@ -1,52 +1,290 @@
+import zlib
+import json
+import heapq
+import base64
 import sqlite3
 import logging
-from typing import List
+import threading
+from pathlib import Path
+from itertools import chain, islice
+from dataclasses import asdict, replace
+from typing import Dict, Iterable, Iterator, List, Literal, Optional, Tuple
 
 from whatsapp._types import (
     Sender,
     ChatMessage,
+    PendingSend,
+    UploadedMedia,
     AgentMessage,
     ConversationData,
+    ConversationStats,
+    DailyStats,
+    SearchHit,
 )
 
 logger = logging.getLogger(__name__)
 
+ExportFormat = Literal["jsonl", "parquet"]
+
+
+def _fts_query(text: str) -> str:
+    """Quotes each word so order references like ORD-123 match literally."""
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _write_export(rows: Iterable, path: str, format: ExportFormat, batch_size: int) -> int:
+    """Writes dataclass rows to `path` one batch at a time and returns the row count."""
+    count = 0
+    if format == "jsonl":
+        with open(path, "w") as file:
+            for row in rows:
+                file.write(json.dumps(asdict(row), default=_json_default) + "\n")
+                count += 1
+        return count
+
+    if format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(
+                "Parquet export requires pyarrow, install it with `pip install pyarrow`"
+            ) from e
+
+        rows = iter(rows)
+        writer = None
+        try:
+            while batch := list(islice(rows, batch_size)):
+                table = pa.Table.from_pylist([asdict(row) for row in batch])
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                count += len(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+
+    raise ValueError(f"Unsupported export format: {format}")
+
 
 class BaseDatastore:
     def create_tables(self):
         raise NotImplementedError
 
-    def create_conversation(self, customer_id: str, start_time: int) -> ConversationData:
+    # Conversations are kept per customer and per business number, so
+    # several numbers can share one datastore without mixing histories
+    def create_conversation(self, customer_id: str, start_time: int, phone_number_id: Optional[str] = None) -> ConversationData:
+        raise NotImplementedError
+
+    def end_conversation(self, customer_id: str, timestamp: int, phone_number_id: Optional[str] = None):
         raise NotImplementedError
 
-    def end_conversation(self, customer_id: str, timestamp: int):
+    def set_conversation_intent(self, conversation_id: str, intent: str):
         raise NotImplementedError
 
     def add_chat_message(self, conversation_id: str, sender: str, timestamp: int, message: str):
         raise NotImplementedError
 
-    def add_agent_message(self, conversation_id: str, type: str, sender: Sender, data: str):
+    def add_agent_message(self, conversation_id: str, type: str, sender: Sender, data: str, payload: Optional[bytes] = None):
         raise NotImplementedError
 
-    def get_chat_messages(self) -> List[ChatMessage]:
+    def update_agent_message(self, agent_message_id: str, data: str, payload: Optional[bytes]):
+        raise NotImplementedError
+
+    def get_chat_messages(self, conversation_id: str) -> List[ChatMessage]:
         raise NotImplementedError
 
     def get_agent_messages(self, conversation_id: str) -> List[AgentMessage]:
         raise NotImplementedError
 
-    def get_current_conversation(self, customer_id: str) -> ConversationData:
+    def get_current_conversation(self, customer_id: str, phone_number_id: Optional[str] = None) -> ConversationData:
+        raise NotImplementedError
+
+    def add_pending_send(self, recipient: str, payload: str, created_at: int, phone_number_id: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    def remove_pending_send(self, pending_send_id: str):
+        raise NotImplementedError
+
+    def get_pending_sends(self, phone_number_id: Optional[str] = None) -> List[PendingSend]:
+        raise NotImplementedError
+
+    def mark_pending_send_failed(self, pending_send_id: str, failed_at: int, error: str):
+        """Keeps a send that ran out of retries as a dead letter instead of deleting it."""
+        raise NotImplementedError
+
+    def get_failed_sends(self, phone_number_id: Optional[str] = None) -> List[PendingSend]:
+        raise NotImplementedError
+
+    def add_uploaded_media(self, media: UploadedMedia):
+        raise NotImplementedError
+
+    def get_uploaded_media(self, phone_number_id: str, digest: str, mime_type: str) -> Optional[UploadedMedia]:
+        raise NotImplementedError
+
+    def remove_uploaded_media(self, phone_number_id: str, digest: str, mime_type: str):
+        raise NotImplementedError
+
+    def expire_idle_conversations(self, idle_before: int, timestamp: int) -> int:
+        """Ends open conversations with no activity since `idle_before`.
+
+        Returns the number of conversations ended.
+        """
+        raise NotImplementedError
+
+    def archive_conversations(self, ended_before: int, batch_size: int = 500) -> int:
+        """Moves messages of conversations ended before `ended_before` out of the hot tables.
+
+        Archived messages are still returned by the getters, iterators and
+        exports. Returns the number of conversations archived in this batch.
+        """
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Loads the pages the first turns will read into the cache. Optional."""
+        pass
+
+    def search_messages(
+            self,
+            query: str,
+            customer_id: Optional[str] = None,
+            since: Optional[int] = None,
+            until: Optional[int] = None,
+            limit: int = 20,
+            raw: bool = False,
+    ) -> List[SearchHit]:
+        """Full-text search over chat messages, archived ones included, best matches first.
+
+        Every word of `query` must appear, a blank query matches nothing;
+        with `raw=True` the query is passed to the search engine as is
+        (FTS5 syntax for SQLite).
+        """
+        raise NotImplementedError
+
+    def get_conversation_stats(self, conversation_id: str) -> Optional[ConversationStats]:
+        raise NotImplementedError
+
+    def get_daily_stats(self, since: Optional[str] = None, until: Optional[str] = None) -> List[DailyStats]:
+        """Returns per-day summaries, `since`/`until` are YYYY-MM-DD (inclusive/exclusive)."""
+        raise NotImplementedError
+
+    def rebuild_analytics(self):
+        """Recomputes the summary tables from the message tables."""
+        raise NotImplementedError
+
+    def iter_conversations(
+            self,
+            customer_id: Optional[str] = None,
+            since: Optional[int] = None,
+            until: Optional[int] = None,
+            batch_size: int = 500,
+    ) -> Iterator[ConversationData]:
+        """Yields conversations ordered by id, optionally by customer and start time."""
+        raise NotImplementedError
+
+    def iter_chat_messages(
+            self,
+            conversation_id: Optional[str] = None,
+            customer_id: Optional[str] = None,
+            since: Optional[int] = None,
+            until: Optional[int] = None,
+            batch_size: int = 500,
+            include_archived: bool = True,
+    ) -> Iterator[ChatMessage]:
+        """Yields chat messages ordered by timestamp, fetching one page at a time.
+
+        Filters combine, and `since`/`until` bound the message timestamp
+        (inclusive/exclusive) across all conversations. Messages moved to the
+        archive are included unless `include_archived=False`.
+        """
+        raise NotImplementedError
+
+    def iter_agent_messages(
+            self,
+            conversation_id: Optional[str] = None,
+            batch_size: int = 500,
+            include_archived: bool = True,
+    ) -> Iterator[AgentMessage]:
+        """Yields agent messages ordered by id, archived ones included by default."""
         raise NotImplementedError
 
+    def export_chat_messages(
+            self,
+            path: str,
+            format: ExportFormat = "jsonl",
+            batch_size: int = 10_000,
+            **filters,
+    ) -> int:
+        """Streams chat messages matching `filters` to a JSONL or Parquet file."""
+        rows = self.iter_chat_messages(batch_size=batch_size, **filters)
+        return _write_export(rows, path, format, batch_size)
+
+    def export_agent_messages(
+            self,
+            path: str,
+            format: ExportFormat = "jsonl",
+            batch_size: int = 10_000,
+            conversation_id: Optional[str] = None,
+            include_archived: bool = True,
+    ) -> int:
+        """Streams agent messages to a JSONL or Parquet file."""
+        rows = self.iter_agent_messages(
+            conversation_id, batch_size=batch_size, include_archived=include_archived)
+        return _write_export(rows, path, format, batch_size)
+
+    def export_conversations(
+            self,
+            path: str,
+            format: ExportFormat = "jsonl",
+            batch_size: int = 10_000,
+            **filters,
+    ) -> int:
+        """Streams conversations matching `filters` to a JSONL or Parquet file."""
+        rows = self.iter_conversations(batch_size=batch_size, **filters)
+        return _write_export(rows, path, format, batch_size)
+
 
 class SQLiteDatastore(BaseDatastore):
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, archive_path=None):
         self.db_path = db_path
+        self.archive_path = archive_path
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        # The connection is shared by the webhook, worker and sender threads
+        self.lock = threading.RLock()
+
+        # Archived messages live in a separate file when archive_path is set
+        self.archive_schema = "main"
+        if archive_path:
+            self.cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            self.archive_schema = "archive"
+
+        # WAL lets dashboards read from their own connection without
+        # blocking the bot's writes. A transaction spanning several WAL files
+        # is only atomic per file though, archival would be able to commit
+        # the delete from the hot file and lose the copy into the archive
+        # file, so with an archive file both keep a rollback journal
+        journal_mode = "DELETE" if archive_path else "WAL"
+        self.cursor.execute(f"PRAGMA journal_mode={journal_mode}")
 
         self.create_tables()
 
+    def _add_column(self, table: str, column: str, definition: str, schema: str = "main"):
+        self.cursor.execute(f"PRAGMA {schema}.table_info({table})")
+        columns = [r[1] for r in self.cursor.fetchall()]
+        if column not in columns:
+            logger.debug("Adding %s.%s", table, column)
+            self.cursor.execute(
+                f"ALTER TABLE {schema}.{table} ADD COLUMN {column} {definition}")
+
     def create_tables(self):
         logging.debug("Creating tables...")
         self.cursor.execute(
@@ -84,19 +322,547 @@ class SQLiteDatastore(BaseDatastore):
             )
             """
         )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_sends (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                payload TEXT NOT NULL, -- Serialized reply message
+                created_at INTEGER NOT NULL -- Unix timestamp
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploaded_media (
+                phone_number_id TEXT NOT NULL,
+                digest TEXT NOT NULL, -- sha256 of the file content
+                mime_type TEXT NOT NULL,
+                media_id TEXT NOT NULL,
+                uploaded_at INTEGER NOT NULL, -- Unix timestamp
+                PRIMARY KEY (phone_number_id, digest, mime_type)
+            )
+            """
+        )
+        self._add_column("conversations", "archived_at", "INTEGER")
+        self._add_column("agent_messages", "payload", "BLOB")
+        self._add_column("pending_sends", "failed_at", "INTEGER")
+        self._add_column("pending_sends", "error", "TEXT")
+        self._add_column("conversations", "phone_number_id", "TEXT")
+        self._add_column("pending_sends", "phone_number_id", "TEXT")
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.archive_schema}.agent_messages_archive (
+                id INTEGER PRIMARY KEY,
+                conversation_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self._add_column("agent_messages_archive", "payload",
+                         "BLOB", schema=self.archive_schema)
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.archive_schema}.chat_messages_archive (
+                id INTEGER PRIMARY KEY,
+                conversation_id INTEGER NOT NULL,
+                sender TEXT NOT NULL,
+                timestamp INTEGER NOT NULL, -- Unix timestamp
+                message TEXT NOT NULL
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS conversations_customer
+            ON conversations (customer_id, end_time)
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS conversations_current
+            ON conversations (customer_id, phone_number_id, end_time)
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS conversations_open
+            ON conversations (start_time) WHERE end_time IS NULL
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS conversations_unarchived
+            ON conversations (end_time) WHERE archived_at IS NULL
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS chat_messages_conversation
+            ON chat_messages (conversation_id, timestamp)
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS chat_messages_timestamp
+            ON chat_messages (timestamp)
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS agent_messages_conversation
+            ON agent_messages (conversation_id)
+            """
+        )
+        self.cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {self.archive_schema}.chat_messages_archive_conversation
+            ON chat_messages_archive (conversation_id, timestamp)
+            """
+        )
+        self.cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {self.archive_schema}.chat_messages_archive_timestamp
+            ON chat_messages_archive (timestamp)
+            """
+        )
+        self.cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {self.archive_schema}.agent_messages_archive_conversation
+            ON agent_messages_archive (conversation_id)
+            """
+        )
+        self._create_analytics_tables()
+        self._create_search_index()
         self.conn.commit()
 
-    def create_conversation(self, customer_id, start_time):
+    def _create_search_index(self):
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chat_messages_fts'")
+        exists = self.cursor.fetchone() is not None
+
+        try:
+            self.cursor.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5 (
+                    message,
+                    content='chat_messages',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+                """
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning("Full-text search is unavailable: %s", e)
+            self.search_enabled = False
+            return
+        self.search_enabled = True
+
+        # External content table, the triggers keep the index in step
         self.cursor.execute(
             """
-            INSERT INTO conversations
-            (customer_id, start_time)
-            VALUES (?, ?)
-            """,
-            (customer_id, start_time,)
+            CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert
+            AFTER INSERT ON chat_messages
+            BEGIN
+                INSERT INTO chat_messages_fts (rowid, message)
+                VALUES (NEW.id, NEW.message);
+            END
+            """
         )
-        self.conn.commit()
-        conversation_id = str(self.cursor.lastrowid)
+        self.cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete
+            AFTER DELETE ON chat_messages
+            BEGIN
+                INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message)
+                VALUES ('delete', OLD.id, OLD.message);
+            END
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update
+            AFTER UPDATE OF message ON chat_messages
+            BEGIN
+                INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message)
+                VALUES ('delete', OLD.id, OLD.message);
+                INSERT INTO chat_messages_fts (rowid, message)
+                VALUES (NEW.id, NEW.message);
+            END
+            """
+        )
+
+        if not exists:
+            self.cursor.execute(
+                "INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')")
+
+        self._create_archive_search_index()
+
+    def _create_archive_search_index(self):
+        # Archived messages get their own index next to the archive table,
+        # triggers can only touch tables in their own schema
+        schema = self.archive_schema
+        self.cursor.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name='chat_messages_archive_fts'")
+        exists = self.cursor.fetchone() is not None
+
+        self.cursor.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.chat_messages_archive_fts USING fts5 (
+                message,
+                content='chat_messages_archive',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """
+        )
+        self.cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {schema}.chat_messages_archive_fts_insert
+            AFTER INSERT ON chat_messages_archive
+            BEGIN
+                INSERT INTO chat_messages_archive_fts (rowid, message)
+                VALUES (NEW.id, NEW.message);
+            END
+            """
+        )
+        self.cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {schema}.chat_messages_archive_fts_delete
+            AFTER DELETE ON chat_messages_archive
+            BEGIN
+                INSERT INTO chat_messages_archive_fts (chat_messages_archive_fts, rowid, message)
+                VALUES ('delete', OLD.id, OLD.message);
+            END
+            """
+        )
+
+        if not exists:
+            self.cursor.execute(
+                f"""
+                INSERT INTO {schema}.chat_messages_archive_fts (chat_messages_archive_fts)
+                VALUES ('rebuild')
+                """
+            )
+
+    def _create_analytics_tables(self):
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_stats'")
+        exists = self.cursor.fetchone() is not None
+
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_stats (
+                conversation_id INTEGER PRIMARY KEY,
+                day TEXT NOT NULL, -- UTC date the conversation started
+                start_time INTEGER NOT NULL, -- Unix timestamp
+                end_time INTEGER, -- Unix timestamp
+                customer_messages INTEGER NOT NULL DEFAULT 0,
+                bot_messages INTEGER NOT NULL DEFAULT 0,
+                tool_calls INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT PRIMARY KEY, -- UTC date, YYYY-MM-DD
+                conversations INTEGER NOT NULL DEFAULT 0,
+                ended_conversations INTEGER NOT NULL DEFAULT 0,
+                customer_messages INTEGER NOT NULL DEFAULT 0,
+                bot_messages INTEGER NOT NULL DEFAULT 0,
+                tool_calls INTEGER NOT NULL DEFAULT 0,
+                total_duration INTEGER NOT NULL DEFAULT 0 -- Seconds
+            )
+            """
+        )
+        # Triggers keep the summaries in the same transaction as the writes
+        self.cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS conversations_stats_insert
+            AFTER INSERT ON conversations
+            BEGIN
+                INSERT INTO conversation_stats (conversation_id, day, start_time, end_time)
+                VALUES (NEW.id, date(NEW.start_time, 'unixepoch'), NEW.start_time, NEW.end_time);
+                INSERT OR IGNORE INTO daily_stats (day)
+                VALUES (date(NEW.start_time, 'unixepoch'));
+                UPDATE daily_stats SET conversations = conversations + 1
+                WHERE day = date(NEW.start_time, 'unixepoch');
+            END
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS conversations_stats_end
+            AFTER UPDATE OF end_time ON conversations
+            WHEN OLD.end_time IS NULL AND NEW.end_time IS NOT NULL
+            BEGIN
+                UPDATE conversation_stats SET end_time = NEW.end_time
+                WHERE conversation_id = NEW.id;
+                UPDATE daily_stats
+                SET ended_conversations = ended_conversations + 1,
+                    total_duration = total_duration + MAX(NEW.end_time - NEW.start_time, 0)
+                WHERE day = date(NEW.start_time, 'unixepoch');
+            END
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS chat_messages_stats_insert
+            AFTER INSERT ON chat_messages
+            BEGIN
+                UPDATE conversation_stats
+                SET customer_messages = customer_messages + (NEW.sender = 'customer'),
+                    bot_messages = bot_messages + (NEW.sender = 'bot')
+                WHERE conversation_id = CAST(NEW.conversation_id AS INTEGER);
+                UPDATE daily_stats
+                SET customer_messages = customer_messages + (NEW.sender = 'customer'),
+                    bot_messages = bot_messages + (NEW.sender = 'bot')
+                WHERE day = (SELECT day FROM conversation_stats
+                             WHERE conversation_id = CAST(NEW.conversation_id AS INTEGER));
+            END
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS agent_messages_stats_insert
+            AFTER INSERT ON agent_messages
+            WHEN NEW.type = 'function_call'
+            BEGIN
+                UPDATE conversation_stats SET tool_calls = tool_calls + 1
+                WHERE conversation_id = CAST(NEW.conversation_id AS INTEGER);
+                UPDATE daily_stats SET tool_calls = tool_calls + 1
+                WHERE day = (SELECT day FROM conversation_stats
+                             WHERE conversation_id = CAST(NEW.conversation_id AS INTEGER));
+            END
+            """
+        )
+
+        # Existing databases get their history summarized once
+        if not exists:
+            self._rebuild_analytics()
+
+    def _rebuild_analytics(self):
+        self.cursor.execute("DELETE FROM conversation_stats")
+        self.cursor.execute("DELETE FROM daily_stats")
+        self.cursor.execute(
+            f"""
+            WITH chats AS (
+                SELECT conversation_id, sender FROM chat_messages
+                UNION ALL
+                SELECT conversation_id, sender FROM {self.archive_schema}.chat_messages_archive
+            ), chat_counts AS (
+                SELECT CAST(conversation_id AS INTEGER) AS conversation_id,
+                       SUM(sender = 'customer') AS customer_messages,
+                       SUM(sender = 'bot') AS bot_messages
+                FROM chats GROUP BY 1
+            ), tool_counts AS (
+                SELECT CAST(conversation_id AS INTEGER) AS conversation_id,
+                       COUNT(*) AS tool_calls
+                FROM (
+                    SELECT conversation_id, type FROM agent_messages
+                    UNION ALL
+                    SELECT conversation_id, type FROM {self.archive_schema}.agent_messages_archive
+                )
+                WHERE type = 'function_call'
+                GROUP BY 1
+            )
+            INSERT INTO conversation_stats
+            (conversation_id, day, start_time, end_time, customer_messages, bot_messages, tool_calls)
+            SELECT c.id, date(c.start_time, 'unixepoch'), c.start_time, c.end_time,
+                   COALESCE(m.customer_messages, 0), COALESCE(m.bot_messages, 0),
+                   COALESCE(t.tool_calls, 0)
+            FROM conversations c
+            LEFT JOIN chat_counts m ON m.conversation_id = c.id
+            LEFT JOIN tool_counts t ON t.conversation_id = c.id
+            """
+        )
+        self.cursor.execute(
+            """
+            INSERT INTO daily_stats
+            (day, conversations, ended_conversations, customer_messages,
+             bot_messages, tool_calls, total_duration)
+            SELECT day, COUNT(*), COUNT(end_time), SUM(customer_messages),
+                   SUM(bot_messages), SUM(tool_calls),
+                   SUM(CASE WHEN end_time IS NULL THEN 0
+                       ELSE MAX(end_time - start_time, 0) END)
+            FROM conversation_stats
+            GROUP BY day
+            """
+        )
+
+    def rebuild_analytics(self):
+        with self.lock:
+            try:
+                self._rebuild_analytics()
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def warm_up(self):
+        if self.db_path == ":memory:":
+            return
+
+        # Reads on a connection of its own, so the bot's writes never wait on
+        # the lock; what it warms is the OS cache both connections read from
+        conn = sqlite3.connect(f"{Path(self.db_path).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            # Walks the open conversations and their history, which is what
+            # the first turns after a restart read
+            ids = [r[0] for r in conn.execute(
+                "SELECT id FROM conversations WHERE end_time IS NULL")]
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ", ".join("?" * len(batch))
+                conn.execute(
+                    f"""
+                    SELECT COUNT(*), SUM(LENGTH(message))
+                    FROM chat_messages
+                    WHERE conversation_id IN ({placeholders})
+                    """,
+                    batch
+                ).fetchall()
+                # agent_messages.conversation_id is TEXT, compare as text to use its index
+                conn.execute(
+                    f"""
+                    SELECT COUNT(*), SUM(LENGTH(data)), SUM(LENGTH(payload))
+                    FROM agent_messages
+                    WHERE conversation_id IN ({placeholders})
+                    """,
+                    [str(id) for id in batch]
+                ).fetchall()
+            conn.execute("SELECT COUNT(*) FROM pending_sends").fetchall()
+        finally:
+            conn.close()
+
+    def search_messages(self, query, customer_id=None, since=None, until=None, limit=20, raw=False):
+        if not query.strip():
+            return []
+        if not self.search_enabled:
+            raise RuntimeError("This SQLite build has no FTS5, search is unavailable")
+
+        filters, params = [], [query if raw else _fts_query(query)]
+        if customer_id is not None:
+            filters.append("c.customer_id=?")
+            params.append(customer_id)
+        if since is not None:
+            filters.append("m.timestamp>=?")
+            params.append(since)
+        if until is not None:
+            filters.append("m.timestamp<?")
+            params.append(until)
+
+        # Live and archived messages have separate indexes, so bm25 scores
+        # from the two are close to but not strictly comparable
+        queries = [
+            f"""
+            SELECT m.id, m.conversation_id, m.sender, m.timestamp, m.message,
+                   c.customer_id,
+                   snippet({fts}, 0, '[', ']', '...', 12),
+                   bm25({fts}) AS rank
+            FROM {schema}.{fts}
+            JOIN {schema}.{table} m ON m.id = {fts}.rowid
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE {' AND '.join([f"{fts} MATCH ?"] + filters)}
+            """
+            for schema, table, fts in (
+                ("main", "chat_messages", "chat_messages_fts"),
+                (self.archive_schema, "chat_messages_archive", "chat_messages_archive_fts"),
+            )
+        ]
+
+        with self.lock:
+            self.cursor.execute(
+                f"""
+                SELECT * FROM ({queries[0]})
+                UNION ALL
+                SELECT * FROM ({queries[1]})
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (*params, *params, limit)
+            )
+            rows = self.cursor.fetchall()
+
+        return [
+            SearchHit(
+                message=ChatMessage(
+                    id=r[0],
+                    conversation_id=r[1],
+                    sender=r[2],
+                    timestamp=r[3],
+                    message=r[4],
+                ),
+                customer_id=r[5],
+                snippet=r[6],
+                rank=r[7],
+            )
+            for r in rows
+        ]
+
+    def get_conversation_stats(self, conversation_id: str):
+        with self.lock:
+            self.cursor.execute(
+                """
+                SELECT conversation_id, day, start_time, end_time,
+                       customer_messages, bot_messages, tool_calls
+                FROM conversation_stats
+                WHERE conversation_id=?
+                """,
+                (conversation_id,)
+            )
+            res = self.cursor.fetchone()
+
+        return ConversationStats(
+            conversation_id=str(res[0]),
+            day=res[1],
+            start_time=res[2],
+            end_time=res[3],
+            customer_messages=res[4],
+            bot_messages=res[5],
+            tool_calls=res[6],
+        ) if res else None
+
+    def get_daily_stats(self, since=None, until=None):
+        filters, params = [], []
+        if since is not None:
+            filters.append("day >= ?")
+            params.append(since)
+        if until is not None:
+            filters.append("day < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+
+        with self.lock:
+            self.cursor.execute(
+                f"""
+                SELECT day, conversations, ended_conversations, customer_messages,
+                       bot_messages, tool_calls, total_duration
+                FROM daily_stats
+                {where}
+                ORDER BY day
+                """,
+                params
+            )
+            rows = self.cursor.fetchall()
+
+        return [DailyStats(*row) for row in rows]
+
+    def create_conversation(self, customer_id, start_time, phone_number_id=None):
+        with self.lock:
+            self.cursor.execute(
+                """
+                INSERT INTO conversations
+                (customer_id, start_time, phone_number_id)
+                VALUES (?, ?, ?)
+                """,
+                (customer_id, start_time, phone_number_id)
+            )
+            self.conn.commit()
+            conversation_id = str(self.cursor.lastrowid)
         if not conversation_id:
             raise ValueError("Failed to start conversation with customer")
 
@@ -106,20 +872,22 @@ class SQLiteDatastore(BaseDatastore):
             start_time=start_time,
             end_time=None,
             intent=None,
+            phone_number_id=phone_number_id,
         )
 
-    def get_current_conversation(self, customer_id):
-        self.cursor.execute(
-            """
-            SELECT id, customer_id, start_time, end_time, intent
-            FROM conversations
-            WHERE customer_id=? AND end_time IS NULL
-            ORDER BY start_time DESC
-            LIMIT 1
-            """,
-            (customer_id,)
-        )
-        res = self.cursor.fetchone()
+    def get_current_conversation(self, customer_id, phone_number_id=None):
+        with self.lock:
+            self.cursor.execute(
+                """
+                SELECT id, customer_id, start_time, end_time, intent, phone_number_id
+                FROM conversations
+                WHERE customer_id=? AND phone_number_id IS ? AND end_time IS NULL
+                ORDER BY start_time DESC
+                LIMIT 1
+                """,
+                (customer_id, phone_number_id)
+            )
+            res = self.cursor.fetchone()
 
         return ConversationData(
             id=res[0],
@@ -127,79 +895,674 @@ class SQLiteDatastore(BaseDatastore):
             start_time=res[2],
             end_time=res[3],
             intent=res[4],
+            phone_number_id=res[5],
         ) if res else None
 
-    def end_conversation(self, customer_id: str, timestamp: int):
-        self.cursor.execute(
-            """
-            UPDATE conversations
-            SET end_time=?
-            WHERE customer_id=? AND end_time IS NULL
-            """,
-            (timestamp, customer_id)
-        )
-        self.conn.commit()
+    def end_conversation(self, customer_id: str, timestamp: int, phone_number_id: Optional[str] = None):
+        with self.lock:
+            self.cursor.execute(
+                """
+                UPDATE conversations
+                SET end_time=?
+                WHERE customer_id=? AND phone_number_id IS ? AND end_time IS NULL
+                """,
+                (timestamp, customer_id, phone_number_id)
+            )
+            self.conn.commit()
+
+    def set_conversation_intent(self, conversation_id: str, intent: str):
+        with self.lock:
+            self.cursor.execute(
+                """
+                UPDATE conversations
+                SET intent=?
+                WHERE id=?
+                """,
+                (intent, conversation_id)
+            )
+            self.conn.commit()
 
     def add_chat_message(self, conversation_id: str, sender: str, timestamp: int, message: str):
-        self.cursor.execute(
-            """
-            INSERT INTO chat_messages
-            (conversation_id, sender, timestamp, message)
-            VALUES (?, ?, ?, ?)
-            """,
-            (conversation_id, sender, timestamp, message)
-        )
-        self.conn.commit()
+        with self.lock:
+            self.cursor.execute(
+                """
+                INSERT INTO chat_messages
+                (conversation_id, sender, timestamp, message)
+                VALUES (?, ?, ?, ?)
+                """,
+                (conversation_id, sender, timestamp, message)
+            )
+            self.conn.commit()
 
-    def add_agent_message(self, conversation_id: str, type: str, sender: Sender, data: str):
-        self.cursor.execute(
-            """
-            INSERT INTO agent_messages
-            (conversation_id, type, sender, data)
-            VALUES (?, ?, ?, ?)
-            """,
-            (conversation_id, type, sender, data)
-        )
-        self.conn.commit()
+    def add_agent_message(self, conversation_id: str, type: str, sender: Sender, data: str, payload: Optional[bytes] = None):
+        with self.lock:
+            self.cursor.execute(
+                """
+                INSERT INTO agent_messages
+                (conversation_id, type, sender, data, payload)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (conversation_id, type, sender, data, payload)
+            )
+            self.conn.commit()
+
+    def update_agent_message(self, agent_message_id: str, data: str, payload: Optional[bytes]):
+        with self.lock:
+            self.cursor.execute(
+                """
+                UPDATE agent_messages
+                SET data=?, payload=?
+                WHERE id=?
+                """,
+                (data, payload, agent_message_id)
+            )
+            self.conn.commit()
+
+    def expire_idle_conversations(self, idle_before: int, timestamp: int):
+        with self.lock:
+            self.cursor.execute(
+                """
+                UPDATE conversations
+                SET end_time=?
+                WHERE end_time IS NULL AND COALESCE(
+                    (SELECT MAX(timestamp) FROM chat_messages
+                     WHERE conversation_id=conversations.id),
+                    start_time
+                ) < ?
+                """,
+                (timestamp, idle_before)
+            )
+            self.conn.commit()
+            return self.cursor.rowcount
+
+    def archive_conversations(self, ended_before: int, batch_size: int = 500):
+        with self.lock:
+            self.cursor.execute(
+                """
+                SELECT id FROM conversations
+                WHERE archived_at IS NULL AND end_time < ?
+                ORDER BY end_time
+                LIMIT ?
+                """,
+                (ended_before, batch_size)
+            )
+            ids = [r[0] for r in self.cursor.fetchall()]
+            if not ids:
+                return 0
+
+            placeholders = ", ".join("?" * len(ids))
+            try:
+                self.cursor.execute(
+                    f"""
+                    INSERT OR REPLACE INTO {self.archive_schema}.agent_messages_archive
+                    (id, conversation_id, type, sender, data, payload)
+                    SELECT id, conversation_id, type, sender, data, payload
+                    FROM agent_messages
+                    WHERE conversation_id IN ({placeholders})
+                    """,
+                    ids
+                )
+                # Rows left by an interrupted run are deleted rather than
+                # replaced, REPLACE would skip the search index triggers
+                self.cursor.execute(
+                    f"""
+                    DELETE FROM {self.archive_schema}.chat_messages_archive
+                    WHERE conversation_id IN ({placeholders})
+                    """,
+                    ids
+                )
+                self.cursor.execute(
+                    f"""
+                    INSERT INTO {self.archive_schema}.chat_messages_archive
+                    (id, conversation_id, sender, timestamp, message)
+                    SELECT id, conversation_id, sender, timestamp, message
+                    FROM chat_messages
+                    WHERE conversation_id IN ({placeholders})
+                    """,
+                    ids
+                )
+                self.cursor.execute(
+                    f"DELETE FROM agent_messages WHERE conversation_id IN ({placeholders})",
+                    ids
+                )
+                self.cursor.execute(
+                    f"DELETE FROM chat_messages WHERE conversation_id IN ({placeholders})",
+                    ids
+                )
+                self.cursor.execute(
+                    f"""
+                    UPDATE conversations
+                    SET archived_at=strftime('%s', 'now')
+                    WHERE id IN ({placeholders})
+                    """,
+                    ids
+                )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+            logger.debug("Archived %d conversations", len(ids))
+            return len(ids)
 
     def get_chat_messages(self, conversation_id: str):
-        self.cursor.execute(
-            """
-            SELECT id, conversation_id, sender, timestamp, message
-            FROM chat_messages
-            WHERE conversation_id=?
-            """,
-            (conversation_id,)
+        return list(self.iter_chat_messages(conversation_id))
+
+    def get_agent_messages(self, conversation_id: str):
+        return list(self.iter_agent_messages(conversation_id))
+
+    def _iter_pages(
+            self,
+            queries: List[str],
+            filters: List[str],
+            params: list,
+            keyset: str,
+            key,
+            order_by: str,
+            batch_size: int,
+    ):
+        """Runs `queries` page by page, resuming after the `key` of the last row.
+
+        Each page is a separate short query, so the shared connection is never
+        held for the whole iteration. With several queries (hot and archive
+        tables) every one is paged on its own index and the pages are merged.
+        """
+        last = None
+        while True:
+            conditions = list(filters)
+            page_params = list(params)
+            if last is not None:
+                conditions.append(keyset)
+                page_params.extend(last)
+
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            branches = [f"SELECT * FROM ({query.format(where=where)})" for query in queries]
+            with self.lock:
+                self.cursor.execute(
+                    f"{' UNION ALL '.join(branches)} ORDER BY {order_by} LIMIT ?",
+                    (*page_params, batch_size) * len(queries) + (batch_size,),
+                )
+                rows = self.cursor.fetchall()
+
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last = key(rows[-1])
+
+    def iter_conversations(self, customer_id=None, since=None, until=None, batch_size=500):
+        filters, params = [], []
+        if customer_id is not None:
+            filters.append("customer_id=?")
+            params.append(customer_id)
+        if since is not None:
+            filters.append("start_time>=?")
+            params.append(since)
+        if until is not None:
+            filters.append("start_time<?")
+            params.append(until)
+
+        rows = self._iter_pages(
+            [
+                """
+                SELECT id, customer_id, start_time, end_time, intent, phone_number_id
+                FROM conversations
+                {where}
+                ORDER BY id
+                LIMIT ?
+                """
+            ],
+            filters, params,
+            keyset="id > ?", key=lambda r: (r[0],),
+            order_by="id",
+            batch_size=batch_size,
         )
-        res = self.cursor.fetchall()
+        for r in rows:
+            yield ConversationData(
+                id=r[0],
+                customer_id=r[1],
+                start_time=r[2],
+                end_time=r[3],
+                intent=r[4],
+                phone_number_id=r[5],
+            )
 
-        return [
-            ChatMessage(
+    def iter_chat_messages(self, conversation_id=None, customer_id=None, since=None, until=None, batch_size=500,
+                           include_archived=True):
+        filters, params = [], []
+        if conversation_id is not None:
+            filters.append("m.conversation_id=?")
+            params.append(conversation_id)
+        if customer_id is not None:
+            filters.append(
+                "m.conversation_id IN (SELECT id FROM conversations WHERE customer_id=?)")
+            params.append(customer_id)
+        if since is not None:
+            filters.append("m.timestamp>=?")
+            params.append(since)
+        if until is not None:
+            filters.append("m.timestamp<?")
+            params.append(until)
+
+        tables = ["chat_messages"]
+        if include_archived:
+            tables.append(f"{self.archive_schema}.chat_messages_archive")
+
+        rows = self._iter_pages(
+            [
+                f"""
+                SELECT m.id, m.conversation_id, m.sender, m.timestamp, m.message
+                FROM {table} m
+                {{where}}
+                ORDER BY m.timestamp, m.id
+                LIMIT ?
+                """
+                for table in tables
+            ],
+            filters, params,
+            keyset="(m.timestamp, m.id) > (?, ?)", key=lambda r: (r[3], r[0]),
+            order_by="timestamp, id",
+            batch_size=batch_size,
+        )
+        for r in rows:
+            yield ChatMessage(
                 id=r[0],
                 conversation_id=r[1],
                 sender=r[2],
                 timestamp=r[3],
                 message=r[4],
-            ) for r in res
-        ]
+            )
 
-    def get_agent_messages(self, conversation_id: str):
-        self.cursor.execute(
-            """
-            SELECT id, conversation_id, type, sender, data
-            FROM agent_messages
-            WHERE conversation_id=?
-            """,
-            (conversation_id,)
-        )
-        res = self.cursor.fetchall()
+    def iter_agent_messages(self, conversation_id=None, batch_size=500, include_archived=True):
+        filters, params = [], []
+        if conversation_id is not None:
+            filters.append("conversation_id=?")
+            params.append(conversation_id)
 
-        return [
-            AgentMessage(
+        tables = ["agent_messages"]
+        if include_archived:
+            tables.append(f"{self.archive_schema}.agent_messages_archive")
+
+        rows = self._iter_pages(
+            [
+                f"""
+                SELECT id, conversation_id, type, sender, data, payload
+                FROM {table}
+                {{where}}
+                ORDER BY id
+                LIMIT ?
+                """
+                for table in tables
+            ],
+            filters, params,
+            keyset="id > ?", key=lambda r: (r[0],),
+            order_by="id",
+            batch_size=batch_size,
+        )
+        for r in rows:
+            yield AgentMessage(
                 id=r[0],
                 conversation_id=r[1],
                 type=r[2],
                 sender=r[3],
                 data=r[4],
+                payload=r[5],
+            )
+
+    def add_pending_send(self, recipient: str, payload: str, created_at: int, phone_number_id=None):
+        with self.lock:
+            self.cursor.execute(
+                """
+                INSERT INTO pending_sends
+                (recipient, payload, created_at, phone_number_id)
+                VALUES (?, ?, ?, ?)
+                """,
+                (recipient, payload, created_at, phone_number_id)
+            )
+            self.conn.commit()
+            return str(self.cursor.lastrowid)
+
+    def remove_pending_send(self, pending_send_id: str):
+        with self.lock:
+            self.cursor.execute(
+                """
+                DELETE FROM pending_sends
+                WHERE id=?
+                """,
+                (pending_send_id,)
+            )
+            self.conn.commit()
+
+    def _get_pending_sends(self, failed: bool, phone_number_id: Optional[str]):
+        with self.lock:
+            self.cursor.execute(
+                f"""
+                SELECT id, recipient, payload, created_at, failed_at, error
+                FROM pending_sends
+                WHERE failed_at IS {'NOT NULL' if failed else 'NULL'}
+                AND phone_number_id IS ?
+                ORDER BY id
+                """,
+                (phone_number_id,)
+            )
+            res = self.cursor.fetchall()
+
+        return [
+            PendingSend(
+                id=str(r[0]),
+                recipient=r[1],
+                payload=r[2],
+                created_at=r[3],
+                failed_at=r[4],
+                error=r[5],
             ) for r in res
         ]
+
+    def get_pending_sends(self, phone_number_id=None):
+        return self._get_pending_sends(False, phone_number_id)
+
+    def get_failed_sends(self, phone_number_id=None):
+        return self._get_pending_sends(True, phone_number_id)
+
+    def mark_pending_send_failed(self, pending_send_id: str, failed_at: int, error: str):
+        with self.lock:
+            self.cursor.execute(
+                """
+                UPDATE pending_sends
+                SET failed_at=?, error=?
+                WHERE id=?
+                """,
+                (failed_at, error, pending_send_id)
+            )
+            self.conn.commit()
+
+    def add_uploaded_media(self, media: UploadedMedia):
+        with self.lock:
+            self.cursor.execute(
+                """
+                INSERT OR REPLACE INTO uploaded_media
+                (phone_number_id, digest, mime_type, media_id, uploaded_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (media.phone_number_id, media.digest, media.mime_type,
+                 media.media_id, media.uploaded_at)
+            )
+            self.conn.commit()
+
+    def get_uploaded_media(self, phone_number_id: str, digest: str, mime_type: str):
+        with self.lock:
+            self.cursor.execute(
+                """
+                SELECT phone_number_id, digest, mime_type, media_id, uploaded_at
+                FROM uploaded_media
+                WHERE phone_number_id=? AND digest=? AND mime_type=?
+                """,
+                (phone_number_id, digest, mime_type)
+            )
+            res = self.cursor.fetchone()
+
+        return UploadedMedia(
+            phone_number_id=res[0],
+            digest=res[1],
+            mime_type=res[2],
+            media_id=res[3],
+            uploaded_at=res[4],
+        ) if res else None
+
+    def remove_uploaded_media(self, phone_number_id: str, digest: str, mime_type: str):
+        with self.lock:
+            self.cursor.execute(
+                """
+                DELETE FROM uploaded_media
+                WHERE phone_number_id=? AND digest=? AND mime_type=?
+                """,
+                (phone_number_id, digest, mime_type)
+            )
+            self.conn.commit()
+
+
+class ShardedSQLiteDatastore(BaseDatastore):
+    """Spreads customers over several SQLite files so writes don't share one lock.
+
+    A customer is hashed onto a shard with crc32 and every conversation and
+    message of that customer lives there. Conversation and agent message ids
+    are returned as "<shard>:<id>" so later calls can be routed without a
+    lookup. `db_path="bot.db"` with 4 shards uses bot.0.db to bot.3.db.
+    Uploaded media is shared by all customers and kept on shard 0.
+
+    Changing the number of shards moves customers between files, pick it
+    once for a database.
+    """
+
+    def __init__(self, db_path, shards: int = 4, archive_path=None):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+
+        self.db_path = db_path
+        self.archive_path = archive_path
+        self.shards = [
+            SQLiteDatastore(
+                self._shard_path(db_path, i),
+                self._shard_path(archive_path, i) if archive_path else None,
+            )
+            for i in range(shards)
+        ]
+
+    @staticmethod
+    def _shard_path(path: str, index: int) -> str:
+        path = Path(path)
+        return str(path.with_name(f"{path.stem}.{index}{path.suffix}"))
+
+    def _customer_shard(self, customer_id: str) -> Tuple[int, SQLiteDatastore]:
+        index = zlib.crc32(str(customer_id).encode()) % len(self.shards)
+        return index, self.shards[index]
+
+    def _route(self, id: str) -> Tuple[int, SQLiteDatastore, str]:
+        shard, sep, local_id = str(id).partition(":")
+        if not sep or not shard.isdigit() or int(shard) >= len(self.shards):
+            raise ValueError(f"Not a sharded id: {id}")
+        return int(shard), self.shards[int(shard)], local_id
+
+    @staticmethod
+    def _global(shard: int, id) -> str:
+        return f"{shard}:{id}"
+
+    def _conversation(self, shard: int, conversation: Optional[ConversationData]):
+        if conversation is None:
+            return None
+        return replace(conversation, id=self._global(shard, conversation.id))
+
+    def _chat_message(self, shard: int, message: ChatMessage):
+        return replace(
+            message,
+            id=self._global(shard, message.id),
+            conversation_id=self._global(shard, message.conversation_id),
+        )
+
+    def _agent_message(self, shard: int, message: AgentMessage):
+        return replace(
+            message,
+            id=self._global(shard, message.id),
+            conversation_id=self._global(shard, message.conversation_id),
+        )
+
+    def create_tables(self):
+        for shard in self.shards:
+            shard.create_tables()
+
+    def create_conversation(self, customer_id, start_time, phone_number_id=None):
+        index, shard = self._customer_shard(customer_id)
+        return self._conversation(
+            index, shard.create_conversation(customer_id, start_time, phone_number_id))
+
+    def get_current_conversation(self, customer_id, phone_number_id=None):
+        index, shard = self._customer_shard(customer_id)
+        return self._conversation(
+            index, shard.get_current_conversation(customer_id, phone_number_id))
+
+    def end_conversation(self, customer_id: str, timestamp: int, phone_number_id: Optional[str] = None):
+        _, shard = self._customer_shard(customer_id)
+        shard.end_conversation(customer_id, timestamp, phone_number_id)
+
+    def set_conversation_intent(self, conversation_id: str, intent: str):
+        _, shard, local_id = self._route(conversation_id)
+        shard.set_conversation_intent(local_id, intent)
+
+    def add_chat_message(self, conversation_id: str, sender: str, timestamp: int, message: str):
+        _, shard, local_id = self._route(conversation_id)
+        shard.add_chat_message(local_id, sender, timestamp, message)
+
+    def add_agent_message(self, conversation_id: str, type: str, sender: Sender, data: str, payload: Optional[bytes] = None):
+        _, shard, local_id = self._route(conversation_id)
+        shard.add_agent_message(local_id, type, sender, data, payload)
+
+    def update_agent_message(self, agent_message_id: str, data: str, payload: Optional[bytes]):
+        _, shard, local_id = self._route(agent_message_id)
+        shard.update_agent_message(local_id, data, payload)
+
+    def get_chat_messages(self, conversation_id: str):
+        return list(self.iter_chat_messages(conversation_id))
+
+    def get_agent_messages(self, conversation_id: str):
+        return list(self.iter_agent_messages(conversation_id))
+
+    def expire_idle_conversations(self, idle_before: int, timestamp: int):
+        return sum(s.expire_idle_conversations(idle_before, timestamp) for s in self.shards)
+
+    def archive_conversations(self, ended_before: int, batch_size: int = 500):
+        return sum(s.archive_conversations(ended_before, batch_size) for s in self.shards)
+
+    def iter_conversations(self, customer_id=None, since=None, until=None, batch_size=500):
+        """Yields conversations shard by shard, ordered by id within a shard."""
+        if customer_id is not None:
+            shards = [self._customer_shard(customer_id)]
+        else:
+            shards = list(enumerate(self.shards))
+
+        for index, shard in shards:
+            for conversation in shard.iter_conversations(customer_id, since, until, batch_size):
+                yield self._conversation(index, conversation)
+
+    def iter_chat_messages(self, conversation_id=None, customer_id=None, since=None, until=None, batch_size=500,
+                           include_archived=True):
+        """Yields chat messages ordered by timestamp, merged across shards."""
+        if conversation_id is not None:
+            index, shard, conversation_id = self._route(conversation_id)
+            shards = [(index, shard)]
+        elif customer_id is not None:
+            shards = [self._customer_shard(customer_id)]
+        else:
+            shards = list(enumerate(self.shards))
+
+        def messages(index, shard):
+            for message in shard.iter_chat_messages(
+                    conversation_id, customer_id, since, until, batch_size, include_archived):
+                yield self._chat_message(index, message)
+
+        # Each shard is already in (timestamp, id) order, merge streams them
+        yield from heapq.merge(
+            *(messages(index, shard) for index, shard in shards),
+            key=lambda m: m.timestamp,
+        )
+
+    def iter_agent_messages(self, conversation_id=None, batch_size=500, include_archived=True):
+        """Yields agent messages shard by shard, ordered by id within a shard."""
+        if conversation_id is not None:
+            index, shard, conversation_id = self._route(conversation_id)
+            shards = [(index, shard)]
+        else:
+            shards = list(enumerate(self.shards))
+
+        for index, shard in shards:
+            for message in shard.iter_agent_messages(conversation_id, batch_size, include_archived):
+                yield self._agent_message(index, message)
+
+    def warm_up(self):
+        for shard in self.shards:
+            shard.warm_up()
+
+    def search_messages(self, query, customer_id=None, since=None, until=None, limit=20, raw=False):
+        """Searches every shard and merges the hits by rank.
+
+        The ranking is approximate: bm25 weighs terms by how rare they are
+        in each shard, so equal matches from different shards can score
+        slightly differently.
+        """
+        if customer_id is not None:
+            shards = [self._customer_shard(customer_id)]
+        else:
+            shards = list(enumerate(self.shards))
+
+        hits = [
+            replace(hit, message=self._chat_message(index, hit.message))
+            for index, shard in shards
+            for hit in shard.search_messages(query, customer_id, since, until, limit, raw)
+        ]
+        return sorted(hits, key=lambda hit: hit.rank)[:limit]
+
+    def get_conversation_stats(self, conversation_id: str):
+        index, shard, local_id = self._route(conversation_id)
+        stats = shard.get_conversation_stats(local_id)
+        if stats is None:
+            return None
+        return replace(stats, conversation_id=self._global(index, stats.conversation_id))
+
+    def get_daily_stats(self, since=None, until=None):
+        days: Dict[str, DailyStats] = {}
+        for stats in chain.from_iterable(s.get_daily_stats(since, until) for s in self.shards):
+            total = days.get(stats.day)
+            if total is None:
+                days[stats.day] = stats
+                continue
+            days[stats.day] = DailyStats(
+                day=stats.day,
+                conversations=total.conversations + stats.conversations,
+                ended_conversations=total.ended_conversations + stats.ended_conversations,
+                customer_messages=total.customer_messages + stats.customer_messages,
+                bot_messages=total.bot_messages + stats.bot_messages,
+                tool_calls=total.tool_calls + stats.tool_calls,
+                total_duration=total.total_duration + stats.total_duration,
+            )
+        return [days[day] for day in sorted(days)]
+
+    def rebuild_analytics(self):
+        for shard in self.shards:
+            shard.rebuild_analytics()
+
+    def add_pending_send(self, recipient: str, payload: str, created_at: int, phone_number_id=None):
+        index, shard = self._customer_shard(recipient)
+        return self._global(
+            index, shard.add_pending_send(recipient, payload, created_at, phone_number_id))
+
+    def remove_pending_send(self, pending_send_id: str):
+        _, shard, local_id = self._route(pending_send_id)
+        shard.remove_pending_send(local_id)
+
+    def get_pending_sends(self, phone_number_id=None):
+        sends = [
+            replace(send, id=self._global(index, send.id))
+            for index, shard in enumerate(self.shards)
+            for send in shard.get_pending_sends(phone_number_id)
+        ]
+        # Keep the oldest first across shards, as a single database would
+        return sorted(sends, key=lambda send: send.created_at)
+
+    def mark_pending_send_failed(self, pending_send_id: str, failed_at: int, error: str):
+        _, shard, local_id = self._route(pending_send_id)
+        shard.mark_pending_send_failed(local_id, failed_at, error)
+
+    def get_failed_sends(self, phone_number_id=None):
+        sends = [
+            replace(send, id=self._global(index, send.id))
+            for index, shard in enumerate(self.shards)
+            for send in shard.get_failed_sends(phone_number_id)
+        ]
+        return sorted(sends, key=lambda send: send.created_at)
+
+    def add_uploaded_media(self, media: UploadedMedia):
+        self.shards[0].add_uploaded_media(media)
+
+    def get_uploaded_media(self, phone_number_id: str, digest: str, mime_type: str):
+        return self.shards[0].get_uploaded_media(phone_number_id, digest, mime_type)
+
+    def remove_uploaded_media(self, phone_number_id: str, digest: str, mime_type: str):
+        self.shards[0].remove_uploaded_media(phone_number_id, digest, mime_type)
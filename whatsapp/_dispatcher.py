@@ -0,0 +1,185 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from whatsapp.utils import percentile
+from whatsapp._datastore import BaseDatastore
+from whatsapp.reply_message import Message as ReplyMessage
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _QueuedSend:
+    message: ReplyMessage
+    enqueued_at: float
+    id: Optional[str] = None
+
+
+class SendDispatcher:
+    """Delivers replies on its own pool, in FIFO order for each recipient.
+
+    Every queued reply is persisted to the datastore (when one is configured)
+    until the Graph API accepts it, so pending sends survive a restart.
+    Replies that run out of retries stay in the datastore as failed sends,
+    see `resend_failed`.
+    """
+
+    def __init__(
+            self,
+            send: Callable[[ReplyMessage], bool],
+            datastore: Optional[BaseDatastore] = None,
+            max_workers: int = 4,
+            max_retries: int = 5,
+            backoff: float = 0.5,
+            max_backoff: float = 30.0,
+            phone_number_id: Optional[str] = None,
+    ):
+        self._send = send
+        self.datastore = datastore
+        # Sends are persisted per business number, so dispatchers sharing a
+        # datastore only restore their own
+        self.phone_number_id = phone_number_id
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[_QueuedSend]] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="whatsapp-send")
+
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def submit(self, message: ReplyMessage):
+        """Queues a reply for delivery and returns immediately."""
+        queued = _QueuedSend(message=message, enqueued_at=time.time())
+        if self.datastore:
+            queued.id = self.datastore.add_pending_send(
+                message.to,
+                message.model_dump_json(),
+                int(queued.enqueued_at),
+                self.phone_number_id,
+            )
+        self._enqueue(queued)
+
+    def restore(self):
+        """Re-queues sends that were still pending when the process stopped."""
+        if not self.datastore:
+            return
+
+        pending_sends = self.datastore.get_pending_sends(self.phone_number_id)
+        if pending_sends:
+            logger.info("Restoring %d pending sends", len(pending_sends))
+
+        for pending in pending_sends:
+            self._enqueue(_QueuedSend(
+                id=pending.id,
+                enqueued_at=float(pending.created_at),
+                message=ReplyMessage.model_validate_json(pending.payload),
+            ))
+
+    def resend_failed(self, ids: Optional[Iterable[str]] = None) -> int:
+        """Queues failed sends (all, or those in `ids`) for delivery again."""
+        if not self.datastore:
+            return 0
+
+        failed_sends = self.datastore.get_failed_sends(self.phone_number_id)
+        if ids is not None:
+            ids = set(ids)
+            failed_sends = [send for send in failed_sends if send.id in ids]
+
+        for failed in failed_sends:
+            self.datastore.remove_pending_send(failed.id)
+            self.submit(ReplyMessage.model_validate_json(failed.payload))
+        return len(failed_sends)
+
+    def _enqueue(self, queued: _QueuedSend):
+        recipient = queued.message.to
+        with self._lock:
+            queue = self._queues.get(recipient)
+            if queue is not None:
+                # A drain is already running for this recipient
+                queue.append(queued)
+                return
+            self._queues[recipient] = deque([queued])
+        self._executor.submit(self._drain, recipient)
+
+    def _drain(self, recipient: str):
+        while True:
+            with self._lock:
+                queue = self._queues[recipient]
+                if not queue:
+                    del self._queues[recipient]
+                    return
+                queued = queue[0]
+
+            self._deliver(queued)
+
+            with self._lock:
+                queue.popleft()
+
+    def _deliver(self, queued: _QueuedSend):
+        error = "Rejected by the Graph API"
+        for attempt in range(self.max_retries + 1):
+            try:
+                # send() strips uploaded media from the message, so each
+                # attempt gets its own copy
+                ok = self._send(queued.message.model_copy(deep=True))
+            except Exception as e:
+                logger.warning("Send to %s failed: %s",
+                               queued.message.to, e)
+                error = str(e)
+                ok = False
+
+            if ok:
+                with self._lock:
+                    self.sent += 1
+                    self._latencies.append(time.time() - queued.enqueued_at)
+                break
+
+            if attempt < self.max_retries:
+                with self._lock:
+                    self.retried += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        else:
+            with self._lock:
+                self.failed += 1
+            logger.error("Giving up on send to %s after %d attempts",
+                         queued.message.to, self.max_retries + 1)
+            if self.datastore and queued.id is not None:
+                self.datastore.mark_pending_send_failed(
+                    queued.id, int(time.time()), error)
+            return
+
+        if self.datastore and queued.id is not None:
+            self.datastore.remove_pending_send(queued.id)
+
+    def stats(self):
+        """Returns delivery counters and send-queue latency in seconds."""
+        with self._lock:
+            latencies = list(self._latencies)
+            pending = sum(len(q) for q in self._queues.values())
+
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "pending": pending,
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "latency_max": max(latencies, default=0.0),
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
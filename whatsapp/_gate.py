@@ -0,0 +1,49 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Deque
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyGate:
+    """Runs at most `limit` tasks at a time on a shared executor.
+
+    Excess tasks wait in the gate rather than in the executor, so one busy
+    tenant cannot fill the shared pool and starve the others.
+    """
+
+    def __init__(self, executor: Executor, limit: int):
+        self.executor = executor
+        self.limit = limit
+        self.running = 0
+        self._lock = threading.Lock()
+        self._pending: Deque[Callable[[], None]] = deque()
+
+    def submit(self, func: Callable[[], None]):
+        with self._lock:
+            if self.running >= self.limit:
+                self._pending.append(func)
+                return
+            self.running += 1
+        self.executor.submit(self._run, func)
+
+    def _run(self, func: Callable[[], None]):
+        try:
+            func()
+        except Exception as e:
+            logger.error("Task failed: %s", e)
+        finally:
+            with self._lock:
+                if self._pending:
+                    func = self._pending.popleft()
+                else:
+                    self.running -= 1
+                    return
+            self.executor.submit(self._run, func)
+
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._pending)
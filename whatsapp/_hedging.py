@@ -0,0 +1,113 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, TypeVar
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    TimeoutError,
+    wait,
+)
+
+from whatsapp.utils import percentile
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class HedgingPolicy:
+    """Fires a duplicate request when the first one is slower than usual.
+
+    The hedge delay is the `percentile` of recently observed latencies,
+    clamped to [min_delay, max_delay] (max_delay until `min_samples` calls
+    have been seen). At most `budget` extra requests per request made are
+    allowed, e.g. 0.05 for 5%. Whichever attempt finishes first wins and the
+    other result is discarded, so callers must only act on the returned value.
+    """
+
+    def __init__(
+            self,
+            percentile: float = 95,
+            min_delay: float = 0.5,
+            max_delay: float = 10.0,
+            budget: float = 0.05,
+            min_samples: int = 20,
+            max_workers: int = 16,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=500)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="whatsapp-hedge")
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self) -> float:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.max_delay
+            latency = percentile(list(self._latencies), self.percentile)
+        return min(self.max_delay, max(self.min_delay, latency))
+
+    def _timed(self, func: Callable[[], T]) -> Callable[[], T]:
+        def run():
+            start = time.monotonic()
+            result = func()
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+            return result
+        return run
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def run(self, primary: Callable[[], T], hedge: Callable[[], T]) -> T:
+        with self._lock:
+            self.requests += 1
+
+        first = self._executor.submit(self._timed(primary))
+        try:
+            return first.result(timeout=self.delay())
+        except TimeoutError:
+            pass
+
+        if not self._take_budget():
+            return first.result()
+
+        logger.debug("Hedging slow Gemini request")
+        second = self._executor.submit(self._timed(hedge))
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [f for f in done if f.exception() is None]
+            if succeeded:
+                if succeeded[0] is second:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return succeeded[0].result()
+            if not pending:
+                # Both attempts failed, surface the last error
+                return done.pop().result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+            }
@@ -0,0 +1,31 @@
+import threading
+
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session(pool_maxsize: int = 32):
+    """Returns the process-wide pooled HTTP session, creating it on first use.
+
+    `requests` is imported here rather than at module level so importing the
+    framework stays cheap until the first Graph API call.
+    """
+    global _session
+
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=pool_maxsize,
+                    pool_maxsize=pool_maxsize,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+
+    return _session
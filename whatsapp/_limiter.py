@@ -0,0 +1,215 @@
+import time
+import random
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Callable, Literal, Optional, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Raised by google.api_core when quota is exhausted or the backend is unhealthy
+RETRYABLE_ERRORS = {
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "DeadlineExceeded",
+}
+
+
+def is_retryable(error: Exception) -> bool:
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & RETRYABLE_ERRORS) or getattr(error, "code", None) in (429, 503)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at `per_minute` tokens a minute.
+
+    Holds at most `capacity` tokens (a minute's worth by default), which bounds
+    the burst allowed after an idle period.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.capacity = float(capacity or per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount: float):
+        """Charges (or refunds, if negative) tokens after the real usage is known."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets a single
+    trial call through once `reset_timeout` seconds have passed.
+
+    Only the trial's outcome moves the breaker out of half-open, outcomes of
+    calls let through while it was closed are recorded with `trial=False`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state: Literal["closed", "open", "half_open"] = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[Literal["closed", "half_open"]]:
+        """Returns the state the call is let through in, None if it is not."""
+        with self._lock:
+            if self.state == "closed":
+                return "closed"
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return "half_open"
+            return None
+
+    def record_success(self, trial: bool = True):
+        with self._lock:
+            if self.state != "closed" and not trial:
+                return
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self, trial: bool = True):
+        with self._lock:
+            if self.state != "closed" and not trial:
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("Gemini circuit breaker opened")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class GeminiLimiter:
+    """Shared gate in front of Gemini calls.
+
+    Caps concurrent calls, paces requests and prompt tokens per minute with
+    token buckets, retries quota and availability errors with jittered
+    exponential backoff, and fails fast through a circuit breaker while the
+    backend keeps failing. One limiter can be shared by several agents that
+    use the same API key.
+    """
+
+    def __init__(
+            self,
+            max_in_flight: Optional[int] = None,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            max_retries: int = 3,
+            backoff: float = 1.0,
+            max_backoff: float = 30.0,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30.0,
+    ):
+        self._semaphore = (
+            threading.BoundedSemaphore(max_in_flight)
+            if max_in_flight else None
+        )
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def call(self, func: Callable[[], T], estimated_tokens: int = 0) -> T:
+        admitted = self.breaker.allow()
+        if not admitted:
+            with self._lock:
+                self.rejected += 1
+            raise CircuitOpenError("Gemini is unavailable, circuit breaker is open")
+
+        # Calls that started while closed can still be running when the
+        # breaker opens, their outcome must not decide the trial's
+        trial = admitted == "half_open"
+        attempt = 0
+        succeeded = False
+        exhausted = False
+        try:
+            while True:
+                with self._semaphore or nullcontext():
+                    if self.requests:
+                        self.requests.acquire(1)
+                    if self.tokens:
+                        self.tokens.acquire(estimated_tokens)
+
+                    with self._lock:
+                        self.calls += 1
+                    try:
+                        result = func()
+                    except Exception as e:
+                        if not is_retryable(e):
+                            raise
+                        if attempt == self.max_retries:
+                            exhausted = True
+                            raise
+                        logger.warning("Gemini call failed, retrying: %s", e)
+                    else:
+                        succeeded = True
+                        self._charge_usage(result, estimated_tokens)
+                        return result
+
+                with self._lock:
+                    self.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+        finally:
+            if succeeded:
+                self.breaker.record_success(trial)
+            elif trial or exhausted:
+                # Whatever ended the trial call other than a success
+                # re-opens the breaker
+                self.breaker.record_failure(trial)
+
+    def _charge_usage(self, result, estimated_tokens: int):
+        usage = getattr(result, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        if self.tokens and prompt_tokens:
+            self.tokens.adjust(prompt_tokens - estimated_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "circuit": self.breaker.state,
+            }
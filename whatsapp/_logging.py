@@ -0,0 +1,129 @@
+import sys
+import copy
+import json
+import atexit
+import random
+import logging
+import logging.handlers
+from queue import SimpleQueue
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from whatsapp._turn import current_turn
+
+
+class TurnContextFilter(logging.Filter):
+    """Stamps records with the conversation and trace id of the current turn.
+
+    Must run on the emitting thread, the turn is thread-local.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        turn = current_turn()
+        record.conversation_id = turn.conversation_id if turn else None
+        record.trace_id = turn.trace_id if turn else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of DEBUG records per logger, e.g. {"whatsapp.agent_interface": 0.1}.
+
+    Rates apply to the named logger and its children, the most specific wins.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < self._rate(record.name)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key in ("conversation_id", "trace_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only snapshot what can change after the call returns or can't be
+        # pickled, the listener does the formatting
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def stop(self):
+        # Safe to call twice, once by the caller and once at exit
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(
+        level: int = logging.INFO,
+        handler: Optional[logging.Handler] = None,
+        sample: Optional[Dict[str, float]] = None,
+        json_format: bool = True,
+        logger_name: str = "whatsapp",
+) -> logging.handlers.QueueListener:
+    """Routes the framework's logs through a queue to a background writer.
+
+    Worker threads only enqueue records, formatting and I/O happen on the
+    listener thread. Records are written to `handler` (stderr by default)
+    as JSON lines carrying the conversation and trace id of the turn that
+    logged them. Returns the started listener, which is stopped at exit.
+    """
+    if handler is None:
+        handler = logging.StreamHandler(sys.stderr)
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+
+    queue: SimpleQueue = SimpleQueue()
+    queue_handler = _QueueHandler(queue)
+    queue_handler.addFilter(TurnContextFilter())
+    if sample:
+        queue_handler.addFilter(SamplingFilter(sample))
+
+    logger = logging.getLogger(logger_name)
+    for existing in list(logger.handlers):
+        if isinstance(existing, logging.handlers.QueueHandler):
+            logger.removeHandler(existing)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener = _QueueListener(queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,286 @@
+import os
+import re
+import time
+import base64
+import hashlib
+import logging
+import binascii
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+from whatsapp._types import UploadedMedia
+from whatsapp._datastore import BaseDatastore
+
+
+logger = logging.getLogger(__name__)
+
+# The Graph API keeps uploaded media for 30 days, keep a day of headroom
+MEDIA_ID_TTL = 29 * 24 * 60 * 60
+
+# Graph API errors meaning a media id can no longer be used: media download
+# and upload errors, or an invalid parameter naming the media id
+MEDIA_ERROR_CODES = (131052, 131053)
+INVALID_PARAMETER = 100
+
+# Only files named by digest_key are managed, anything else under the root is left alone
+_MEDIA_FILE = re.compile(r"[0-9a-f]{64}(\.\w+)?")
+
+
+def digest_key(sha256: str) -> str:
+    """Normalizes a WhatsApp sha256 (hex or base64) into a filename-safe hex key."""
+    value = sha256.strip()
+    if len(value) == 64:
+        try:
+            int(value, 16)
+            return value.lower()
+        except ValueError:
+            pass
+
+    try:
+        raw = base64.b64decode(value, validate=True)
+        if len(raw) == 32:
+            return raw.hex()
+    except (binascii.Error, ValueError):
+        pass
+
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def is_media_error(error: dict) -> bool:
+    """Tells whether a Graph API error object rejects the media id that was sent."""
+    code = error.get("code")
+    if code in MEDIA_ERROR_CODES:
+        return True
+    return code == INVALID_PARAMETER and "media" in str(error.get("message", "")).lower()
+
+
+class MediaStore:
+    """Content-addressed cache of downloaded media, keyed by sha256.
+
+    Files live in `root` as `<sha256><ext>`. The least recently used files are
+    evicted once the directory grows past `max_bytes`; recency is kept in the
+    file mtimes so it survives restarts. Files held with `pinned` are not
+    evicted. Other files in `root` are ignored.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 1024 ** 3):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._files: "OrderedDict[str, Path]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._pins: Counter = Counter()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load()
+
+    def _load(self):
+        if not self.root.is_dir():
+            return
+
+        files = [f for f in self.root.iterdir()
+                 if f.is_file() and _MEDIA_FILE.fullmatch(f.name)]
+        files.sort(key=lambda f: f.stat().st_mtime)
+        for file in files:
+            size = file.stat().st_size
+            self._files[file.stem] = file
+            self._sizes[file.stem] = size
+            self.total_bytes += size
+
+        self._evict()
+
+    def get(self, sha256: str) -> Optional[Path]:
+        key = digest_key(sha256)
+        with self._lock:
+            path = self._files.get(key)
+            if path is None or not path.exists():
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._files.move_to_end(key)
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, sha256: str, extension: str, content: bytes) -> Path:
+        key = digest_key(sha256)
+        path = self.root / f"{key}{extension}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so readers never see partial media
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as file:
+            file.write(content)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self.total_bytes -= self._sizes.get(key, 0)
+            self._files[key] = path
+            self._files.move_to_end(key)
+            self._sizes[key] = len(content)
+            self.total_bytes += len(content)
+            self._evict()
+
+        return path
+
+    @contextmanager
+    def pinned(self, path: Path) -> Iterator[bool]:
+        """Keeps `path` from being evicted, yields whether it still exists."""
+        key = Path(path).stem
+        with self._lock:
+            self._pins[key] += 1
+        try:
+            yield Path(path).exists()
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                self._evict()
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        # Never evict the most recent entry, it is about to be handed out
+        for key in list(self._files)[:-1]:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            path = self._files.pop(key)
+            self.total_bytes -= self._sizes.pop(key, 0)
+            self.evictions += 1
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            logger.debug("Evicted media %s", path)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "files": len(self._files),
+                "bytes": self.total_bytes,
+            }
+
+
+class UploadCache:
+    """Caches Graph API media ids by file content and mime type.
+
+    Entries are kept in memory and, when a datastore is configured, persisted
+    so repeat sends of the same file skip the upload after a restart too.
+    Both in-memory maps keep the `max_entries` most recently used keys.
+    """
+
+    def __init__(
+            self,
+            datastore: Optional[BaseDatastore] = None,
+            ttl: int = MEDIA_ID_TTL,
+            max_entries: int = 10_000,
+    ):
+        self.datastore = datastore
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, str], UploadedMedia]" = OrderedDict()
+        # (path, size, mtime) -> digest, so unchanged files are hashed once
+        self._digests: "OrderedDict[Tuple[str, int, float], str]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def file_digest(self, filename: str) -> str:
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest:
+                self._digests.move_to_end(key)
+                return digest
+
+        sha256 = hashlib.sha256()
+        with open(filename, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+
+        with self._lock:
+            self._digests[key] = digest
+            self._trim(self._digests)
+        return digest
+
+    def _trim(self, entries: OrderedDict):
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def get(self, phone_number_id: str, digest: str, mime_type: str) -> Optional[str]:
+        key = (phone_number_id, digest, mime_type)
+        with self._lock:
+            media = self._entries.get(key)
+
+        if media is None and self.datastore:
+            media = self.datastore.get_uploaded_media(*key)
+
+        if media is None or time.time() - media.uploaded_at > self.ttl:
+            with self._lock:
+                self._entries.pop(key, None)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self._entries[key] = media
+            self._entries.move_to_end(key)
+            self._trim(self._entries)
+            self.hits += 1
+        return media.media_id
+
+    def put(self, phone_number_id: str, digest: str, mime_type: str, media_id: str):
+        media = UploadedMedia(
+            phone_number_id=phone_number_id,
+            digest=digest,
+            mime_type=mime_type,
+            media_id=media_id,
+            uploaded_at=int(time.time()),
+        )
+        key = (phone_number_id, digest, mime_type)
+        with self._lock:
+            self._entries[key] = media
+            self._entries.move_to_end(key)
+            self._trim(self._entries)
+        if self.datastore:
+            self.datastore.add_uploaded_media(media)
+
+    def invalidate(self, phone_number_id: str, digest: str, mime_type: str):
+        with self._lock:
+            self._entries.pop((phone_number_id, digest, mime_type), None)
+        if self.datastore:
+            self.datastore.remove_uploaded_media(
+                phone_number_id, digest, mime_type)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,131 @@
+import io
+import shutil
+import logging
+import multiprocessing
+import threading
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Gemini tiles images at 768px, anything past a couple of tiles only adds tokens
+MAX_IMAGE_SIDE = 1536
+# Gemini rejects requests over 20MB, larger media goes through the File API
+MAX_INLINE_BYTES = 15 * 1024 * 1024
+# Rough prompt cost of one media part, used for rate limiting
+MEDIA_TOKEN_ESTIMATE = 258
+
+SUPPORTED_MIME_TYPES = (
+    "image/", "audio/", "video/", "application/pdf", "text/",
+)
+
+
+class MediaUploadError(Exception):
+    """Raised when a file sent through the File API can't be used in a turn."""
+
+
+@dataclass
+class MediaPart:
+    mime_type: str
+    path: Path
+    data: Optional[bytes] = None  # Preprocessed bytes, None when too large to inline
+
+
+def prepare_image(path: str, max_side: int = MAX_IMAGE_SIDE, quality: int = 85) -> Tuple[bytes, str]:
+    """Downscales an image to `max_side` and re-encodes it as JPEG."""
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.debug("Pillow is not installed, sending %s as is", path)
+        return Path(path).read_bytes(), ""
+
+    with Image.open(path) as image:
+        image.thumbnail((max_side, max_side))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def prepare_audio(path: str) -> Tuple[bytes, str]:
+    """Transcodes audio to 16kHz mono Opus, what the model listens at anyway."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        logger.debug("ffmpeg is not installed, sending %s as is", path)
+        return Path(path).read_bytes(), ""
+
+    result = subprocess.run(
+        [ffmpeg, "-v", "error", "-i", str(path),
+         "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k",
+         "-f", "ogg", "pipe:1"],
+        capture_output=True,
+        check=True,
+    )
+    return result.stdout, "audio/ogg"
+
+
+def _prepare(path: str, mime_type: str) -> Tuple[bytes, str]:
+    if mime_type.startswith("image/"):
+        data, prepared_mime_type = prepare_image(path)
+    else:
+        data, prepared_mime_type = prepare_audio(path)
+    return data, prepared_mime_type or mime_type
+
+
+class MediaPreprocessor:
+    """Prepares downloaded media for the model in a pool of processes.
+
+    Image and audio preprocessing is CPU bound, so it runs outside the
+    worker threads. Pillow and ffmpeg are optional, without them media is
+    sent unchanged.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, executor: Optional[Executor] = None):
+        self.max_workers = max_workers
+        self._executor = executor
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> Executor:
+        # Processes are only started the first time media arrives
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Forking would copy the parent's locks and threads mid-use
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    def prepare(self, path: Path, mime_type: str) -> Optional[MediaPart]:
+        mime_type = mime_type.split(";")[0]
+        if not mime_type.startswith(SUPPORTED_MIME_TYPES):
+            logger.warning("Media type %s is not supported by the model", mime_type)
+            return None
+
+        # Only images and audio shrink, anything else is sent as is: read
+        # here when small enough to inline, uploaded otherwise
+        if not mime_type.startswith(("image/", "audio/")):
+            if Path(path).stat().st_size > MAX_INLINE_BYTES:
+                return MediaPart(mime_type=mime_type, path=Path(path))
+            return MediaPart(mime_type=mime_type, path=Path(path), data=Path(path).read_bytes())
+
+        try:
+            data, prepared_mime_type = self.executor.submit(_prepare, str(path), mime_type).result()
+        except Exception as e:
+            logger.error("Preprocessing %s failed: %s", path, e)
+            data, prepared_mime_type = Path(path).read_bytes(), mime_type
+
+        if len(data) > MAX_INLINE_BYTES:
+            return MediaPart(mime_type=mime_type, path=Path(path))
+        return MediaPart(mime_type=prepared_mime_type, path=Path(path), data=data)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
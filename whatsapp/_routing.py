@@ -0,0 +1,102 @@
+import re
+import inspect
+import time
+import string
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+_punctuation = str.maketrans("", "", string.punctuation)
+
+
+def normalize(text: str) -> str:
+    """Lowercases, drops punctuation and collapses whitespace."""
+    return " ".join(text.lower().translate(_punctuation).split())
+
+
+@dataclass
+class IntentMatcher:
+    name: str
+    pattern: Optional["re.Pattern[str]"] = None
+    keywords: Sequence[str] = ()
+
+    def matches(self, text: str) -> bool:
+        if self.pattern is not None and self.pattern.search(text):
+            return True
+
+        padded = f" {normalize(text)} "
+        return any(f" {normalize(k)} " in padded for k in self.keywords)
+
+
+def intent(name: Optional[str] = None, pattern: Optional[str] = None, keywords: Sequence[str] = ()):
+    """Marks a method as a deterministic handler for an intent.
+
+    The method is called with the customer's text and returns the reply,
+    skipping the model entirely, when `pattern` (a case-insensitive regex)
+    matches or one of `keywords` appears as a whole word or phrase.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            logger.debug("Intent: %s", func.__name__)
+            return func(*args, **kwargs)
+
+        wrapper._intent = IntentMatcher(  # type: ignore
+            name=name or func.__name__,
+            pattern=re.compile(pattern, re.IGNORECASE) if pattern else None,
+            keywords=tuple(keywords),
+        )
+        return wrapper
+    return decorator
+
+
+def get_all_intents(obj) -> List[Tuple[IntentMatcher, Callable[[str], str]]]:
+    intents = []
+    for attr in dir(obj):
+        # Properties can do work on access, e.g. `http` creates the session
+        if isinstance(inspect.getattr_static(obj, attr, None), property):
+            continue
+        func = getattr(obj, attr)
+        matcher = getattr(func, "_intent", None)
+        if callable(func) and isinstance(matcher, IntentMatcher):
+            intents.append((matcher, func))
+    return intents
+
+
+class ResponseCache:
+    """LRU cache of replies keyed by normalized customer text, with a TTL."""
+
+    def __init__(self, ttl: float, max_size: int = 1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str, bool]]" = OrderedDict()
+
+    def get(self, text: str) -> Optional[Tuple[str, bool]]:
+        key = normalize(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, response, end_chat = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response, end_chat
+
+    def put(self, text: str, response: str, end_chat: bool):
+        key = normalize(text)
+        if not key:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response, end_chat)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
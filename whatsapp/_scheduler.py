@@ -0,0 +1,70 @@
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Job:
+    name: str
+    interval: float
+    func: Callable[[], None]
+    next_run: float
+
+
+class Scheduler:
+    """Runs periodic maintenance jobs on a single background thread."""
+
+    def __init__(self, tick: float = 1.0):
+        self.tick = tick
+        self._jobs: List[_Job] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def every(self, seconds: float, func: Callable[[], None], name: Optional[str] = None, run_now: bool = False):
+        """Runs `func` every `seconds`, first after one interval unless `run_now`."""
+        job = _Job(
+            name=name or getattr(func, "__name__", repr(func)),
+            interval=seconds,
+            func=func,
+            next_run=time.monotonic() + (0 if run_now else seconds),
+        )
+        with self._lock:
+            self._jobs.append(job)
+        return job
+
+    def run_pending(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [job for job in self._jobs if job.next_run <= now]
+
+        for job in due:
+            try:
+                job.func()
+            except Exception as e:
+                logger.error("Scheduled job %s failed: %s", job.name, e)
+            job.next_run = time.monotonic() + job.interval
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="whatsapp-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            self.run_pending()
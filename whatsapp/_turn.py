@@ -0,0 +1,93 @@
+import time
+import uuid
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+@dataclass
+class Turn:
+    """Bookkeeping for one customer turn, visible to code running in that turn."""
+    conversation_id: str
+    id: int = field(default_factory=lambda: next(_ids))
+    started_at: float = field(default_factory=time.monotonic)
+    iterations: int = 0
+    tool_calls: int = 0
+    tokens: int = 0
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+def current_turn() -> Optional[Turn]:
+    return getattr(_local, "turn", None)
+
+
+@contextmanager
+def start_turn(conversation_id: str) -> Iterator[Turn]:
+    """Opens a turn for the current thread, or joins the one already open."""
+    turn = current_turn()
+    if turn is not None:
+        yield turn
+        return
+
+    turn = Turn(conversation_id=conversation_id)
+    _local.turn = turn
+    try:
+        yield turn
+    finally:
+        _local.turn = None
+
+
+@dataclass
+class TurnBudget:
+    """Limits on one turn of the function-calling loop, None disables a limit."""
+    max_iterations: Optional[int] = 10
+    deadline: Optional[float] = 120.0  # seconds
+    max_tokens: Optional[int] = None
+
+    def exceeded(self, turn: Turn) -> Optional[str]:
+        """Returns the name of the first limit the turn has reached, if any."""
+        if self.max_iterations is not None and turn.iterations >= self.max_iterations:
+            return "iterations"
+        if self.deadline is not None and time.monotonic() - turn.started_at >= self.deadline:
+            return "deadline"
+        if self.max_tokens is not None and turn.tokens >= self.max_tokens:
+            return "tokens"
+        return None
+
+
+class TurnMetrics:
+    """Counts finished turns, how many model calls they took and budget hits."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.iterations: Counter = Counter()
+        self.budget_hits: Counter = Counter()
+        self.fallbacks = 0
+
+    def record(self, turn: Turn, budget_hit: Optional[str], fallback: bool):
+        with self._lock:
+            self.turns += 1
+            self.iterations[turn.iterations] += 1
+            if budget_hit:
+                self.budget_hits[budget_hit] += 1
+            if fallback:
+                self.fallbacks += 1
+
+    def stats(self):
+        with self._lock:
+            total = sum(n * count for n, count in self.iterations.items())
+            return {
+                "turns": self.turns,
+                "avg_iterations": total / self.turns if self.turns else 0.0,
+                "iterations": dict(sorted(self.iterations.items())),
+                "budget_hits": dict(self.budget_hits),
+                "fallbacks": self.fallbacks,
+            }
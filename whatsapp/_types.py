@@ -1,5 +1,5 @@
 import sqlite3
-from typing import Literal
+from typing import Literal, Optional
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
@@ -13,8 +13,9 @@ class ConversationData:
     id: str
     customer_id: str
     start_time: int
-    end_time: int | None
-    intent: str | None
+    end_time: Optional[int]
+    intent: Optional[str]
+    phone_number_id: Optional[str] = None  # Business number the conversation is with
 
 
 Sender = Literal["bot", "customer"]
@@ -30,6 +31,14 @@ class ChatMessage:
     message: str
 
 
+@dataclass
+class SearchHit:
+    message: ChatMessage
+    customer_id: str
+    snippet: str  # Matched terms wrapped in [ ]
+    rank: float  # bm25, lower is better
+
+
 @dataclass
 class AgentMessage:
     id: str
@@ -37,3 +46,53 @@ class AgentMessage:
     sender: str
     conversation_id: int
     type: MessageTypes = "text"
+    payload: Optional[bytes] = None  # Serialized Content, replaces data when set
+
+
+@dataclass
+class PendingSend:
+    id: str
+    recipient: str
+    payload: str
+    created_at: int
+    failed_at: Optional[int] = None  # Set once delivery was given up on
+    error: Optional[str] = None
+
+
+@dataclass
+class UploadedMedia:
+    phone_number_id: str
+    digest: str
+    mime_type: str
+    media_id: str
+    uploaded_at: int
+
+
+@dataclass
+class ConversationStats:
+    conversation_id: str
+    day: str  # UTC date the conversation started, YYYY-MM-DD
+    start_time: int
+    end_time: Optional[int]
+    customer_messages: int
+    bot_messages: int
+    tool_calls: int
+
+
+@dataclass
+class DailyStats:
+    day: str  # UTC date, YYYY-MM-DD
+    conversations: int
+    ended_conversations: int
+    customer_messages: int
+    bot_messages: int
+    tool_calls: int
+    total_duration: int  # Seconds, summed over ended conversations
+
+    @property
+    def average_turns(self) -> float:
+        return self.bot_messages / self.conversations if self.conversations else 0.0
+
+    @property
+    def average_duration(self) -> float:
+        return self.total_duration / self.ended_conversations if self.ended_conversations else 0.0
@@ -1,25 +1,37 @@
 import os
+import time
+import json
 import inspect
 import logging
+import threading
 from functools import wraps
-from typing import Tuple, Callable, Iterable, List
-
-import google.generativeai as genai
-from google.generativeai.types.model_types import json
-from google.protobuf.json_format import MessageToJson, MessageToDict
-from google.generativeai.types import GenerateContentResponse, StrictContentType
+from typing import TYPE_CHECKING, Literal, Tuple, Callable, Iterable, List, Sequence, Optional
 
 from whatsapp._datastore import BaseDatastore
-from whatsapp._types import BaseInterface, AgentMessage, ConversationData
+from whatsapp._hedging import HedgingPolicy
+from whatsapp._multimodal import MediaPart, MediaUploadError, MEDIA_TOKEN_ESTIMATE
+from whatsapp._turn import Turn, TurnBudget, TurnMetrics, current_turn, start_turn
+from whatsapp._limiter import GeminiLimiter, CircuitOpenError
+from whatsapp._types import BaseInterface, AgentMessage, ConversationData, MessageTypes
+
+if TYPE_CHECKING:
+    from google.generativeai.types import GenerateContentResponse, StrictContentType
 
 
 logger = logging.getLogger(__name__)
 
 
+def _genai():
+    # google.generativeai pulls in protobuf and grpc, which dominates import
+    # time, so it is only loaded once a model is actually needed.
+    import google.generativeai as genai
+    return genai
+
+
 def instruction(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        logger.debug(f"Instruction: {func.__name__}")
+        logger.debug("Instruction: %s", func.__name__)
         return func(*args, **kwargs)
 
     wrapper._is_instruction = True  # type: ignore
@@ -29,18 +41,56 @@ def instruction(func):
 class AgentInterface(BaseInterface):
     system_message = ""
     datastore: BaseDatastore
+    # "protobuf" stores function calls/responses as serialized Content bytes,
+    # which is smaller than JSON and decodes straight into Parts
+    history_format: Literal["json", "protobuf"] = "json"
+    # Sent instead of failing the turn while the Gemini circuit breaker is open
+    llm_fallback_message: Optional[str] = None
+    # Sent when a turn runs out of budget and the model still won't answer
+    budget_fallback_message = "Sorry, I couldn't finish that request. Could you try again?"
 
     def __init__(
             self,
             gemini_model_name: str = "models/gemini-1.5-flash",
             gemini_api_key: str = os.environ.get("GEMINI_API_KEY", ""),
+            gemini_limiter: Optional[GeminiLimiter] = None,
+            hedging: Optional[HedgingPolicy] = None,
+            turn_budget: Optional[TurnBudget] = None,
     ):
         self.model_name = gemini_model_name
+        self.turn_budget = turn_budget or TurnBudget()
+        self.turn_metrics = TurnMetrics()
+        self.gemini_limiter = gemini_limiter or GeminiLimiter()
+        self.hedging = hedging
+        self.gemini_api_key = gemini_api_key
         self.instructions = self.get_all_instructions()
+        self._genai_configured = False
+        # The model and its tool declarations are built once and shared
+        self._model = None
+        self._model_lock = threading.Lock()
 
-        genai.configure(api_key=gemini_api_key)
+        self.llm_in_flight = 0
+        self._llm_lock = threading.Lock()
+
+    def _configure_genai(self):
+        genai = _genai()
+        if not self._genai_configured:
+            genai.configure(api_key=self.gemini_api_key)
+            self._genai_configured = True
+        return genai
 
     def model(self, config=None):
+        if config is None and self._model is not None:
+            return self._model
+
+        with self._model_lock:
+            if self._model is None:
+                self._model = self._build_model()
+        return self._model
+
+    def _build_model(self):
+        genai = self._configure_genai()
+
         additional_messages = [
             "\n",
             "Always try to use the tools and minimize use of your own knowledge.",
@@ -79,41 +129,116 @@ class AgentInterface(BaseInterface):
             system_instruction=system_instruction,
         )
 
-    def _setup_history_data(self, history_data: List[AgentMessage]) -> Iterable[StrictContentType]:
+    def _warm_up_model(self):
+        """Builds the model and opens its connection to Gemini ahead of the first turn.
+
+        count_tokens goes through the client generate_content uses, without
+        spending generation quota.
+        """
+        self.model().count_tokens("warm-up")
+
+    def _setup_history_data(self, history_data: List[AgentMessage]) -> Iterable["StrictContentType"]:
         """Converts conversation history into a structured format for the model."""
 
         history = []
         for message in history_data:
             role = "user" if message.sender == "user" else "model"
-            if message.type == "text":
-                history.append(
-                    {"role": role, "parts": [genai.protos.Part(text=message.data)]})
-            elif message.type == "function_call":
-                function_call = json.loads(message.data)["functionCall"]
-                history.append({
-                    "role": role,
-                    "parts": [genai.protos.Part(function_call=genai.protos.FunctionCall(
-                        name=function_call["name"], args=function_call["args"]
-                    ))]
-                })
-            elif message.type == "function_response":
-                function_responses = json.loads(message.data)
-                parts = [
-                    genai.protos.Part(function_response=genai.protos.FunctionResponse(
-                        name=resp["functionResponse"]["name"], response=resp["functionResponse"]["response"]
-                    )) for resp in function_responses
-                ]
+            parts = self._decode_parts(message)
+            if parts:
                 history.append({"role": role, "parts": parts})
         return history
 
-    def handler(self, conversation: ConversationData, message: str) -> Tuple[str, bool]:
+    def _decode_parts(self, message: AgentMessage) -> list:
+        genai = _genai()
+
+        if message.payload is not None:
+            return list(genai.protos.Content.deserialize(message.payload).parts)
+
+        if message.type == "text":
+            return [genai.protos.Part(text=message.data)]
+        elif message.type == "function_call":
+            function_call = json.loads(message.data)["functionCall"]
+            return [genai.protos.Part(function_call=genai.protos.FunctionCall(
+                name=function_call["name"], args=function_call["args"]
+            ))]
+        elif message.type == "function_response":
+            function_responses = json.loads(message.data)
+            return [
+                genai.protos.Part(function_response=genai.protos.FunctionResponse(
+                    name=resp["functionResponse"]["name"], response=resp["functionResponse"]["response"]
+                )) for resp in function_responses
+            ]
+        return []
+
+    def _encode_parts(
+            self,
+            type: MessageTypes,
+            parts: list,
+            history_format: Optional[Literal["json", "protobuf"]] = None,
+    ) -> Tuple[str, Optional[bytes]]:
+        """Encodes function call/response parts as (data, payload) for the datastore."""
+        if (history_format or self.history_format) == "protobuf":
+            genai = _genai()
+            content = genai.protos.Content(parts=parts)
+            return "", genai.protos.Content.serialize(content)
+
+        from google.protobuf.json_format import MessageToJson, MessageToDict
+
+        if type == "function_call":
+            return MessageToJson(parts[0]._pb), None
+        return json.dumps([MessageToDict(p._pb) for p in parts]), None
+
+    def migrate_history(self, batch_size: int = 500) -> int:
+        """Re-encodes JSON function call/response history as protobuf payloads.
+
+        Returns the number of rows migrated.
+        """
+        migrated = 0
+        # Archived rows are left as they are, both formats decode
+        messages = self.datastore.iter_agent_messages(
+            batch_size=batch_size, include_archived=False)
+        for message in messages:
+            if message.payload is not None or message.type == "text":
+                continue
+
+            # The format is passed rather than set on self, turns running
+            # alongside the migration keep writing in the configured format
+            data, payload = self._encode_parts(
+                message.type, self._decode_parts(message), "protobuf")
+            self.datastore.update_agent_message(message.id, data, payload)
+            migrated += 1
+
+        logger.info("Migrated %d agent messages", migrated)
+        return migrated
+
+    def handler(self, conversation: ConversationData, message: str, media: Sequence[MediaPart] = ()) -> Tuple[str, bool]:
         """Handle the chat messages and return the response and whether the chat has ended."""
 
+        with start_turn(conversation.id) as turn:
+            return self._handle_turn(conversation, message, turn, media)
+
+    def _handle_turn(self, conversation: ConversationData, message: str, turn: Turn, media: Sequence[MediaPart] = ()) -> Tuple[str, bool]:
         model = self.model()
         history_data = self.datastore.get_agent_messages(conversation.id)
         history = self._setup_history_data(history_data)
         session = model.start_chat(history=history)
 
+        # Media is only sent on the turn it arrives, history keeps a note of it
+        content = message
+        if media:
+            genai = _genai()
+            notes = [f"[attachment: {item.mime_type}]" for item in media]
+            try:
+                content = self._media_parts(media)
+                if message:
+                    content.append(genai.protos.Part(text=message))
+            except Exception as e:
+                # Answer from the caption alone rather than not at all
+                logger.warning("Sending the turn without its media: %s", e)
+                notes = [f"[attachment: {item.mime_type}, could not be opened]" for item in media]
+                content = "\n".join(notes + ([message] if message else []))
+            message = "\n".join(notes + ([message] if message else []))
+
         self.datastore.add_agent_message(
             type="text",
             data=message,
@@ -125,35 +250,154 @@ class AgentInterface(BaseInterface):
         end_chat = False
         end_loop = False
         function_call_response = None
+        budget_hit = None
 
         while not end_loop:
-            if function_call_response:
-                res = session.send_message(function_call_response)
-            else:
-                res = session.send_message(message)
+            # Out of budget: send the tool results but make the model answer
+            if function_call_response and budget_hit is None:
+                budget_hit = self.turn_budget.exceeded(turn)
+                if budget_hit:
+                    logger.warning("Turn budget reached (%s), forcing an answer", budget_hit)
+
+            try:
+                if function_call_response:
+                    res = self._send_message(
+                        session, function_call_response, force_text=budget_hit is not None)
+                else:
+                    res = self._send_message(session, content)
+            except CircuitOpenError:
+                if self.llm_fallback_message is None:
+                    raise
+                logger.warning("Gemini unavailable, sending fallback reply")
+                self.turn_metrics.record(turn, budget_hit, fallback=True)
+                return self.llm_fallback_message, False
+            turn.iterations += 1
+            usage = getattr(res, "usage_metadata", None)
+            turn.tokens += getattr(usage, "total_token_count", 0) or 0
 
             fns, response, end_loop, end_chat = self._process_response(
-                conversation.id, res)
+                conversation.id, res, allow_tools=budget_hit is None)
+
+            if budget_hit and not end_loop:
+                # The model kept asking for tools, give up on this turn
+                response = self.budget_fallback_message
+                self.datastore.add_agent_message(
+                    type="text",
+                    sender="bot",
+                    data=response,
+                    conversation_id=conversation.id,
+                )
+                self.turn_metrics.record(turn, budget_hit, fallback=True)
+                return response, False
 
             function_call_response = []
+            turn.tool_calls += len(fns)
             for fn in fns:
                 res_part = self._call_function(fn)
                 function_call_response.append(res_part)
 
             if function_call_response:
                 # Save responses to history
-                responses_json = [MessageToDict(r._pb)
-                                  for r in function_call_response]  # type: ignore
+                data, payload = self._encode_parts(
+                    "function_response", function_call_response)
 
                 self.datastore.add_agent_message(
                     sender="customer",
                     type="function_response",
-                    data=json.dumps(responses_json),
+                    data=data,
+                    payload=payload,
                     conversation_id=conversation.id,
                 )
+
+        self.turn_metrics.record(turn, budget_hit, fallback=False)
         return response, end_chat
 
+    def _turn_remaining(self) -> float:
+        """Seconds left before the current turn's deadline, inf without one."""
+        turn = current_turn()
+        if turn is None or self.turn_budget.deadline is None:
+            return float("inf")
+        return turn.started_at + self.turn_budget.deadline - time.monotonic()
+
+    def _media_parts(self, media: Sequence[MediaPart]) -> list:
+        genai = _genai()
+
+        parts = []
+        for item in media:
+            if item.data is not None:
+                parts.append(genai.protos.Part(inline_data=genai.protos.Blob(
+                    mime_type=item.mime_type, data=item.data)))
+                continue
+
+            # Too large to inline, go through the File API
+            file = genai.upload_file(item.path, mime_type=item.mime_type)
+            while file.state.name == "PROCESSING":
+                if self._turn_remaining() <= 0:
+                    raise MediaUploadError(f"{file.name} was still processing at the turn deadline")
+                time.sleep(min(1.0, self._turn_remaining()))
+                file = genai.get_file(file.name)
+            if file.state.name == "FAILED":
+                raise MediaUploadError(f"{file.name} failed processing")
+            parts.append(genai.protos.Part(file_data=genai.protos.FileData(
+                mime_type=file.mime_type, file_uri=file.uri)))
+        return parts
+
+    def _send_message(self, session, content, force_text: bool = False):
+        with self._llm_lock:
+            self.llm_in_flight += 1
+        try:
+            if self.hedging is None:
+                return self._call_model(session, content, force_text)
+
+            # Each attempt runs on its own copy of the chat so the loser never
+            # touches the real history, only the winner's turn is kept
+            def attempt():
+                chat = session.model.start_chat(history=list(session.history))
+                return chat, self._call_model(chat, content, force_text)
+
+            chat, res = self.hedging.run(attempt, attempt)
+            session.history = chat.history
+            return res
+        finally:
+            with self._llm_lock:
+                self.llm_in_flight -= 1
+
+    def _call_model(self, session, content, force_text: bool = False):
+        options = {}
+        if force_text:
+            # Function calling mode NONE makes the model reply with text
+            options["tool_config"] = {"function_calling_config": {"mode": "NONE"}}
+
+        return self.gemini_limiter.call(
+            lambda: session.send_message(content, **options),
+            self._estimate_tokens(session, content),
+        )
+
+    def _estimate_tokens(self, session, content) -> int:
+        """Roughly estimates prompt tokens at four characters per token.
+
+        Media parts, in the history as well, count as MEDIA_TOKEN_ESTIMATE
+        rather than by the length of their bytes.
+        """
+        parts = [
+            part
+            for c in getattr(session, "history", [])
+            for part in getattr(c, "parts", [c])
+        ]
+        parts += content if isinstance(content, list) else [content]
+
+        tokens = 0
+        characters = 0
+        for part in parts:
+            if getattr(part, "inline_data", None) or getattr(part, "file_data", None):
+                tokens += MEDIA_TOKEN_ESTIMATE
+            else:
+                characters += len(str(part))
+        return tokens + characters // 4
+
     def _call_function(self, fn):
+        genai = _genai()
+
         # Call the function and get the response
         func = getattr(self, fn.name)
         res = func(**fn.args)
@@ -164,25 +408,30 @@ class AgentInterface(BaseInterface):
 
         return res_part
 
-    def _process_response(self, conversation_id: str, res: GenerateContentResponse):
+    def _process_response(self, conversation_id: str, res: "GenerateContentResponse", allow_tools: bool = True):
         fns = []
         response = ""
         end_chat = False
         end_loop = False
 
         for part in res.parts:
-            if part.function_call:
+            if part.function_call and not allow_tools:
+                # Never persist a call that will not be answered
+                continue
+            elif part.function_call:
                 fn = part.function_call
-                args = ", ".join(f"{key}={val}" for key,
-                                 val in fn.args.items())
-                logger.debug(
-                    f"Model declared a function call: {fn.name}({args})")
+                if logger.isEnabledFor(logging.DEBUG):
+                    args = ", ".join(f"{key}={val}" for key,
+                                     val in fn.args.items())
+                    logger.debug(
+                        "Model declared a function call: %s(%s)", fn.name, args)
                 fns.append(fn)
-                response = MessageToJson(part._pb)
+                data, payload = self._encode_parts("function_call", [part])
 
                 self.datastore.add_agent_message(
                     sender="bot",
-                    data=response,
+                    data=data,
+                    payload=payload,
                     type="function_call",
                     conversation_id=conversation_id,
                 )
@@ -208,12 +457,14 @@ class AgentInterface(BaseInterface):
         instructions = []
 
         for attr in dir(self):
+            if isinstance(inspect.getattr_static(self, attr, None), property):
+                continue
             is_callable = callable(getattr(self, attr))
             is_instruction = getattr(
                 getattr(self, attr), "_is_instruction", False)
 
             if is_callable and is_instruction:
-                logger.debug(f"Instruction: {attr}")
+                logger.debug("Instruction: %s", attr)
                 func = getattr(self, attr)
                 instructions.append(func)
 
@@ -0,0 +1,217 @@
+import csv
+import json
+import time
+import random
+import logging
+import threading
+from pathlib import Path
+from collections import Counter
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from whatsapp.events import Status
+from whatsapp._limiter import TokenBucket
+from whatsapp._datastore import BaseDatastore
+from whatsapp.message import Message, Template
+
+if TYPE_CHECKING:
+    from whatsapp.conversation_handler import ConversationHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+def recipients_from_file(path: str) -> Iterator[str]:
+    """Streams phone numbers from the first column of a text or CSV file."""
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if row and row[0].strip() and not row[0].startswith("#"):
+                yield row[0].strip()
+
+
+def recipients_from_datastore(datastore: BaseDatastore) -> Iterator[str]:
+    """Streams every customer that has had a conversation, once each."""
+    seen: Set[str] = set()
+    for conversation in datastore.iter_conversations():
+        if conversation.customer_id not in seen:
+            seen.add(conversation.customer_id)
+            yield conversation.customer_id
+
+
+@dataclass
+class BroadcastResult:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    errors: Counter = field(default_factory=Counter)
+    statuses: Counter = field(default_factory=Counter)
+
+
+class Broadcast:
+    """Sends a template message to a large audience at a fixed rate.
+
+    Recipients are streamed, so the audience never has to fit in memory.
+    Sends share the handler's pooled HTTP session and are paced to
+    `messages_per_second`. When `checkpoint_path` is set, progress is saved
+    as the number of leading recipients that are done, so an interrupted
+    broadcast can be run again with the same recipients and resumes there.
+    Delivery statuses arriving on the webhook are aggregated in
+    `result.statuses` for `status_window` seconds after the last send.
+    """
+
+    def __init__(
+            self,
+            handler: "ConversationHandler",
+            template: Template,
+            messages_per_second: float = 80,
+            max_workers: int = 16,
+            max_retries: int = 3,
+            checkpoint_path: Optional[str] = None,
+            checkpoint_every: int = 100,
+            status_window: float = 24 * 60 * 60,
+    ):
+        self.handler = handler
+        self.template = template
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.status_window = status_window
+        self.finished_at: Optional[float] = None
+        self.rate = TokenBucket(messages_per_second * 60, capacity=messages_per_second)
+
+        self.result = BroadcastResult()
+        self._lock = threading.Lock()
+        self._message_ids: Dict[str, str] = {}
+        self._status_seen: Set[tuple] = set()
+
+        # Indexes finished out of order, waiting for the checkpoint to catch up
+        self._done: Set[int] = set()
+        self._checkpoint = 0
+
+    def _load_checkpoint(self) -> int:
+        if self.checkpoint_path and Path(self.checkpoint_path).exists():
+            with open(self.checkpoint_path) as file:
+                return json.load(file)["completed"]
+        return 0
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, "w") as file:
+            json.dump({"completed": self._checkpoint}, file)
+        Path(tmp).replace(self.checkpoint_path)
+
+    def _mark_done(self, index: int):
+        with self._lock:
+            self._done.add(index)
+            advanced = False
+            while self._checkpoint in self._done:
+                self._done.remove(self._checkpoint)
+                self._checkpoint += 1
+                advanced = True
+            if advanced and self._checkpoint % self.checkpoint_every == 0:
+                self._save_checkpoint()
+
+    def run(self, recipients: Iterable[str]) -> BroadcastResult:
+        self._checkpoint = self._load_checkpoint()
+        if self._checkpoint:
+            logger.info("Resuming broadcast after %d recipients", self._checkpoint)
+
+        # Bound the recipients held in memory to what the pool is working on
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def task(index: int, recipient: str):
+            try:
+                self._send(recipient)
+            finally:
+                self._mark_done(index)
+                slots.release()
+
+        with ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="whatsapp-broadcast") as executor:
+            for index, recipient in enumerate(recipients):
+                if index < self._checkpoint:
+                    self.result.skipped += 1
+                    continue
+                slots.acquire()
+                with self._lock:
+                    self.result.total += 1
+                executor.submit(task, index, recipient)
+
+        with self._lock:
+            self._save_checkpoint()
+        self.finished_at = time.monotonic()
+        logger.info("Broadcast finished: %d sent, %d failed",
+                    self.result.sent, self.result.failed)
+        return self.result
+
+    def _send(self, recipient: str):
+        message = Message(to=recipient, template=self.template, type="template")
+        error = "unknown"
+
+        for attempt in range(self.max_retries + 1):
+            self.rate.acquire()
+            try:
+                response = self.handler.http.post(
+                    f"{self.handler.url}/{self.handler.whatsapp_number}/messages",
+                    headers={
+                        "Content-Type": "application/json",
+                        "Authorization": f"Bearer {self.handler.token}"
+                    },
+                    json=message.model_dump(),
+                )
+                message_id, error = self._parse(response)
+            except Exception as e:
+                error = type(e).__name__
+            else:
+                if message_id:
+                    with self._lock:
+                        self.result.sent += 1
+                        self._message_ids[message_id] = recipient
+                    return
+
+                # An accepted send without a message id may have gone out,
+                # and only throttling and server errors are worth retrying
+                if response.ok or (response.status_code != 429 and response.status_code < 500):
+                    break
+
+            time.sleep(random.uniform(0, min(30.0, 2 ** attempt)))
+
+        logger.debug("Broadcast to %s failed: %s", recipient, error)
+        with self._lock:
+            self.result.failed += 1
+            self.result.errors[error] += 1
+
+    @staticmethod
+    def _parse(response) -> Tuple[Optional[str], str]:
+        """Returns the message id of an accepted send, or the error of a rejected one."""
+        try:
+            data = response.json()
+            if response.ok:
+                return data["messages"][0]["id"], ""
+            return None, str(data["error"]["code"])
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None, "invalid_response" if response.ok else str(response.status_code)
+
+    def is_expired(self) -> bool:
+        """Tells whether the status window has closed since the broadcast finished."""
+        return (
+            self.finished_at is not None
+            and time.monotonic() - self.finished_at > self.status_window
+        )
+
+    def record_status(self, status: Status) -> bool:
+        """Counts a delivery status if it belongs to this broadcast."""
+        with self._lock:
+            if status.id not in self._message_ids:
+                return False
+            key = (status.id, status.status)
+            if key not in self._status_seen:
+                self._status_seen.add(key)
+                self.result.statuses[status.status] += 1
+            return True
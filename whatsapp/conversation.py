@@ -1,10 +1,20 @@
 import os
 import logging
+import threading
+from typing import List, Optional, Sequence, Tuple
 from datetime import datetime
+from contextlib import ExitStack
 from concurrent.futures import ThreadPoolExecutor
 
 from whatsapp.events import Message
+from whatsapp._types import ConversationData
+from whatsapp._turn import TurnBudget, start_turn
+from whatsapp._routing import ResponseCache, get_all_intents
 from whatsapp.agent_interface import AgentInterface
+from whatsapp._hedging import HedgingPolicy
+from whatsapp._multimodal import MediaPart, MediaPreprocessor
+from whatsapp._limiter import GeminiLimiter
+from whatsapp._admission import AdmissionController
 from whatsapp.conversation_handler import ConversationHandler
 from whatsapp.reply_message import Message as ReplyMessage, Text
 
@@ -19,50 +29,151 @@ class Conversation(AgentInterface, ConversationHandler):
             start_proxy=True,
             media_root: str = "media",
             webhook_initialize_string="token",
+            send_workers: int = 4,
+            send_max_retries: int = 5,
+            max_media_bytes: int = 1024 ** 3,
+            media_workers: Optional[int] = None,
+            idle_timeout: Optional[int] = 24 * 60 * 60,
+            archive_after: Optional[int] = None,
+            maintenance_interval: int = 60,
+            archive_batches_per_run: int = 10,
+            coalesce_window_ms: int = 0,
+            coalesce_max_messages: int = 10,
+            admission_control: Optional[AdmissionController] = None,
+            max_concurrency: Optional[int] = None,
+            record_webhooks: Optional[str] = None,
+            response_cache_ttl: Optional[int] = None,
+            response_cache_size: int = 1000,
             gemini_model_name: str = "models/gemini-1.5-flash",
             gemini_api_key: str = os.environ.get("GEMINI_API_KEY", ""),
+            gemini_limiter: Optional[GeminiLimiter] = None,
+            hedging: Optional[HedgingPolicy] = None,
+            turn_budget: Optional[TurnBudget] = None,
     ):
         AgentInterface.__init__(
             self,
             gemini_model_name,
-            gemini_api_key
+            gemini_api_key,
+            gemini_limiter,
+            hedging,
+            turn_budget,
         )
         ConversationHandler.__init__(
             self,
-            start_proxy,
-            media_root,
-            webhook_initialize_string,
+            start_proxy=start_proxy,
+            media_root=media_root,
+            webhook_initialize_string=webhook_initialize_string,
+            send_workers=send_workers,
+            send_max_retries=send_max_retries,
+            max_media_bytes=max_media_bytes,
+            coalesce_window_ms=coalesce_window_ms,
+            coalesce_max_messages=coalesce_max_messages,
+            admission_control=admission_control,
+            max_concurrency=max_concurrency,
+            record_webhooks=record_webhooks,
         )
 
         if debug:
             logger.setLevel(logging.DEBUG)
 
-    def on_message(self, message: Message):
-        chat_id = message.to
+        # Images and voice notes are shrunk for the model in worker processes
+        self.media_preprocessor = MediaPreprocessor(media_workers)
+
+        # Conversations left idle past WhatsApp's 24h customer service window
+        # are ended, and ended ones are moved out of the hot message tables
+        self.idle_timeout = idle_timeout
+        self.archive_after = archive_after
+        self.archive_batches_per_run = archive_batches_per_run
+        if idle_timeout is not None:
+            self.scheduler.every(
+                maintenance_interval, self._expire_idle_conversations)
+        if archive_after is not None:
+            self.scheduler.every(
+                maintenance_interval, self._archive_conversations)
 
-        # TODO: Storage of media messages
-        text = (
-            message.message.text.body
-            if message.message.text
-            else ""
+        # Pre-LLM routing: @intent handlers, then cached first-turn replies
+        self.intents = get_all_intents(self)
+        self.response_cache = (
+            ResponseCache(response_cache_ttl, response_cache_size)
+            if response_cache_ttl else None
         )
+        self._routing_lock = threading.Lock()
+        self.intent_hits = 0
+        self.cache_hits = 0
+        self.llm_turns = 0
+
+    def _expire_idle_conversations(self):
+        now = int(datetime.now().timestamp())
+        expired = self.datastore.expire_idle_conversations(
+            now - self.idle_timeout, now)
+        if expired:
+            logger.info("Ended %d idle conversations", expired)
+
+    def _archive_conversations(self):
+        # A bounded number of batches per run, a large backlog is worked off
+        # over several runs instead of holding up the other scheduled jobs
+        ended_before = int(datetime.now().timestamp()) - self.archive_after
+        archived = 0
+        for _ in range(self.archive_batches_per_run):
+            batch = self.datastore.archive_conversations(ended_before)
+            if not batch:
+                break
+            archived += batch
+        if archived:
+            logger.info("Archived %d conversations", archived)
+
+    def on_message(self, message: Message):
+        self.on_messages([message])
 
-        # conversation = self.datastore.get_current_conversation(chat_id)
-        conversation = self.datastore.get_current_conversation(message.to)
+    def on_messages(self, messages: List[Message]):
+        chat_id = messages[0].to
+
+        conversation = self.datastore.get_current_conversation(
+            chat_id, self.whatsapp_number)
+        is_new_conversation = not conversation
         if not conversation:
             conversation = self.datastore.create_conversation(
-                message.to,
+                chat_id,
                 int(datetime.now().timestamp()),
+                self.whatsapp_number,
             )
 
-        self.datastore.add_chat_message(
-            conversation.id,
-            "customer",
-            int(message.message.timestamp),
-            text,
-        )
+        # Every message keeps its own chat row, but the model sees one turn.
+        # Media stays pinned until the turn is over, large files are only
+        # read when they are uploaded to the File API
+        with ExitStack() as pins:
+            texts = []
+            media: List[MediaPart] = []
+            for message in messages:
+                # TODO: Storage of media messages
+                text = (
+                    message.message.text.body
+                    if message.message.text
+                    else ""
+                )
+                attachment = getattr(message.message, message.type, None)
+                if message.type != "text" and attachment is not None:
+                    text = getattr(attachment, "caption", None) or ""
+                    if message.message.file:
+                        if pins.enter_context(self.media_store.pinned(message.message.file)):
+                            part = self.media_preprocessor.prepare(
+                                message.message.file, attachment.mime_type)
+                            if part:
+                                media.append(part)
+                        else:
+                            logger.warning("Media %s was evicted before it was handled",
+                                           message.message.file)
+                self.datastore.add_chat_message(
+                    conversation.id,
+                    "customer",
+                    int(message.message.timestamp),
+                    text,
+                )
+                if text:
+                    texts.append(text)
+            text = "\n".join(texts)
 
-        res, is_ended = self.handler(conversation, text)
+            res, is_ended = self._respond(conversation, text, is_new_conversation, media)
         timestamp = int(datetime.now().timestamp())
         self.datastore.add_chat_message(
             conversation.id,
@@ -79,13 +190,93 @@ class Conversation(AgentInterface, ConversationHandler):
             to=chat_id,
             type="text",
         )
-        self.send(reply)
+        self.dispatch(reply)
 
         if is_ended:
-            self.datastore.end_conversation(chat_id, timestamp)
+            self.datastore.end_conversation(chat_id, timestamp, self.whatsapp_number)
+
+    def _respond(
+            self,
+            conversation: ConversationData,
+            text: str,
+            is_new_conversation: bool,
+            media: Sequence[MediaPart] = (),
+    ) -> Tuple[str, bool]:
+        if media:
+            # Shortcuts only see the caption, the model has to look at the media
+            res, is_ended = self.handler(conversation, text, media)
+            with self._routing_lock:
+                self.llm_turns += 1
+            return res, is_ended
+
+        for matcher, func in self.intents:
+            if matcher.matches(text):
+                logger.debug("Matched intent %s", matcher.name)
+                self.datastore.set_conversation_intent(
+                    conversation.id, matcher.name)
+                res = func(text)
+                self._record_shortcut(conversation, text, res)
+                with self._routing_lock:
+                    self.intent_hits += 1
+                return res, False
+
+        # Only first turns are cached, later replies depend on the history
+        cacheable = self.response_cache is not None and is_new_conversation
+        if cacheable:
+            cached = self.response_cache.get(text)
+            if cached:
+                self._record_shortcut(conversation, text, cached[0])
+                with self._routing_lock:
+                    self.cache_hits += 1
+                return cached
+
+        with start_turn(conversation.id) as turn:
+            res, is_ended = self.handler(conversation, text)
+        with self._routing_lock:
+            self.llm_turns += 1
+
+        # Replies that ran tools may have side effects, never replay them
+        if cacheable and turn.iterations and not turn.tool_calls:
+            self.response_cache.put(text, res, is_ended)
+        return res, is_ended
+
+    def _record_shortcut(self, conversation: ConversationData, text: str, res: str):
+        # Keep the agent history complete for the model's next turn
+        self.datastore.add_agent_message(
+            type="text",
+            data=text,
+            sender="customer",
+            conversation_id=conversation.id,
+        )
+        self.datastore.add_agent_message(
+            type="text",
+            data=res,
+            sender="bot",
+            conversation_id=conversation.id,
+        )
+
+    def routing_stats(self):
+        with self._routing_lock:
+            saved = self.intent_hits + self.cache_hits
+            total = saved + self.llm_turns
+            return {
+                "intent_hits": self.intent_hits,
+                "cache_hits": self.cache_hits,
+                "llm_turns": self.llm_turns,
+                "llm_calls_saved": saved,
+                "hit_rate": saved / total if total else 0.0,
+            }
+
+    def _warm_up_steps(self):
+        return [("model", self._warm_up_model)] + super()._warm_up_steps()
 
-    def start(self, port: int = 5000, host="localhost"):
+    def start(self, port: int = 5000, host="localhost", warm_up: bool = True):
         logger.info("Starting conversation handler")
+        # Like Router.start: warm up first, restored sends then go out on
+        # warm connections
+        self._warm_up_before_serving(warm_up)
+        self.dispatcher.restore()
+        self.scheduler.start()
         with ThreadPoolExecutor(max_workers=2) as executor:
             executor.submit(self._handle_new_message)
             executor.submit(lambda: self.create_server(self.queue, host, port))
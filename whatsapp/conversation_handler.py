@@ -1,21 +1,32 @@
 import os
+import time
 import logging
+import threading
 from queue import Queue
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional, Tuple
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from pyngrok import ngrok
-from werkzeug import Request, Response
-from werkzeug.serving import make_server
-
 from whatsapp._types import BaseInterface
+from whatsapp._http import get_session
+from whatsapp._media import MediaStore, UploadCache, is_media_error
 from whatsapp.utils import mime_to_extension
 from whatsapp._datastore import BaseDatastore
-from whatsapp.reply_message import Message as ReplyMessage
+from whatsapp._gate import ConcurrencyGate
+from whatsapp._scheduler import Scheduler
+from whatsapp._coalescer import MessageCoalescer
+from whatsapp._admission import AdmissionController
+from whatsapp._dispatcher import SendDispatcher
+from whatsapp.message import Template
+from whatsapp.broadcast import Broadcast, BroadcastResult
+from whatsapp.reply_message import Message as ReplyMessage, Text
 from whatsapp.events import Change, WhatsappEvent, Message
 
+if TYPE_CHECKING:
+    from werkzeug import Request
+
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +36,48 @@ NGROK_AUTH_TOKEN = os.environ.get("NGROK_AUTH_TOKEN", "")
 
 executor = ThreadPoolExecutor()
 
+# Downloaded before they are queued
+MEDIA_MESSAGE_TYPES = ("image", "audio", "video", "document")
+
+# Validated during warm-up so the first real webhook doesn't pay for it
+SAMPLE_EVENT = {
+    "object": "whatsapp_business_account",
+    "entry": [{
+        "id": "0",
+        "changes": [{
+            "field": "messages",
+            "value": {
+                "messaging_product": "whatsapp",
+                "metadata": {"phone_number_id": "0", "display_phone_number": "0"},
+                "contacts": [{"wa_id": "0", "profile": {"name": "warm-up"}}],
+                "messages": [
+                    {"id": "0", "from": "0", "timestamp": "0", "type": "text",
+                     "text": {"body": "warm-up"}},
+                    {"id": "1", "from": "0", "timestamp": "0", "type": "image",
+                     "image": {"id": "0", "sha256": "0", "mime_type": "image/jpeg"}},
+                ],
+                "statuses": [{"id": "0", "status": "sent", "timestamp": "0",
+                              "recipient_id": "0"}],
+            },
+        }],
+    }],
+}
+
+
+def setup_ngrok(port: int, webhook_initialize_string: str):
+    from pyngrok import ngrok
+
+    ngrok.set_auth_token(NGROK_AUTH_TOKEN)
+
+    public_url = ngrok.connect(str(port))
+    logger.info(
+        f" * %s", public_url)
+    logger.info(" * Use %s as the webhook verify token",
+                webhook_initialize_string)
+
 
 class ConversationHandler(BaseInterface, ABC):
-    queue: Queue[Message] = Queue()
+    queue: Queue[Message]
     url = "https://graph.facebook.com/v20.0"
 
     token: str = TOKEN
@@ -40,10 +90,46 @@ class ConversationHandler(BaseInterface, ABC):
             start_proxy=True,
             media_root: str = "media",
             webhook_initialize_string="token",
+            send_workers: int = 4,
+            send_max_retries: int = 5,
+            max_media_bytes: int = 1024 ** 3,
+            coalesce_window_ms: int = 0,
+            coalesce_max_messages: int = 10,
+            admission_control: Optional[AdmissionController] = None,
+            max_concurrency: Optional[int] = None,
+            record_webhooks: Optional[str] = None,
     ):
+        self.queue = Queue()
+        self._local = threading.local()
+        # Set once warm-up has finished, reported on GET /ready
+        self.ready = threading.Event()
+        self.record_webhooks = record_webhooks
+        self.use_executor(executor, max_concurrency)
         self.media_root = media_root
+        self.media_store = MediaStore(media_root, max_media_bytes)
+        self.upload_cache = UploadCache(getattr(self, "datastore", None))
         self.start_proxy = start_proxy
         self.webhook_initialize_string = webhook_initialize_string
+        self.scheduler = Scheduler()
+        self.dispatcher = SendDispatcher(
+            self.send,
+            datastore=getattr(self, "datastore", None),
+            max_workers=send_workers,
+            max_retries=send_max_retries,
+            phone_number_id=self.whatsapp_number,
+        )
+        self.coalescer = MessageCoalescer(
+            self._handle_messages,
+            self._submit,
+            window_ms=coalesce_window_ms,
+            max_messages=coalesce_max_messages,
+        )
+        self.admission_control = admission_control
+        self.broadcasts: List[Broadcast] = []
+        self._broadcasts_lock = threading.Lock()
+        self.scheduler.every(60, self._prune_broadcasts)
+        if admission_control:
+            self.scheduler.every(1, self._readmit_deferred)
 
         if not self.whatsapp_number:
             raise ValueError(
@@ -54,38 +140,144 @@ class ConversationHandler(BaseInterface, ABC):
     def _handle_new_message(self):
         logger.debug("Listening for new messages...")
         while True:
-            print("NEW MESSAGE")
             message = self.queue.get(block=True)
-            executor.submit(lambda: self.on_message(message))
-            print("MESSAGE PROCESSED")
+            self._admit(message)
+
+    def _submit(self, func):
+        if self.gate:
+            self.gate.submit(func)
+        else:
+            self.executor.submit(func)
+
+    def use_executor(self, shared_executor, max_concurrency: Optional[int] = None):
+        """Runs message handling on a shared pool, capped at `max_concurrency`."""
+        self.executor = shared_executor
+        self.gate = (
+            ConcurrencyGate(shared_executor, max_concurrency)
+            if max_concurrency else None
+        )
+
+    def use_media_store(self, media_store: MediaStore):
+        """Shares a media cache with other handlers using the same media root."""
+        self.media_store = media_store
+
+    def use_datastore(self, datastore: BaseDatastore):
+        """Points the handler and its caches at a (possibly shared) datastore."""
+        self.datastore = datastore
+        self.dispatcher.datastore = datastore
+        self.upload_cache.datastore = datastore
+
+    def _load(self):
+        return {
+            "queue_depth": self.queue.qsize() + self.coalescer.backlog(),
+            "llm_in_flight": getattr(self, "llm_in_flight", 0),
+        }
+
+    def _is_overloaded(self, message: Optional[Message] = None) -> bool:
+        queue_age = 0.0
+        if message is not None:
+            queue_age = time.time() - int(message.message.timestamp)
+
+        return self.admission_control.is_overloaded(
+            queue_age=queue_age, **self._load())
+
+    def _admit(self, message: Message):
+        admission = self.admission_control
+        if not admission or not self._is_overloaded(message):
+            if admission:
+                admission.record_accepted()
+            self.coalescer.add(message)
+            return
+
+        # Ongoing conversations keep priority over new ones
+        datastore = getattr(self, "datastore", None)
+        if datastore and datastore.get_current_conversation(message.to, self.whatsapp_number):
+            admission.record_accepted()
+            self.coalescer.add(message)
+            return
+
+        if admission.policy == "defer" and admission.defer(message):
+            logger.debug("Deferred message from %s", message.to)
+            return
+
+        self._shed(message)
+
+    def _shed(self, message: Message):
+        logger.warning("Shedding message from %s", message.to)
+        self.admission_control.record_shed()
+        with self._dry_run([message]):
+            self.dispatch(ReplyMessage(
+                text=Text(
+                    body=self.admission_control.busy_message,
+                    preview_url=False,
+                ),
+                to=message.to,
+                type="text",
+            ))
+
+    def _readmit_deferred(self):
+        for message in self.admission_control.take_expired():
+            self._shed(message)
+
+        # Only as many as fit under the limits, the rest wait for the next tick
+        headroom = self.admission_control.headroom(**self._load())
+        for message in self.admission_control.take_ready(headroom):
+            self.coalescer.add(message)
+
+    def _handle_messages(self, messages: List[Message]):
+        with self._dry_run(messages):
+            if len(messages) == 1:
+                self.on_message(messages[0])
+            else:
+                self.on_messages(messages)
+
+    @contextmanager
+    def _dry_run(self, messages: List[Message]):
+        # Replies dispatched from this thread while handling replayed
+        # messages are dropped instead of being sent to Graph
+        self._local.dry_run = any(message.replayed for message in messages)
+        try:
+            yield
+        finally:
+            self._local.dry_run = False
 
     @abstractmethod
     def on_message(self, message: Message):
         pass
 
-    def _handle_text_message(self, change: Change, queue: Queue):
+    def on_messages(self, messages: List[Message]):
+        """Handles messages from one customer that were coalesced into a batch."""
+        for message in messages:
+            self.on_message(message)
+
+    def _handle_text_message(self, change: Change, queue: Queue, replayed: bool = False):
         if change.field == "messages":
             if change.value.messages:
                 for message in change.value.messages:
+                    # Media is queued by _handle_media_message once downloaded
+                    if message.type in MEDIA_MESSAGE_TYPES:
+                        continue
                     logger.debug("Received text message: %s", message)
                     data = Message(
                         message=message,
                         to=message.from_,
                         type=message.type,
                         contacts=change.value.contacts if change.value.contacts else [],
+                        replayed=replayed,
                     )
                     queue.put(data)
 
-    def _handle_media_message(self, change: Change, queue: Queue):
+    def _handle_media_message(self, change: Change, queue: Queue, replayed: bool = False):
         if change.field == "messages":
             if change.value.messages:
                 for message in change.value.messages:
                     logger.debug("Received media message: %s", message)
-                    if message.type in ["image", "audio", "video", "document"]:
+                    if message.type in MEDIA_MESSAGE_TYPES:
                         data = getattr(message, message.type)
                         logger.debug("Downloading media...")
                         mime_type = data.mime_type.split(";")[0]
-                        file = self._download_media(data.id, mime_type)
+                        file = self._download_media(
+                            data.id, mime_type, data.sha256)
                         message.file = file
 
                         data = Message(
@@ -93,6 +285,7 @@ class ConversationHandler(BaseInterface, ABC):
                             to=message.from_,
                             type=message.type,
                             contacts=change.value.contacts if change.value.contacts else [],
+                            replayed=replayed,
                         )
 
                         queue.put(data)
@@ -100,10 +293,86 @@ class ConversationHandler(BaseInterface, ABC):
     def _handle_status_message(self, change: Change, queue: Queue):
         if change.field == "messages":
             if change.value.statuses:
-                # Ignore for now
-                pass
+                for status in change.value.statuses:
+                    for broadcast in self.broadcasts:
+                        if broadcast.record_status(status):
+                            break
+
+    def _warm_up_steps(self) -> List[Tuple[str, Callable[[], None]]]:
+        steps = [
+            ("graph connection", self._warm_up_http),
+            ("payload validation", self._warm_up_payloads),
+        ]
+        datastore = getattr(self, "datastore", None)
+        if datastore is not None:
+            steps.append(("datastore", datastore.warm_up))
+        return steps
+
+    def warm_up(self):
+        """Pays the first-request costs up front, then marks the handler ready.
+
+        A failed step is logged and skipped, it only means that cost is paid
+        by the first message instead.
+        """
+        started = time.monotonic()
+        for name, step in self._warm_up_steps():
+            step_started = time.monotonic()
+            try:
+                step()
+            except Exception as e:
+                logger.warning("Warm-up step %s failed: %s", name, e)
+            else:
+                logger.debug("Warm-up step %s took %.2fs",
+                             name, time.monotonic() - step_started)
+        self.ready.set()
+        logger.info("Warm-up finished in %.2fs", time.monotonic() - started)
+
+    def _warm_up_http(self):
+        # Opens a pooled TLS connection to the Graph API
+        self.http.get(
+            f"{self.url}/{self.whatsapp_number}",
+            headers={
+                "Authorization": f"Bearer {self.token}"
+            },
+            timeout=10,
+        )
+
+    def _warm_up_payloads(self):
+        event = WhatsappEvent(**SAMPLE_EVENT)
+        for change in event.entry[0].changes:
+            for message in change.value.messages or []:
+                Message(
+                    message=message,
+                    to=message.from_,
+                    type=message.type,
+                    contacts=change.value.contacts or [],
+                )
+        ReplyMessage(
+            text=Text(body="warm-up", preview_url=False),
+            to="0",
+            type="text",
+        ).model_dump()
+
+    def _warm_up_before_serving(self, warm_up: bool):
+        # Runs before the server is created, so no webhook waits on a cold start
+        if warm_up:
+            self.warm_up()
+        else:
+            self.ready.set()
+
+    @property
+    def http(self):
+        return get_session()
+
+    def handle_change(self, change: Change, q: Queue, replayed: bool = False):
+        self._handle_text_message(change, q, replayed)
+        self._handle_media_message(change, q, replayed)
+        self._handle_status_message(change, q)
+
+    @staticmethod
+    def _handle_verification(request: "Request", webhook_initialize_string: str):
+        from werkzeug import Response
 
-    def _handle_verification(self, request: Request, webhook_initialize_string: str):
         hub_mode = request.args.get("hub.mode", "")
         hub_challenge = request.args.get("hub.challenge", "")
         hub_verify_token = request.args.get("hub.verify_token", "")
@@ -114,24 +383,37 @@ class ConversationHandler(BaseInterface, ABC):
             return Response("Verification failed", 403)
 
     def create_server(self, q: Queue, host: str, port: int) -> None:
+        from werkzeug import Request, Response
+        from werkzeug.serving import make_server
+        from whatsapp.replay import REPLAY_HEADER, DRY_RUN
+
         logging.info("Creating server...")
+        recorder = None
+        if self.record_webhooks:
+            from whatsapp.replay import WebhookRecorder
+            recorder = WebhookRecorder(self.record_webhooks)
 
         @Request.application
         def app(request: Request) -> Response:
-            if request.method == "GET":
+            if request.method == "GET" and request.path == "/ready":
+                if self.ready.is_set():
+                    return Response("Ready", 200)
+                return Response("Warming up", 503)
+            elif request.method == "GET":
                 logger.debug("Handling verification...")
                 return self._handle_verification(
                     request, self.webhook_initialize_string)
             elif request.method == "POST":
+                if recorder:
+                    recorder.record(request.get_data())
                 try:
                     data = request.get_json()
                     data = WhatsappEvent(**data)
-                    data = data.entry[0]
+                    replayed = request.headers.get(REPLAY_HEADER) == DRY_RUN
 
-                    for change in data.changes:
-                        self._handle_text_message(change, q)
-                        self._handle_media_message(change, q)
-                        self._handle_status_message(change, q)
+                    for entry in data.entry:
+                        for change in entry.changes:
+                            self.handle_change(change, q, replayed)
                     return Response("Received", 200)
 
                 except Exception as e:
@@ -153,16 +435,16 @@ class ConversationHandler(BaseInterface, ABC):
         server.serve_forever()
 
     def _setup_ngrok(self, port: int):
-        ngrok.set_auth_token(NGROK_AUTH_TOKEN)
+        setup_ngrok(port, self.webhook_initialize_string)
 
-        public_url = ngrok.connect(str(port))
-        logger.info(
-            f" * %s", public_url)
-        logger.info(" * Use %s as the webhook verify token",
-                    self.webhook_initialize_string)
+    def _download_media(self, media_id: str, mime_type: str, sha256: Optional[str] = None):
+        if sha256:
+            cached = self.media_store.get(sha256)
+            if cached:
+                logger.debug("Media %s served from cache", media_id)
+                return cached
 
-    def _download_media(self, media_id: str, mime_type: str):
-        response = requests.get(
+        response = self.http.get(
             f"{self.url}/{media_id}",
             headers={
                 "Authorization": f"Bearer {self.token}"
@@ -170,36 +452,41 @@ class ConversationHandler(BaseInterface, ABC):
         )
 
         url = response.json()["url"]
-        filename = Path(f"{self.media_root}") / \
-            f"{media_id}{mime_to_extension[mime_type]}"
-        filename.parent.mkdir(parents=True, exist_ok=True)
+        extension = mime_to_extension[mime_type]
 
-        response = requests.get(
+        response = self.http.get(
             url,
             headers={
                 "Authorization": f"Bearer {self.token}"
             }
         )
 
+        if sha256:
+            return self.media_store.put(sha256, extension, response.content)
+
+        filename = Path(f"{self.media_root}") / f"{media_id}{extension}"
+        filename.parent.mkdir(parents=True, exist_ok=True)
         with open(filename, "wb") as file:
             file.write(response.content)
 
         return filename
 
     def _upload_media(self, phone_number_id: str, filename: str, mime_type: str):
-        response = requests.post(
-            f"{self.url}/{phone_number_id}/media",
-            headers={
-                "Authorization": f"Bearer {self.token}"
-            },
-            data={
-                "type": mime_type,
-                "messaging_product": "whatsapp",
-            },
-            files={
-                "file": (filename, open(filename, "rb"), mime_type)
-            }
-        )
+        with open(filename, "rb") as file:
+            response = self.http.post(
+                f"{self.url}/{phone_number_id}/media",
+                headers={
+                    "Authorization": f"Bearer {self.token}"
+                },
+                data={
+                    "type": mime_type,
+                    "messaging_product": "whatsapp",
+                },
+                files={
+                    "file": (filename, file, mime_type)
+                }
+            )
+        response.raise_for_status()
 
         data = response.json()
         logger.debug("Media uploaded: %s", data)
@@ -207,17 +494,24 @@ class ConversationHandler(BaseInterface, ABC):
 
     def send(self, message: ReplyMessage):
         # Check if message has media and upload it
+        uploaded = None
         if message.type in ["audio", "video", "document", "image", "sticker"]:
             media = getattr(message, message.type)
-            filename_id = self._upload_media(
-                self.whatsapp_number, media.file, media.mime_type)
+            digest = self.upload_cache.file_digest(media.file)
+            uploaded = (self.whatsapp_number, digest, media.mime_type)
+
+            filename_id = self.upload_cache.get(*uploaded)
+            if not filename_id:
+                filename_id = self._upload_media(
+                    self.whatsapp_number, media.file, media.mime_type)
+                self.upload_cache.put(*uploaded, filename_id)
             media.id = filename_id
 
             del media.file
             del media.mime_type
             setattr(message, message.type, media)
 
-        response = requests.post(
+        response = self.http.post(
             f"{self.url}/{self.whatsapp_number}/messages",
             headers={
                 "Content-Type": "application/json",
@@ -227,10 +521,44 @@ class ConversationHandler(BaseInterface, ABC):
         )
 
         logger.debug("Message sent: %s", message)
-        logger.debug("Response: %s", response.json())
-        return True
-
-    def start(self, port: int = 5000, host="localhost"):
-        with executor:
-            executor.submit(self._handle_new_message)
-            executor.submit(lambda: self.create_server(self.queue, host, port))
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        logger.debug("Response: %s", data)
+
+        if not response.ok and uploaded and is_media_error(data.get("error", {})):
+            # The cached media id expired early, upload again next time
+            self.upload_cache.invalidate(*uploaded)
+        return response.ok
+
+    def broadcast(self, template: Template, recipients: Iterable[str], **options) -> BroadcastResult:
+        """Sends a template to every recipient, see `whatsapp.broadcast.Broadcast`.
+
+        Blocks until every recipient has been tried. Delivery statuses keep
+        being added to the returned result as they arrive on the webhook.
+        """
+        broadcast = Broadcast(self, template, **options)
+        with self._broadcasts_lock:
+            self.broadcasts = self.broadcasts + [broadcast]
+        return broadcast.run(recipients)
+
+    def _prune_broadcasts(self):
+        # The list is replaced rather than edited, the webhook iterates it
+        with self._broadcasts_lock:
+            self.broadcasts = [b for b in self.broadcasts if not b.is_expired()]
+
+    def dispatch(self, message: ReplyMessage):
+        """Queues a message on the outbound dispatcher instead of sending inline."""
+        if getattr(self._local, "dry_run", False):
+            logger.debug("Dry run, not sending reply to %s", message.to)
+            return
+        self.dispatcher.submit(message)
+
+    def start(self, port: int = 5000, host="localhost", warm_up: bool = True):
+        self._warm_up_before_serving(warm_up)
+        self.dispatcher.restore()
+        self.scheduler.start()
+        with self.executor:
+            self.executor.submit(self._handle_new_message)
+            self.executor.submit(lambda: self.create_server(self.queue, host, port))
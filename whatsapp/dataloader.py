@@ -0,0 +1,104 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Iterable, List, Literal, Mapping, Optional, TypeVar
+
+from whatsapp._turn import current_turn
+
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class DataLoader(Generic[K, V]):
+    """Fetches records for instruction tools in batches and caches them.
+
+    `fetch` receives a list of keys and returns a mapping of key to record;
+    keys it leaves out load as None. Records are cached for the current turn
+    or, with `scope="conversation"`, for the whole conversation, so a tool
+    asking again for a product it already saw costs nothing.
+
+        products = DataLoader(lambda ids: {p.id: p for p in Products.from_ids(ids)})
+
+        @instruction
+        def create_payment_link(self, email: str, product_ids: List[str]):
+            total = sum(p.price for p in products.load_many(product_ids))
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[List[K]], Mapping[K, V]],
+            scope: Literal["turn", "conversation"] = "turn",
+            max_batch_size: int = 100,
+            max_scopes: int = 1000,
+    ):
+        self.fetch = fetch
+        self.scope = scope
+        self.max_batch_size = max_batch_size
+        self.max_scopes = max_scopes
+
+        self._lock = threading.Lock()
+        self._caches: "OrderedDict[Hashable, Dict[K, Optional[V]]]" = OrderedDict()
+        self.batches = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _cache(self) -> Dict[K, Optional[V]]:
+        turn = current_turn()
+        if turn is None:
+            # Outside a turn there is nothing to scope the cache to
+            return {}
+
+        key = turn.id if self.scope == "turn" else turn.conversation_id
+        with self._lock:
+            cache = self._caches.get(key)
+            if cache is None:
+                cache = self._caches[key] = {}
+                while len(self._caches) > self.max_scopes:
+                    self._caches.popitem(last=False)
+            self._caches.move_to_end(key)
+            return cache
+
+    def load(self, key: K) -> Optional[V]:
+        return self.load_many([key])[0]
+
+    def load_many(self, keys: Iterable[K]) -> List[Optional[V]]:
+        """Loads records in the order of `keys`, fetching the missing ones together."""
+        keys = list(keys)
+        cache = self._cache()
+
+        # A key asked for twice in one call is fetched once and counted once
+        unique = list(dict.fromkeys(keys))
+        missing = [key for key in unique if key not in cache]
+        with self._lock:
+            self.hits += len(unique) - len(missing)
+            self.misses += len(missing)
+
+        for start in range(0, len(missing), self.max_batch_size):
+            batch = missing[start:start + self.max_batch_size]
+            records = self.fetch(batch)
+            with self._lock:
+                self.batches += 1
+            for key in batch:
+                cache[key] = records.get(key)
+
+        logger.debug("Loaded %d keys, fetched %d", len(keys), len(missing))
+        return [cache[key] for key in keys]
+
+    def prime(self, key: K, value: V):
+        """Stores a record already in hand, e.g. one returned by a search."""
+        self._cache()[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._caches.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
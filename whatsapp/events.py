@@ -33,12 +33,14 @@ class Video(BaseModel):
     id: str
     sha256: str
     mime_type: str
+    caption: Optional[str] = None
 
 
 class Image(BaseModel):
     id: str
     sha256: str
     mime_type: str
+    caption: Optional[str] = None
 
 
 class Document(BaseModel):
@@ -46,19 +48,20 @@ class Document(BaseModel):
     sha256: str
     filename: str
     mime_type: str
+    caption: Optional[str] = None
 
 
 class MessageEvent(BaseModel):
     id: str
     timestamp: str
     type: MessageType
-    file: Path | None = None
+    file: Optional[Path] = None
     from_: str = Field(alias="from")
-    text: Optional[Text] | None = None
-    image: Optional[Image] | None = None
-    audio: Optional[Audio] | None = None
-    video: Optional[Video] | None = None
-    document: Optional[Document] | None = None
+    text: Optional[Text] = None
+    image: Optional[Image] = None
+    audio: Optional[Audio] = None
+    video: Optional[Video] = None
+    document: Optional[Document] = None
 
 
 class Profile(BaseModel):
@@ -82,7 +85,7 @@ class Origin(BaseModel):
 class Conversation(BaseModel):
     id: str
     origin: Origin
-    expiration_timestamp: str | None = None
+    expiration_timestamp: Optional[str] = None
 
 
 class Pricing(BaseModel):
@@ -96,16 +99,16 @@ class Status(BaseModel):
     status: str
     timestamp: str
     recipient_id: str
-    pricing: Pricing | None = None
-    conversation: Conversation | None = None
+    pricing: Optional[Pricing] = None
+    conversation: Optional[Conversation] = None
 
 
 class Value(BaseModel):
     metadata: Metadata
     messaging_product: str = "whatsapp"
-    statuses: Optional[List[Status]] | None = None
-    contacts: Optional[List[Contact]] | None = None
-    messages: Optional[List[MessageEvent]] | None = None
+    statuses: Optional[List[Status]] = None
+    contacts: Optional[List[Contact]] = None
+    messages: Optional[List[MessageEvent]] = None
 
 
 class Change(BaseModel):
@@ -128,3 +131,5 @@ class Message(BaseModel):
     type: MessageType
     message: MessageEvent
     contacts: List[Contact]
+    # Replayed with `whatsapp.replay` in dry-run mode, replies are not sent
+    replayed: bool = False
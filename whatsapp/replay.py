@@ -0,0 +1,219 @@
+"""Record webhook traffic and replay it against a local server.
+
+Record by starting a Conversation (or Router) with `record_webhooks="hooks.log.gz"`,
+then replay the log:
+
+    python -m whatsapp.replay hooks.log.gz --url http://localhost:5000 --speed 10
+    python -m whatsapp.replay hooks.log.gz --speed max --customers 1000
+
+Message timestamps are moved to the time they are replayed, so admission
+control sees fresh traffic. Replies to replayed traffic are dropped by the
+server unless `--send-replies` is given.
+"""
+import gzip
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from whatsapp.utils import percentile
+from whatsapp._http import get_session
+
+# Marks replayed requests whose replies the server should not send
+REPLAY_HEADER = "X-Whatsapp-Replay"
+DRY_RUN = "dry-run"
+
+
+class WebhookRecorder:
+    """Appends raw webhook bodies to a gzipped JSON-lines log.
+
+    Each line holds the seconds since recording started and the raw body.
+    Appending to an existing log carries on from its last offset.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._started = time.monotonic() - _last_offset(path)
+        self._file = gzip.open(path, "at")
+
+    def record(self, body: bytes):
+        line = json.dumps({
+            "t": round(time.monotonic() - self._started, 4),
+            "body": body.decode(),
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_log(path: str) -> Iterator[Tuple[float, str]]:
+    with gzip.open(path, "rt") as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry["t"], entry["body"]
+
+
+def _last_offset(path: str) -> float:
+    last = 0.0
+    if not Path(path).exists():
+        return last
+    try:
+        for offset, _ in read_log(path):
+            last = offset
+    except (EOFError, OSError, ValueError):
+        # The tail of a log whose writer was killed
+        pass
+    return last
+
+
+def retime(body: str, timestamp: int) -> str:
+    """Moves every message and status in a webhook body to `timestamp`."""
+    event = json.loads(body)
+    for entry in event.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for item in (value.get("messages") or []) + (value.get("statuses") or []):
+                if "timestamp" in item:
+                    item["timestamp"] = str(timestamp)
+    return json.dumps(event)
+
+
+def rewrite_customer(body: str, customer_id: str, suffix: str) -> str:
+    """Moves every message and status in a webhook body to `customer_id`."""
+    event = json.loads(body)
+    for entry in event.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for contact in value.get("contacts") or []:
+                contact["wa_id"] = customer_id
+            for message in value.get("messages") or []:
+                message["from"] = customer_id
+                message["id"] = f"{message['id']}.{suffix}"
+            for status in value.get("statuses") or []:
+                status["recipient_id"] = customer_id
+    return json.dumps(event)
+
+
+def synthetic_customer(index: int) -> str:
+    return f"1555{index:07d}"
+
+
+class Replayer:
+    def __init__(
+            self,
+            url: str,
+            speed: Optional[float],
+            customers: int = 0,
+            concurrency: int = 32,
+            send_replies: bool = False,
+    ):
+        self.url = url
+        self.speed = speed
+        self.customers = customers
+        self.concurrency = concurrency
+        self.send_replies = send_replies
+
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.accepted = 0
+        self.errors = 0
+
+    def _post(self, body: str):
+        headers = {"Content-Type": "application/json"}
+        if not self.send_replies:
+            headers[REPLAY_HEADER] = DRY_RUN
+        body = retime(body, int(time.time()))
+
+        start = time.monotonic()
+        try:
+            response = get_session().post(self.url, data=body, headers=headers)
+            ok = response.ok
+        except Exception:
+            ok = False
+
+        with self._lock:
+            self.latencies.append(time.monotonic() - start)
+            if ok:
+                self.accepted += 1
+            else:
+                self.errors += 1
+
+    def _bodies(self, path: str) -> Iterator[Tuple[float, str]]:
+        for offset, body in read_log(path):
+            if not self.customers:
+                yield offset, body
+                continue
+            for i in range(self.customers):
+                yield offset, rewrite_customer(body, synthetic_customer(i), str(i))
+
+    def run(self, path: str):
+        # Keep the backlog bounded when replaying at max speed
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def post(body: str):
+            try:
+                self._post(body)
+            finally:
+                slots.release()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for offset, body in self._bodies(path):
+                if self.speed:
+                    delay = offset / self.speed - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                slots.acquire()
+                executor.submit(post, body)
+        return time.monotonic() - started
+
+    def report(self, elapsed: float) -> str:
+        total = self.accepted + self.errors
+        lines = [
+            f"requests:      {total}",
+            f"elapsed:       {elapsed:.2f}s",
+            f"accepted rate: {self.accepted / elapsed if elapsed else 0:.1f}/s",
+            f"error rate:    {self.errors / total if total else 0:.2%}",
+        ]
+        for q in (50, 90, 99):
+            lines.append(f"latency p{q}:   {percentile(self.latencies, q) * 1000:.1f}ms")
+        lines.append(f"latency max:   {max(self.latencies, default=0) * 1000:.1f}ms")
+        return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m whatsapp.replay",
+        description="Replay recorded webhooks against a local server.",
+    )
+    parser.add_argument("log", help="log written with record_webhooks")
+    parser.add_argument("--url", default="http://localhost:5000",
+                        help="webhook url of the server under test")
+    parser.add_argument("--speed", default="1",
+                        help="replay speed multiplier, e.g. 1, 10 or max")
+    parser.add_argument("--customers", type=int, default=0,
+                        help="fan every webhook out to N synthetic customers")
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="maximum requests in flight")
+    parser.add_argument("--send-replies", action="store_true",
+                        help="let the server send its replies to Graph")
+    args = parser.parse_args(argv)
+
+    speed = None if args.speed == "max" else float(args.speed)
+    replayer = Replayer(
+        args.url, speed, args.customers, args.concurrency, args.send_replies)
+    elapsed = replayer.run(args.log)
+    print(replayer.report(elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,33 +12,33 @@ class Text(BaseModel):
 class Audio(BaseModel):
     file: str
     mime_type: str
-    id: str | None = None
-    link: str | None = None
+    id: Optional[str] = None
+    link: Optional[str] = None
 
 
 class Video(BaseModel):
     file: str
     mime_type: str
-    id: str | None = None
-    link: str | None = None
-    caption: str | None = None
+    id: Optional[str] = None
+    link: Optional[str] = None
+    caption: Optional[str] = None
 
 
 class Document(BaseModel):
     file: str
     mime_type: str
-    id: str | None = None
-    link: str | None = None
-    caption: str | None = None
-    filename: str | None = None
+    id: Optional[str] = None
+    link: Optional[str] = None
+    caption: Optional[str] = None
+    filename: Optional[str] = None
 
 
 class Image(BaseModel):
     file: str
     mime_type: str
-    id: str | None = None
-    link: str | None = None
-    caption: str | None = None
+    id: Optional[str] = None
+    link: Optional[str] = None
+    caption: Optional[str] = None
 
 
 class Context(BaseModel):
@@ -48,17 +48,17 @@ class Context(BaseModel):
 class Sticker(BaseModel):
     file: str
     mime_type: str
-    id: str | None = None
-    link: str | None = None
+    id: Optional[str] = None
+    link: Optional[str] = None
 
 
 class Message(BaseModel):
     to: str
     type: MessageType
-    text: Text | None = None
-    audio: Audio | None = None
-    video: Video | None = None
-    image: Image | None = None
-    document: Document | None = None
+    text: Optional[Text] = None
+    audio: Optional[Audio] = None
+    video: Optional[Video] = None
+    image: Optional[Image] = None
+    document: Optional[Document] = None
     messaging_product: str = "whatsapp"
-    context: Optional[Context] | None = None
+    context: Optional[Context] = None
@@ -0,0 +1,147 @@
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from whatsapp.events import WhatsappEvent
+from whatsapp._media import MediaStore
+from whatsapp._datastore import BaseDatastore
+from whatsapp.conversation_handler import ConversationHandler, setup_ngrok
+
+
+logger = logging.getLogger(__name__)
+
+
+class Router:
+    """Serves several WhatsApp numbers from one process and one webhook.
+
+    Each change in a webhook is dispatched to the tenant whose
+    `whatsapp_number` matches `value.metadata.phone_number_id`. Tenants share
+    the HTTP connection pool, one worker pool and, when given, one datastore,
+    where conversations and pending sends are kept apart by number. Tenants
+    with the same `media_root` share one media cache. `max_concurrency` caps
+    how many of the shared workers a single tenant can occupy, so a noisy
+    tenant cannot starve the others.
+
+        router = Router(datastore=SQLiteDatastore("bots.db"))
+        router.add(RestaurantBot(start_proxy=False), max_concurrency=8)
+        router.add(PharmacyBot(start_proxy=False), max_concurrency=4)
+        router.start(5000)
+    """
+
+    def __init__(
+            self,
+            max_workers: int = 32,
+            datastore: Optional[BaseDatastore] = None,
+            start_proxy: bool = False,
+            webhook_initialize_string: str = "token",
+            record_webhooks: Optional[str] = None,
+    ):
+        self.datastore = datastore
+        self.record_webhooks = record_webhooks
+        self.start_proxy = start_proxy
+        self.webhook_initialize_string = webhook_initialize_string
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="whatsapp-worker")
+        self.tenants: Dict[str, ConversationHandler] = {}
+        # One store per media root, separate stores would evict each other's files
+        self.media_stores: Dict[Path, MediaStore] = {}
+
+    def add(self, tenant: ConversationHandler, max_concurrency: Optional[int] = None):
+        if tenant.whatsapp_number in self.tenants:
+            raise ValueError(
+                f"A tenant is already registered for {tenant.whatsapp_number}")
+
+        tenant.use_executor(self.executor, max_concurrency)
+        if self.datastore is not None:
+            tenant.use_datastore(self.datastore)
+
+        media_root = Path(tenant.media_root).resolve()
+        if media_root in self.media_stores:
+            tenant.use_media_store(self.media_stores[media_root])
+        else:
+            self.media_stores[media_root] = tenant.media_store
+
+        self.tenants[tenant.whatsapp_number] = tenant
+        return tenant
+
+    def route(self, event: WhatsappEvent, replayed: bool = False):
+        for entry in event.entry:
+            for change in entry.changes:
+                phone_number_id = change.value.metadata.phone_number_id
+                tenant = self.tenants.get(phone_number_id)
+                if tenant is None:
+                    logger.warning(
+                        "No tenant registered for %s", phone_number_id)
+                    continue
+                tenant.handle_change(change, tenant.queue, replayed)
+
+    def create_server(self, host: str, port: int) -> None:
+        from werkzeug import Request, Response
+        from werkzeug.serving import make_server
+        from whatsapp.replay import REPLAY_HEADER, DRY_RUN
+
+        recorder = None
+        if self.record_webhooks:
+            from whatsapp.replay import WebhookRecorder
+            recorder = WebhookRecorder(self.record_webhooks)
+
+        @Request.application
+        def app(request: Request) -> Response:
+            if request.method == "GET" and request.path == "/ready":
+                if all(t.ready.is_set() for t in self.tenants.values()):
+                    return Response("Ready", 200)
+                return Response("Warming up", 503)
+            elif request.method == "GET":
+                return ConversationHandler._handle_verification(
+                    request, self.webhook_initialize_string)
+            elif request.method == "POST":
+                if recorder:
+                    recorder.record(request.get_data())
+                try:
+                    self.route(
+                        WhatsappEvent(**request.get_json()),
+                        replayed=request.headers.get(REPLAY_HEADER) == DRY_RUN,
+                    )
+                    return Response("Received", 200)
+                except Exception as e:
+                    logger.error("Error: %s", e)
+                    return Response("Error", 500)
+            return Response("", 200)
+
+        if self.start_proxy:
+            setup_ngrok(port, self.webhook_initialize_string)
+
+        server = make_server(
+            host, port, app,
+            threaded=True, processes=1
+        )
+        server.serve_forever()
+
+    def start(self, port: int = 5000, host="localhost", warm_up: bool = True):
+        logger.info("Starting router for %d numbers", len(self.tenants))
+        # Tenants warm up side by side, the server starts once all are done
+        warm_ups = [
+            threading.Thread(
+                target=tenant._warm_up_before_serving,
+                args=(warm_up,),
+                name=f"whatsapp-warm-up-{tenant.whatsapp_number}",
+            )
+            for tenant in self.tenants.values()
+        ]
+        for thread in warm_ups:
+            thread.start()
+        for thread in warm_ups:
+            thread.join()
+
+        for tenant in self.tenants.values():
+            tenant.dispatcher.restore()
+            tenant.scheduler.start()
+            threading.Thread(
+                target=tenant._handle_new_message,
+                name=f"whatsapp-inbox-{tenant.whatsapp_number}",
+                daemon=True,
+            ).start()
+
+        self.create_server(host, port)
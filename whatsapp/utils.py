@@ -1,3 +1,16 @@
+from typing import Sequence
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """Returns the q-th percentile (0-100) of samples using nearest rank."""
+    if not samples:
+        return 0.0
+
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
 mime_to_extension = {
     "audio/ogg": ".ogg",
     "audio/mpeg": ".mp3",
@@ -0,0 +1,408 @@
+"""In-process vector index for retrieval tools.
+
+Embeddings live in a memory-mapped matrix on disk, so a catalogue of a few
+thousand items loads instantly and a query is a single matrix-vector product.
+
+    index = VectorIndex("products.index", embed=GeminiEmbedder())
+    index.upsert_texts(["1", "2"], ["Jollof rice", "Fried plantain"])
+    index.search("something with rice", k=5)  # [("1", 0.82), ("2", 0.41)]
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Generic, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError(
+        "The vector index requires numpy, install it with "
+        "`pip install whatsapp-framework[vector]`"
+    ) from e
+
+if TYPE_CHECKING:
+    from whatsapp._scheduler import Scheduler
+
+
+logger = logging.getLogger(__name__)
+
+Embedder = Callable[..., Sequence[Sequence[float]]]
+T = TypeVar("T")
+
+
+class GeminiEmbedder:
+    """Embeds texts with a Gemini embedding model."""
+
+    def __init__(
+            self,
+            model_name: str = "models/text-embedding-004",
+            api_key: str = os.environ.get("GEMINI_API_KEY", ""),
+            batch_size: int = 100,
+    ):
+        self.model_name = model_name
+        self.api_key = api_key
+        self.batch_size = batch_size
+
+    def __call__(self, texts: Sequence[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        import google.generativeai as genai
+
+        if self.api_key:
+            genai.configure(api_key=self.api_key)
+
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            res = genai.embed_content(
+                model=self.model_name,
+                content=list(texts[start:start + self.batch_size]),
+                task_type=task_type,
+            )
+            embeddings.extend(res["embedding"])
+        return embeddings
+
+
+class VectorIndex:
+    """Cosine similarity index backed by a memory-mapped NumPy matrix.
+
+    Vectors are normalized when they are added, so a query is a dot product
+    followed by a partial sort. With `quantize=True` rows are stored as int8
+    with one scale per row, a quarter of the float32 size, at a small cost in
+    precision. The index is saved under the `path` directory on every
+    `upsert` and `delete`; updating existing ids writes the rows in place,
+    new ids rewrite the matrix. `upsert(..., flush=False)` holds new ids
+    back, unsearchable, until `flush()`, so a bulk load rewrites it once.
+    """
+
+    def __init__(self, path: str, embed: Optional[Embedder] = None, quantize: bool = False):
+        self.path = Path(path)
+        self.embed = embed
+        self.quantize = quantize
+        self._lock = threading.Lock()
+
+        self._ids: List[str] = []
+        self._positions: dict = {}
+        self._matrix: Optional["np.ndarray"] = None
+        self._scales: Optional["np.ndarray"] = None
+        # New rows waiting for flush(), by id
+        self._pending: Dict[str, Tuple["np.ndarray", Optional["np.ndarray"]]] = {}
+        self._load()
+
+    @property
+    def _ids_file(self):
+        return self.path / "ids.json"
+
+    @property
+    def _matrix_file(self):
+        return self.path / "vectors.npy"
+
+    @property
+    def _scales_file(self):
+        return self.path / "scales.npy"
+
+    def _load(self):
+        if not self._ids_file.exists():
+            return
+
+        with open(self._ids_file) as file:
+            meta = json.load(file)
+        if meta["quantize"] != self.quantize:
+            raise ValueError(
+                f"{self.path} was built with quantize={meta['quantize']}")
+
+        self._ids = meta["ids"]
+        self._positions = {id: i for i, id in enumerate(self._ids)}
+        self._matrix = np.load(self._matrix_file, mmap_mode="r+")
+        if self.quantize:
+            self._scales = np.load(self._scales_file, mmap_mode="r+")
+
+        if len(self._matrix) != len(self._ids):
+            raise ValueError(f"{self.path} is corrupt, ids and vectors differ in length")
+
+    def _save(self, ids: List[str], matrix: "np.ndarray", scales: Optional["np.ndarray"]):
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # Write next to the live files and swap them in, so readers holding
+        # the old memory map keep a consistent view
+        np.save(f"{self._matrix_file}.tmp.npy", matrix)
+        os.replace(f"{self._matrix_file}.tmp.npy", self._matrix_file)
+        if scales is not None:
+            np.save(f"{self._scales_file}.tmp.npy", scales)
+            os.replace(f"{self._scales_file}.tmp.npy", self._scales_file)
+
+        tmp = f"{self._ids_file}.tmp"
+        with open(tmp, "w") as file:
+            json.dump({"quantize": self.quantize, "ids": ids}, file)
+        os.replace(tmp, self._ids_file)
+
+        self._ids = ids
+        self._positions = {id: i for i, id in enumerate(ids)}
+        self._matrix = np.load(self._matrix_file, mmap_mode="r+")
+        self._scales = np.load(self._scales_file, mmap_mode="r+") if scales is not None else None
+
+    def _encode(self, vectors) -> Tuple["np.ndarray", Optional["np.ndarray"]]:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError("Expected a 2-D array of vectors")
+        if self._matrix is not None and vectors.shape[1] != self._matrix.shape[1]:
+            raise ValueError(
+                f"Expected vectors of dimension {self._matrix.shape[1]}, got {vectors.shape[1]}")
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        if not self.quantize:
+            return vectors, None
+
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        rows = np.round(vectors / scales[:, None]).astype(np.int8)
+        return rows, scales.astype(np.float32)
+
+    def upsert(self, ids: Sequence[str], vectors, flush: bool = True) -> None:
+        """Adds vectors, replacing any already stored under the same id.
+
+        With `flush=False` new ids are kept in memory until `flush()`.
+        """
+        ids = [str(id) for id in ids]
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        if not ids:
+            return
+
+        rows, scales = self._encode(vectors)
+
+        with self._lock:
+            # The last vector wins when an id is repeated
+            latest = {id: i for i, id in enumerate(ids)}
+            existing = [(self._positions[id], i) for id, i in latest.items() if id in self._positions]
+            new = [i for id, i in latest.items() if id not in self._positions]
+
+            if existing:
+                targets, sources = map(list, zip(*existing))
+                self._matrix[targets] = rows[sources]
+                if scales is not None:
+                    self._scales[targets] = scales[sources]
+
+            for i in new:
+                self._pending[ids[i]] = (rows[i], scales[i] if scales is not None else None)
+
+            if flush:
+                self._flush()
+
+        logger.debug("Upserted %d vectors (%d new)", len(latest), len(new))
+
+    def flush(self) -> None:
+        """Writes rows held back by `upsert(..., flush=False)` to disk."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # Must be called with the lock held
+        if self._pending:
+            ids = list(self._pending)
+            rows = np.stack([row for row, _ in self._pending.values()])
+            scales = (
+                np.stack([scale for _, scale in self._pending.values()])
+                if self.quantize else None
+            )
+            if self._matrix is not None:
+                rows = np.concatenate([self._matrix, rows])
+                if scales is not None:
+                    scales = np.concatenate([self._scales, scales])
+            self._save(self._ids + ids, rows, scales)
+            self._pending.clear()
+        elif self._matrix is not None:
+            self._matrix.flush()
+            if self._scales is not None:
+                self._scales.flush()
+
+    def upsert_texts(self, ids: Sequence[str], texts: Sequence[str], flush: bool = True) -> None:
+        if self.embed is None:
+            raise ValueError("upsert_texts needs the index to be created with `embed`")
+        if texts:
+            self.upsert(ids, self.embed(texts, task_type="retrieval_document"), flush)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        with self._lock:
+            held = [str(id) for id in ids if self._pending.pop(str(id), None) is not None]
+            drop = {self._positions[str(id)] for id in ids if str(id) in self._positions}
+            if not drop:
+                return len(held)
+
+            keep = [i for i in range(len(self._ids)) if i not in drop]
+            self._save(
+                [self._ids[i] for i in keep],
+                self._matrix[keep],
+                self._scales[keep] if self._scales is not None else None,
+            )
+            return len(drop) + len(held)
+
+    def query(self, vector, k: int = 5) -> List[Tuple[str, float]]:
+        """Returns up to `k` (id, cosine similarity) pairs, best first."""
+        with self._lock:
+            ids, matrix, scales = self._ids, self._matrix, self._scales
+        if matrix is None or not ids:
+            return []
+
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        scores = matrix @ query
+        if scales is not None:
+            scores = scores * scales
+
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[i], float(scores[i])) for i in top]
+
+    def search(self, text: str, k: int = 5) -> List[Tuple[str, float]]:
+        if self.embed is None:
+            raise ValueError("search needs the index to be created with `embed`")
+        return self.query(self.embed([text], task_type="retrieval_query")[0], k)
+
+    def ids(self) -> List[str]:
+        return self._ids + list(self._pending)
+
+    def __contains__(self, id: str) -> bool:
+        return str(id) in self._positions or str(id) in self._pending
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._pending)
+
+
+@dataclass
+class SyncResult:
+    added: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+
+class CatalogueSync(Generic[T]):
+    """Keeps a VectorIndex in step with a catalogue, embedding only what changed.
+
+    Each record's text is fingerprinted and the fingerprints are kept next to
+    the index, so a run embeds new and edited records in batches, deletes
+    records that are gone and skips the rest.
+
+        sync = CatalogueSync(index, Products.all,
+                             key=lambda p: str(p.id), text=lambda p: p.name)
+        sync.schedule(conversation.scheduler, 40)
+    """
+
+    def __init__(
+            self,
+            index: VectorIndex,
+            load: Callable[[], Iterable[T]],
+            key: Callable[[T], str],
+            text: Callable[[T], str],
+            batch_size: int = 100,
+    ):
+        self.index = index
+        self.load = load
+        self.key = key
+        self.text = text
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._trigger_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running: Optional["Future[SyncResult]"] = None
+
+    @property
+    def _fingerprints_file(self):
+        return self.index.path / "fingerprints.json"
+
+    def _load_fingerprints(self) -> Dict[str, str]:
+        if not self._fingerprints_file.exists():
+            return {}
+        with open(self._fingerprints_file) as file:
+            return json.load(file)
+
+    def _save_fingerprints(self, fingerprints: Dict[str, str]):
+        self.index.path.mkdir(parents=True, exist_ok=True)
+        tmp = f"{self._fingerprints_file}.tmp"
+        with open(tmp, "w") as file:
+            json.dump(fingerprints, file)
+        os.replace(tmp, self._fingerprints_file)
+
+    def run(self) -> SyncResult:
+        # Overlapping runs would embed the same changes twice
+        with self._lock:
+            return self._sync()
+
+    def _sync(self) -> SyncResult:
+        result = SyncResult()
+        fingerprints = self._load_fingerprints()
+
+        current: Dict[str, Tuple[str, str]] = {}
+        for record in self.load():
+            text = self.text(record)
+            current[str(self.key(record))] = (
+                text, hashlib.sha256(text.encode()).hexdigest())
+
+        changed = [
+            id for id, (_, fingerprint) in current.items()
+            if fingerprints.get(id) != fingerprint or id not in self.index
+        ]
+        result.unchanged = len(current) - len(changed)
+
+        try:
+            for start in range(0, len(changed), self.batch_size):
+                batch = changed[start:start + self.batch_size]
+                self.index.upsert_texts(
+                    batch, [current[id][0] for id in batch], flush=False)
+                for id in batch:
+                    if id in fingerprints:
+                        result.updated += 1
+                    else:
+                        result.added += 1
+                    fingerprints[id] = current[id][1]
+        finally:
+            # The index is written once per run, and what was embedded before
+            # a failure is kept so the next run resumes where this one stopped
+            self.index.flush()
+            self._save_fingerprints(fingerprints)
+
+        removed = [id for id in fingerprints if id not in current]
+        removed += [id for id in self.index.ids() if id not in current and id not in fingerprints]
+        if removed:
+            self.index.delete(removed)
+            for id in removed:
+                fingerprints.pop(id, None)
+            result.deleted = len(removed)
+            self._save_fingerprints(fingerprints)
+
+        logger.info(
+            "Catalogue sync: %d added, %d updated, %d deleted, %d unchanged",
+            result.added, result.updated, result.deleted, result.unchanged)
+        return result
+
+    def trigger(self) -> Optional["Future[SyncResult]"]:
+        """Starts a run on the sync's own thread, unless one is still going."""
+        with self._trigger_lock:
+            if self._running is not None and not self._running.done():
+                logger.debug("Catalogue sync still running, skipping")
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="whatsapp-catalogue-sync")
+            self._running = self._executor.submit(self._run_logged)
+            return self._running
+
+    def _run_logged(self) -> SyncResult:
+        try:
+            return self.run()
+        except Exception as e:
+            logger.error("Catalogue sync failed: %s", e)
+            raise
+
+    def schedule(self, scheduler: "Scheduler", seconds: float, run_now: bool = True):
+        """Triggers the sync every `seconds` from a framework Scheduler.
+
+        The scheduler only starts runs, they happen on a separate thread so
+        slow embedding calls don't hold up the scheduler's other jobs.
+        """
+        return scheduler.every(seconds, self.trigger, name="catalogue_sync", run_now=run_now)